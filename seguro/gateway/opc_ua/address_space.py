@@ -0,0 +1,558 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+
+from asyncua import Client, ua
+
+from seguro.gateway.opc_ua.logger import log_msg
+
+# Trees of a measurement device searched for signals by discovery
+DISCOVERY_ROOTS = [
+    ["0:Objects", "2:Device", "2:Measurements"],
+    ["0:Objects", "2:Device", "2:Modules"],
+]
+# Maximum depth of discovered nodes below a root
+DISCOVERY_DEPTH = 16
+# Data types of values which are stored as doubles in a frame
+NUMERIC_DATA_TYPES = {
+    ua.ObjectIds.Boolean,
+    ua.ObjectIds.SByte,
+    ua.ObjectIds.Byte,
+    ua.ObjectIds.Int16,
+    ua.ObjectIds.UInt16,
+    ua.ObjectIds.Int32,
+    ua.ObjectIds.UInt32,
+    ua.ObjectIds.Int64,
+    ua.ObjectIds.UInt64,
+    ua.ObjectIds.Float,
+    ua.ObjectIds.Double,
+    ua.ObjectIds.Number,
+    ua.ObjectIds.Integer,
+    ua.ObjectIds.UInteger,
+    ua.ObjectIds.Enumeration,
+    ua.ObjectIds.Duration,
+}
+# Status codes of requests for NodeIds the server does not know (anymore)
+STALE_NODE_ID_CODES = {
+    ua.StatusCodes.BadNodeIdUnknown,
+    ua.StatusCodes.BadNodeIdInvalid,
+}
+
+
+async def read_operation_limit(client: Client, limit: int):
+    """
+    Read an operation limit from the server capabilities of the server.
+
+    Arguments:
+        client {Client} -- Connected client
+        limit {int} -- NodeId of the operation limit, e.g.
+            ua.ObjectIds.Server_ServerCapabilities_OperationLimits_MaxNodesPerRead
+
+    Returns:
+        int -- Value of the limit, 0 if the server does not define a limit
+    """
+    try:
+        return int(await client.get_node(ua.NodeId(limit)).read_value() or 0)
+    except ua.UaStatusCodeError:
+        return 0
+
+
+async def check_data_types(client: Client, nodes: dict):
+    """
+    Check that the variables of all measurements hold numeric values, which
+    are stored as doubles in the frame. Variables of vendor specific data
+    types are accepted.
+
+    Arguments:
+        client {Client} -- Connected client
+        nodes {dict} -- Nodes as {measurement: Node}
+
+    Raises:
+        ValueError -- A variable holds values of an unsupported data type
+        ua.UaStatusCodeError -- The server does not know the NodeId of a
+            variable
+    """
+    max_nodes = await read_operation_limit(
+        client,
+        ua.ObjectIds.Server_ServerCapabilities_OperationLimits_MaxNodesPerRead,
+    )
+    batches = split_batches(list(nodes.items()), max_nodes)
+    results = await asyncio.gather(
+        *[
+            client.uaclient.read_attributes(
+                [node.nodeid for _, node in batch], ua.AttributeIds.DataType
+            )
+            for batch in batches
+        ]
+    )
+
+    unsupported = []
+    for batch, data_values in zip(batches, results):
+        for (measurement, _), data_value in zip(batch, data_values):
+            if data_value.StatusCode.value in STALE_NODE_ID_CODES:
+                log_msg(f"Unknown node of {measurement}")
+                data_value.StatusCode.check()
+            data_type = data_value.Value.Value
+            if (
+                data_type is not None
+                and data_type.NamespaceIndex == 0
+                and data_type.Identifier not in NUMERIC_DATA_TYPES
+            ):
+                name = ua.ObjectIdNames.get(
+                    data_type.Identifier, str(data_type)
+                )
+                unsupported.append(f"{measurement} ({name})")
+
+    if unsupported:
+        raise ValueError(
+            "Unsupported data type of measurements: " + ", ".join(unsupported)
+        )
+
+
+def split_batches(items: list, size: int):
+    """
+    Split a list into batches of at most size items.
+
+    Arguments:
+        items {list} -- Items to split
+        size {int} -- Maximum size of a batch, 0 for a single batch
+
+    Returns:
+        list -- List of batches
+    """
+    if size <= 0:
+        return [items]
+
+    batches = []
+    for start in range(0, len(items), size):
+        stop = start + size
+        batches.append(items[start:stop])
+    return batches
+
+
+def make_relative_path(browse_path: list):
+    """
+    Create a relative path following hierarchical references.
+
+    Arguments:
+        browse_path {list} -- Qualified names, e.g. ["0:Objects", "2:Device"]
+
+    Returns:
+        ua.RelativePath -- Relative path
+    """
+    relative_path = ua.RelativePath()
+    for name in browse_path:
+        element = ua.RelativePathElement()
+        element.ReferenceTypeId = ua.TwoByteNodeId(
+            ua.ObjectIds.HierarchicalReferences
+        )
+        element.IsInverse = False
+        element.IncludeSubtypes = True
+        element.TargetName = ua.QualifiedName.from_string(name)
+        relative_path.Elements.append(element)
+    return relative_path
+
+
+async def translate_browse_paths(client: Client, browse_paths: dict):
+    """
+    Resolve browse paths starting at the root node to NodeIds with batched
+    TranslateBrowsePathsToNodeIds requests, split by the operation limit of
+    the server.
+
+    Arguments:
+        client {Client} -- Connected client
+        browse_paths {dict} -- Browse paths as {measurement: browse path}
+
+    Returns:
+        dict -- NodeIds as {measurement: NodeId}
+    """
+    max_nodes = await read_operation_limit(
+        client,
+        ua.ObjectIds.Server_ServerCapabilities_OperationLimits_MaxNodesPerTranslateBrowsePathsToNodeIds,  # noqa: E501
+    )
+
+    measurements = list(browse_paths.keys())
+    batches = split_batches(measurements, max_nodes)
+
+    requests = []
+    for batch in batches:
+        paths = []
+        for measurement in batch:
+            path = ua.BrowsePath()
+            path.StartingNode = client.nodes.root.nodeid
+            path.RelativePath = make_relative_path(browse_paths[measurement])
+            paths.append(path)
+        requests.append(
+            client.uaclient.translate_browsepaths_to_nodeids(paths)
+        )
+
+    results = await asyncio.gather(*requests)
+
+    node_ids = {}
+    for batch, batch_results in zip(batches, results):
+        for measurement, result in zip(batch, batch_results):
+            if not result.StatusCode.is_good():
+                log_msg(
+                    f"Failed to resolve {measurement} "
+                    + f"({browse_paths[measurement]}): {result.StatusCode}"
+                )
+                result.StatusCode.check()
+
+            target = result.Targets[0].TargetId
+            node_ids[measurement] = ua.NodeId(
+                target.Identifier, target.NamespaceIndex, target.NodeIdType
+            )
+    return node_ids
+
+
+async def browse_batch(
+    client: Client, node_ids: list, max_references: int = 0
+):
+    """
+    Browse the hierarchical children of nodes with a single Browse request.
+    Continuation points are followed with BrowseNext requests until all
+    references are received.
+
+    Arguments:
+        client {Client} -- Connected client
+        node_ids {list} -- NodeIds of the nodes to browse
+        max_references {int} -- References per node and response, 0 leaves
+            the limit to the server
+
+    Returns:
+        list -- References of every node as list of ua.ReferenceDescription
+    """
+    params = ua.BrowseParameters()
+    params.RequestedMaxReferencesPerNode = max_references
+    for node_id in node_ids:
+        description = ua.BrowseDescription()
+        description.NodeId = node_id
+        description.BrowseDirection = ua.BrowseDirection.Forward
+        description.ReferenceTypeId = ua.NodeId(
+            ua.ObjectIds.HierarchicalReferences
+        )
+        description.IncludeSubtypes = True
+        description.NodeClassMask = ua.NodeClass.Object | ua.NodeClass.Variable
+        description.ResultMask = ua.BrowseResultMask.All
+        params.NodesToBrowse.append(description)
+
+    results = await client.uaclient.browse(params)
+
+    references = []
+    pending = {}
+    for i, result in enumerate(results):
+        result.StatusCode.check()
+        references.append(list(result.References))
+        if result.ContinuationPoint:
+            pending[i] = result.ContinuationPoint
+
+    while pending:
+        next_params = ua.BrowseNextParameters()
+        next_params.ReleaseContinuationPoints = False
+        next_params.ContinuationPoints = list(pending.values())
+        next_results = await client.uaclient.browse_next(next_params)
+
+        next_pending = {}
+        for i, result in zip(pending.keys(), next_results):
+            result.StatusCode.check()
+            references[i] += result.References
+            if result.ContinuationPoint:
+                next_pending[i] = result.ContinuationPoint
+        pending = next_pending
+
+    return references
+
+
+async def discover_signals(
+    client: Client, roots: list = None, max_references: int = 0
+):
+    """
+    Discover all variables below the root nodes level by level. The nodes of
+    a level are browsed with batched Browse requests, split by the operation
+    limit of the server.
+
+    Arguments:
+        client {Client} -- Connected client
+        roots {list} -- Browse paths of the root nodes, DISCOVERY_ROOTS if None
+        max_references {int} -- References per node and Browse response
+
+    Returns:
+        dict -- NodeIds of the variables as {browse path: NodeId}, browse
+            paths are comma-separated qualified names
+    """
+    roots = roots if roots is not None else DISCOVERY_ROOTS
+    max_nodes = await read_operation_limit(
+        client,
+        ua.ObjectIds.Server_ServerCapabilities_OperationLimits_MaxNodesPerBrowse,
+    )
+
+    level = []
+    for root in roots:
+        try:
+            node_ids = await translate_browse_paths(client, {"root": root})
+        except ua.UaStatusCodeError:
+            log_msg(f"Skipping discovery of missing {root}")
+            continue
+        level.append((root, node_ids["root"]))
+
+    signals = {}
+    visited = set(node_id for _, node_id in level)
+    for _ in range(DISCOVERY_DEPTH):
+        if not level:
+            break
+
+        batches = split_batches(level, max_nodes)
+        results = await asyncio.gather(
+            *[
+                browse_batch(
+                    client,
+                    [node_id for _, node_id in batch],
+                    max_references,
+                )
+                for batch in batches
+            ]
+        )
+
+        next_level = []
+        for batch, batch_references in zip(batches, results):
+            for (path, _), references in zip(batch, batch_references):
+                for reference in references:
+                    target = reference.NodeId
+                    node_id = ua.NodeId(
+                        target.Identifier,
+                        target.NamespaceIndex,
+                        target.NodeIdType,
+                    )
+                    if node_id in visited:
+                        continue
+                    visited.add(node_id)
+
+                    child = path + [reference.BrowseName.to_string()]
+                    if reference.NodeClass == ua.NodeClass.Variable:
+                        signals[",".join(child)] = node_id
+                    # Variables may have attributes as child variables
+                    next_level.append((child, node_id))
+        level = next_level
+
+    return signals
+
+
+class NodeCache:
+    """
+    The NodeCache persists resolved NodeIds in a local JSON file.
+
+    Entries are stored per device and are only valid as long as the endpoint,
+    the namespace array and build info of the server and the browse paths
+    are unchanged. As a server may change its address space without changing
+    these, e.g. after a restart, the entries of a device are dropped when the
+    server reports a cached NodeId as unknown.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __load(self):
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def __store(self, entries: dict):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+
+        # Write atomically to not corrupt the cache when interrupted
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            json.dump(entries, file)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    async def key(client: Client, url: str, browse_paths: dict):
+        """
+        Compute the cache key of a server and the browse paths. Namespace array
+        and build info are read with a single Read request.
+
+        Arguments:
+            client {Client} -- Connected client
+            url {str} -- Endpoint of the server
+            browse_paths {dict} -- Browse paths as {measurement: browse path}
+
+        Returns:
+            str -- Cache key
+        """
+        server_info = await client.uaclient.read_attributes(
+            [
+                ua.NodeId(ua.ObjectIds.Server_NamespaceArray),
+                ua.NodeId(
+                    ua.ObjectIds.Server_ServerStatus_BuildInfo_SoftwareVersion
+                ),
+                ua.NodeId(
+                    ua.ObjectIds.Server_ServerStatus_BuildInfo_BuildNumber
+                ),
+            ],
+            ua.AttributeIds.Value,
+        )
+        content = json.dumps(
+            {
+                "url": url,
+                "server": [
+                    str(data_value.Value.Value) for data_value in server_info
+                ],
+                "browse_paths": browse_paths,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def get(self, uid: str, key: str):
+        """
+        Get the cached NodeIds of a device.
+
+        Arguments:
+            uid {str} -- Unique identifier of the device
+            key {str} -- Cache key
+
+        Returns:
+            dict -- NodeIds as {measurement: NodeId}, None if not cached
+        """
+        entry = self.__load().get(uid)
+        if entry is None or entry["key"] != key:
+            return None
+
+        return {
+            measurement: ua.NodeId.from_string(node_id)
+            for measurement, node_id in entry["node_ids"].items()
+        }
+
+    def put(self, uid: str, key: str, node_ids: dict):
+        """
+        Store the NodeIds of a device.
+
+        Arguments:
+            uid {str} -- Unique identifier of the device
+            key {str} -- Cache key
+            node_ids {dict} -- NodeIds as {measurement: NodeId}
+        """
+        entries = self.__load()
+        entries[uid] = {
+            "key": key,
+            "node_ids": {
+                measurement: node_id.to_string()
+                for measurement, node_id in node_ids.items()
+            },
+        }
+        self.__store(entries)
+
+    def drop(self, uid: str):
+        """
+        Drop the NodeIds and discovered signals of a device, so they are
+        resolved again on the next connect.
+
+        Arguments:
+            uid {str} -- Unique identifier of the device
+        """
+        entries = self.__load()
+        dropped = [
+            entries.pop(entry, None) for entry in (uid, f"{uid}#signals")
+        ]
+        if any(entry is not None for entry in dropped):
+            self.__store(entries)
+
+
+async def resolve_browse_paths(
+    client: Client,
+    url: str,
+    uid: str,
+    browse_paths: dict,
+    cache: NodeCache = None,
+    discover: bool = False,
+):
+    """
+    Resolve browse paths to NodeIds, using the cache if it is still valid.
+
+    With discovery, the signals of the device are discovered in a single pass
+    and only browse paths outside of the discovered trees are translated.
+    The discovered signals are cached separately, so they are reused if the
+    configured signals change.
+
+    Arguments:
+        client {Client} -- Connected client
+        url {str} -- Endpoint of the server
+        uid {str} -- Unique identifier of the device
+        browse_paths {dict} -- Browse paths as {measurement: browse path}
+        cache {NodeCache} -- Cache of resolved NodeIds, optional
+        discover {bool} -- Discover the signals of the device
+
+    Returns:
+        dict -- NodeIds as {measurement: NodeId}
+    """
+    key = None
+    if cache is not None:
+        key = await NodeCache.key(client, url, browse_paths)
+        node_ids = cache.get(uid, key)
+        if node_ids is not None:
+            log_msg(f"Using {len(node_ids)} cached NodeIds of {uid}")
+            return node_ids
+
+    node_ids = {}
+    if discover:
+        signals = await discover_device(client, url, uid, cache)
+        for measurement, browse_path in browse_paths.items():
+            node_id = signals.get(",".join(browse_path))
+            if node_id is not None:
+                node_ids[measurement] = node_id
+
+    missing = {
+        measurement: browse_path
+        for measurement, browse_path in browse_paths.items()
+        if measurement not in node_ids
+    }
+    if missing:
+        node_ids.update(await translate_browse_paths(client, missing))
+
+    if cache is not None:
+        try:
+            cache.put(uid, key, node_ids)
+        except OSError as e:
+            log_msg(f"Failed to update node cache {cache.path}: {e}")
+    return node_ids
+
+
+async def discover_device(
+    client: Client, url: str, uid: str, cache: NodeCache = None
+):
+    """
+    Discover the signals of a device, using the cache if it is still valid.
+
+    Arguments:
+        client {Client} -- Connected client
+        url {str} -- Endpoint of the server
+        uid {str} -- Unique identifier of the device
+        cache {NodeCache} -- Cache of discovered NodeIds, optional
+
+    Returns:
+        dict -- NodeIds of the variables as {browse path: NodeId}
+    """
+    entry = f"{uid}#signals"
+    if cache is not None:
+        key = await NodeCache.key(client, url, {"roots": DISCOVERY_ROOTS})
+        signals = cache.get(entry, key)
+        if signals is not None:
+            log_msg(f"Using {len(signals)} cached signals of {uid}")
+            return signals
+
+    signals = await discover_signals(client)
+    log_msg(f"Discovered {len(signals)} signals of {uid}")
+
+    if cache is not None:
+        try:
+            cache.put(entry, key, signals)
+        except OSError as e:
+            log_msg(f"Failed to update node cache {cache.path}: {e}")
+    return signals
@@ -0,0 +1,154 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import numpy as np
+
+from seguro.gateway.opc_ua.frame import Frame
+
+# Statistics computed for every window, followed by the percentiles
+STATISTICS = ["mean", "min", "max", "rms", "std"]
+# Initial number of samples per window, grown as needed
+WINDOW_CAPACITY = 64
+
+
+class Window:
+    """
+    The Window collects the samples of all slots sharing a window length in a
+    two-dimensional array with one row per sample.
+
+    Windows are aligned to multiples of their length since the Unix epoch, so
+    the windows of different gateways cover the same intervals.
+    """
+
+    def __init__(self, length_ns: int, slots: list, targets: np.ndarray):
+        self.length = length_ns
+        self.slots = np.array(slots, dtype=np.intp)
+        # Slots of the aggregated frame as (statistic, slot) array
+        self.targets = targets
+        self.samples = np.empty((WINDOW_CAPACITY, len(slots)))
+        self.count = 0
+        self.index = None
+        self.closed = False
+
+    def append(self, values: np.ndarray):
+        """Append the values of a sample.
+
+        Arguments:
+            values {np.ndarray} -- Values of all slots of the source frame
+        """
+        if self.count == len(self.samples):
+            self.samples = np.concatenate(
+                [self.samples, np.empty_like(self.samples)]
+            )
+        self.samples[self.count] = values[self.slots]
+        self.count += 1
+
+    def statistics(self, percentiles: np.ndarray):
+        """Compute the statistics of the collected samples.
+
+        Arguments:
+            percentiles {np.ndarray} -- Percentiles between 0 and 100
+
+        Returns:
+            np.ndarray -- Statistics as (statistic, slot) array
+        """
+        samples = self.samples[: self.count]
+        rows = [
+            samples.mean(axis=0),
+            samples.min(axis=0),
+            samples.max(axis=0),
+            np.sqrt(np.mean(np.square(samples), axis=0)),
+            samples.std(axis=0),
+        ]
+        if len(percentiles) > 0:
+            rows += list(np.percentile(samples, percentiles, axis=0))
+        return np.stack(rows)
+
+
+class Aggregator:
+    """
+    The Aggregator replaces the samples of a frame by statistics over windows
+    of configurable length per slot.
+
+    It is used in place of the format of a PublishingHandler. Every sample is
+    appended to the window of each slot, and once a sample falls into a new
+    window, the statistics of the completed windows are written with the
+    wrapped format. The aggregated sample is stamped with the end of the
+    completed windows and holds the latest statistics of all slots, so it is
+    only written once every window has been completed at least once.
+
+    The aggregated frame has one column per statistic of every column of the
+    source frame. Real and imaginary parts of complex values are aggregated
+    separately.
+    """
+
+    def __init__(self, fmt, frame: Frame, windows: list, percentiles=()):
+        """
+        Arguments:
+            fmt {Format} -- Format of the aggregated samples
+            frame {Frame} -- Frame of the raw samples
+            windows {list} -- Window length in seconds of every slot
+            percentiles {list} -- Percentiles between 0 and 100 to compute
+                in addition to STATISTICS
+        """
+        self.format = fmt
+        self.percentiles = np.array(percentiles, dtype=float)
+        self.statistics = STATISTICS + [f"p{q:g}" for q in percentiles]
+
+        names = []
+        for real, imag in frame.columns:
+            for statistic in self.statistics:
+                names.append(f"{frame.names[real]}/{statistic}")
+                if imag is not None:
+                    names.append(f"{frame.names[imag]}/{statistic}")
+        self.frame = Frame(names)
+        self.values = np.frombuffer(self.frame.values, dtype=np.float64)
+
+        # Slot of every statistic of every source slot in the aggregated frame
+        targets = np.array(
+            [
+                [
+                    self.frame.slots[f"{name}/{statistic}"]
+                    for statistic in self.statistics
+                ]
+                for name in frame.names
+            ],
+            dtype=np.intp,
+        )
+
+        groups = {}
+        for slot, length in enumerate(windows):
+            groups.setdefault(round(length * 1e9), []).append(slot)
+        self.windows = [
+            Window(length_ns, slots, targets[slots].T)
+            for length_ns, slots in groups.items()
+        ]
+
+    def write(self, output, timestamp_ns: int, frame: Frame):
+        """Add a sample to the windows and write the statistics of completed
+        windows to the output.
+
+        Arguments:
+            output {Output} -- Output to write aggregated samples to
+            timestamp_ns {int} -- Timestamp of the sample in nanoseconds
+            frame {Frame} -- Frame holding the values of the sample
+        """
+        values = np.frombuffer(frame.values, dtype=np.float64)
+
+        end = None
+        for window in self.windows:
+            index = timestamp_ns // window.length
+            if index != window.index and window.count > 0:
+                self.values[window.targets] = window.statistics(
+                    self.percentiles
+                )
+                window.closed = True
+                window.count = 0
+
+                window_end = (window.index + 1) * window.length
+                end = window_end if end is None else max(end, window_end)
+
+            window.index = index
+            window.append(values)
+
+        if end is not None and all(window.closed for window in self.windows):
+            self.format.write(output, end, self.frame)
@@ -0,0 +1,297 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import asyncio
+import time
+from array import array
+from bisect import bisect_right
+from operator import itemgetter
+
+from asyncua import Client, ua
+
+from seguro.gateway.opc_ua.address_space import (
+    read_operation_limit,
+    split_batches,
+)
+from seguro.gateway.opc_ua.frame import Frame
+from seguro.gateway.opc_ua.logger import log_msg
+from seguro.gateway.opc_ua.sample_buffer import (
+    SampleBuffer,
+    datetime_to_ns,
+    ns_to_datetime,
+)
+
+# Default number of values per node read with one HistoryRead request
+BACKFILL_BATCH = 1000
+# Default maximum length in seconds of the interval read after an outage
+BACKFILL_MAX_DURATION = 3600.0
+
+
+class Backfill:
+    """
+    The Backfill reads the values which were missed while the connection to a
+    device was lost from the history of the server and emits them.
+
+    The SubscriptionHandler records the source timestamp of the latest value
+    of every slot. The missing interval starts at these timestamps before the
+    subscription is created again after an outage, and ends at the current
+    time once the subscription has been created. Its values are
+    read with HistoryReadRawModified requests, split by the
+    MaxNodesPerHistoryReadData limit of the server and reading at most batch
+    values per node, continuing with continuation points.
+
+    The values of all nodes are merged into samples by source timestamp in a
+    frame of their own, which starts with the values of the frame before the
+    outage. A sample is emitted once all nodes have been read up to its
+    timestamp, at most rate samples per second. Live samples are only
+    emitted after the backfill has completed. In buffered mode, buffered
+    values which are not newer than the last backfilled sample are
+    discarded, so samples are emitted once in the order of their timestamps.
+    """
+
+    def __init__(
+        self,
+        pub_handler,
+        latest: array,
+        rate: float,
+        batch: int = BACKFILL_BATCH,
+        max_duration: float = BACKFILL_MAX_DURATION,
+        buffer: SampleBuffer = None,
+    ):
+        """
+        Arguments:
+            pub_handler {PublishingHandler} -- Publishing handler of the
+                device
+            latest {array} -- Source timestamp in nanoseconds of the latest
+                value of every slot
+            rate {float} -- Maximum number of samples emitted per second
+            batch {int} -- Number of values per node and request
+            max_duration {float} -- Maximum length in seconds of the interval
+                read after an outage
+            buffer {SampleBuffer} -- Sample buffer in buffered mode, optional
+        """
+        self.pub_handler = pub_handler
+        self.latest = latest
+        self.rate = rate
+        self.batch = batch
+        self.max_duration = round(max_duration * 1e9)
+        self.buffer = buffer
+        self.frame = Frame(pub_handler.frame.names)
+        self.since = {}
+        self.task = None
+
+    @property
+    def running(self):
+        """
+        True while missed values are read and emitted.
+        """
+        return self.task is not None and not self.task.done()
+
+    def prepare(self, slots: list):
+        """Record the start of the missing interval before the subscription
+        is created again.
+
+        Arguments:
+            slots {list} -- Slots of the monitored items
+        """
+        if self.running:
+            self.task.cancel()
+
+        # Slots without values have not been read before
+        self.since = {
+            slot: self.latest[slot] for slot in slots if self.latest[slot] > 0
+        }
+        self.frame.assign(self.pub_handler.frame)
+
+    async def start(self, client: Client, nodes: dict):
+        """Start reading the missing interval after the subscription has been
+        created.
+
+        Arguments:
+            client {Client} -- Connected client
+            nodes {dict} -- Monitored nodes as {slot: NodeId}
+        """
+        if not self.since:
+            return
+
+        # The current time of a server may lag behind, e.g. asyncua updates
+        # it once per second. Values read beyond the start of the
+        # subscription are discarded as duplicates in buffered mode.
+        server_time = await client.get_node(
+            ua.ObjectIds.Server_ServerStatus_CurrentTime
+        ).read_value()
+        end_ns = max(datetime_to_ns(server_time), time.time_ns())
+        end = ns_to_datetime(end_ns)
+
+        since = {
+            slot: max(timestamp_ns, end_ns - self.max_duration)
+            for slot, timestamp_ns in self.since.items()
+            if timestamp_ns < end_ns
+        }
+        if since:
+            self.task = asyncio.create_task(
+                self.__run(client, nodes, since, end)
+            )
+
+    def __params(self, details, nodes: dict, points: list, release=False):
+        params = ua.HistoryReadParameters()
+        params.HistoryReadDetails = details
+        params.TimestampsToReturn = ua.TimestampsToReturn.Source
+        params.ReleaseContinuationPoints = release
+        for slot, point in points:
+            read_value = ua.HistoryReadValueId()
+            read_value.NodeId = nodes[slot]
+            read_value.ContinuationPoint = point
+            params.NodesToRead.append(read_value)
+        return params
+
+    async def __run(self, client: Client, nodes: dict, since: dict, end):
+        start_ns = min(since.values())
+        log_msg(
+            f"Backfilling {len(since)} nodes from {ns_to_datetime(start_ns)} "
+            + f"to {end} ..."
+        )
+
+        max_nodes = await read_operation_limit(
+            client,
+            ua.ObjectIds.Server_ServerCapabilities_OperationLimits_MaxNodesPerHistoryReadData,  # noqa: E501
+        )
+        details = ua.ReadRawModifiedDetails()
+        details.IsReadModified = False
+        details.StartTime = ns_to_datetime(start_ns)
+        details.EndTime = end
+        details.NumValuesPerNode = self.batch
+        details.ReturnBounds = False
+
+        # Values read but not emitted yet as {slot: [(timestamp_ns, value)]}
+        pending = {slot: [] for slot in since}
+        # Timestamp of the last value read of every slot
+        read_until = dict(since)
+        # Continuation points of the nodes with values left to read
+        points = {slot: None for slot in since}
+
+        self.started = time.monotonic()
+        self.emitted = 0
+        self.last = 0
+        try:
+            while points:
+                batches = split_batches(list(points.items()), max_nodes)
+                results = await asyncio.gather(
+                    *[
+                        client.uaclient.history_read(
+                            self.__params(details, nodes, batch)
+                        )
+                        for batch in batches
+                    ]
+                )
+
+                for batch, batch_results in zip(batches, results):
+                    for (slot, _), result in zip(batch, batch_results):
+                        if not result.StatusCode.is_good():
+                            log_msg(
+                                "Failed to read history of "
+                                + f"{self.frame.names[slot]}: "
+                                + f"{result.StatusCode}"
+                            )
+                            del points[slot]
+                            continue
+
+                        self.__append(
+                            pending[slot],
+                            read_until,
+                            slot,
+                            since[slot],
+                            result.HistoryData.DataValues,
+                        )
+                        if result.ContinuationPoint:
+                            points[slot] = result.ContinuationPoint
+                        else:
+                            del points[slot]
+
+                # Samples are complete up to the values of the node read the
+                # least far
+                horizon = min(
+                    (read_until[slot] for slot in points), default=None
+                )
+                await self.__emit(pending, horizon)
+
+        except asyncio.CancelledError:
+            # Cancelled by a reconnect, see prepare
+            log_msg(f"Backfill cancelled after {self.emitted} samples")
+            await self.__release(client, details, nodes, points)
+            raise
+        except Exception as e:
+            log_msg(f"Backfill aborted after {self.emitted} samples: {e}")
+            await self.__release(client, details, nodes, points)
+        else:
+            log_msg(f"Backfilled {self.emitted} samples")
+        finally:
+            if self.buffer is not None:
+                # Values which have been backfilled already
+                self.buffer.discard(self.last)
+
+    async def __release(self, client, details, nodes: dict, points: dict):
+        """
+        Release the continuation points of an aborted backfill.
+        """
+        open_points = [item for item in points.items() if item[1]]
+        if not open_points:
+            return
+
+        try:
+            await client.uaclient.history_read(
+                self.__params(details, nodes, open_points, release=True)
+            )
+        except Exception:
+            pass
+
+    @staticmethod
+    def __append(values, read_until, slot, since, data_values):
+        for data_value in data_values:
+            timestamp = (
+                data_value.SourceTimestamp or data_value.ServerTimestamp
+            )
+            timestamp_ns = datetime_to_ns(timestamp)
+            read_until[slot] = timestamp_ns
+
+            value = data_value.Value.Value
+            if timestamp_ns > since and value is not None:
+                values.append((timestamp_ns, value))
+
+    async def __emit(self, pending: dict, horizon: int):
+        """
+        Emit the samples up to the horizon, all samples without a horizon.
+        """
+        samples = []
+        for slot, values in pending.items():
+            stop = len(values)
+            if horizon is not None:
+                stop = bisect_right(values, horizon, key=itemgetter(0))
+            samples += [
+                (timestamp_ns, slot, value)
+                for timestamp_ns, value in values[:stop]
+            ]
+            del values[:stop]
+        samples.sort()
+
+        frame = self.frame
+        pub_handler = self.pub_handler
+        telemetry = pub_handler.telemetry
+        last = len(samples) - 1
+        for i, (timestamp_ns, slot, value) in enumerate(samples):
+            frame.set(slot, value)
+
+            if i < last and samples[i + 1][0] == timestamp_ns:
+                continue
+            if not frame.complete:
+                continue
+
+            pub_handler.format.write(pub_handler.output, timestamp_ns, frame)
+            self.emitted += 1
+            self.last = timestamp_ns
+            if telemetry is not None:
+                telemetry.backfilled.inc()
+
+            # Limit the rate of the backfilled samples
+            delay = self.started + self.emitted / self.rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
@@ -0,0 +1,291 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import socket
+import sys
+import time
+from array import array
+
+from seguro.gateway.opc_ua.mockup import run_server
+from seguro.gateway.opc_ua.subscription_handler import Mode, read_measurements
+
+URI = "https://github.com/SEGuRo-Projekt/Gateway"
+
+
+def signal_objects(signals: int):
+    """Browse paths of the generic signals of the mockup as OPC UA objects.
+
+    Arguments:
+        signals {int} -- Number of signals
+
+    Returns:
+        dict -- OPC UA objects and attributes to read
+    """
+    return {
+        f"0:Objects,2:Device,2:Signals,2:Signal{i}": ["Momentary"]
+        for i in range(signals)
+    }
+
+
+def percentile(values: list, q: float):
+    """Percentile of sorted values by the nearest rank.
+
+    Arguments:
+        values {list} -- Sorted values
+        q {float} -- Percentile between 0 and 100
+
+    Returns:
+        float -- Percentile, None if there are no values
+    """
+    if not values:
+        return None
+    return values[round(q / 100 * (len(values) - 1))]
+
+
+def current_rss():
+    """
+    Resident set size of the process in KiB.
+    """
+    with open("/proc/self/statm", encoding="utf-8") as file:
+        pages = int(file.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+class CaptureOutput:
+    """
+    The CaptureOutput counts the samples written by the readout and measures
+    their latency from the update of the first signal in the mockup, whose
+    value is the time of the update.
+    """
+
+    def __init__(self):
+        self.active = False
+        self.samples = 0
+        self.latencies = array("d")
+        # Time of the update of the latest sample
+        self.updated = 0.0
+
+    def send(self, *parts):
+        if not self.active:
+            return
+
+        received = time.time()
+        line = b"".join(parts)
+        updated = float(line.split(b" ", 2)[1])
+
+        self.samples += 1
+        self.latencies.append(received - updated)
+        self.updated = updated
+
+
+async def measure(mode: Mode, args, port: int):
+    """Run the readout against the mockup and measure it.
+
+    Arguments:
+        mode {Mode} -- Mode of reading the measurements
+        args {argparse.Namespace} -- Benchmark parameters
+        port {int} -- Port of the mockup
+
+    Returns:
+        dict -- Results
+    """
+    device = {
+        "uid": "benchmark",
+        "uri": "127.0.0.1",
+        "port": port,
+        "sending_rate": args.rate,
+        "mode": mode.name,
+    }
+    output = CaptureOutput()
+    task = asyncio.create_task(
+        read_measurements(device, signal_objects(args.signals), mode, output)
+    )
+
+    await asyncio.sleep(args.warmup)
+    output.active = True
+    start = time.monotonic()
+    cpu_start = time.process_time()
+
+    await asyncio.sleep(args.duration)
+    output.active = False
+    cpu = time.process_time() - cpu_start
+    duration = time.monotonic() - start
+
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+    latencies = sorted(output.latencies)
+    samples = output.samples
+    return {
+        "mode": mode.name,
+        "signals": args.signals,
+        "rate": args.rate,
+        "duration": duration,
+        "samples": samples,
+        "samples_per_s": samples / duration,
+        "values_per_s": samples * args.signals / duration,
+        "latency_ms": {
+            name: (percentile(latencies, q) * 1000 if latencies else None)
+            for name, q in [
+                ("p50", 50),
+                ("p90", 90),
+                ("p99", 99),
+                ("max", 100),
+            ]
+        },
+        "cpu_s": cpu,
+        "cpu_per_sample_us": cpu / samples * 1e6 if samples else None,
+        "cpu_load": cpu / duration,
+        "rss_kib": current_rss(),
+        "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def run_mockup(signals: int, rate: float, port: int):
+    """
+    Process target running the mockup.
+    """
+    asyncio.run(run_server(rate, f"opc.tcp://127.0.0.1:{port}/", URI, signals))
+
+
+def run_readout(mode: Mode, args, port: int, connection):
+    """
+    Process target running and measuring the readout.
+    """
+    if not args.verbose:
+        # Silence log_msg, which is bound to the original STDERR
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stderr.fileno())
+
+    connection.send(asyncio.run(measure(mode, args, port)))
+
+
+def wait_for_port(port: int, timeout: float):
+    """Wait until the mockup accepts connections.
+
+    Arguments:
+        port {int} -- Port of the mockup
+        timeout {float} -- Timeout in seconds
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Mockup did not start on port {port}")
+            time.sleep(0.2)
+
+
+def system_info():
+    """
+    Describe the machine the benchmark runs on.
+    """
+    return {
+        "machine": platform.machine(),
+        "system": platform.platform(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the readout against the mockup"
+    )
+    parser.add_argument(
+        "--signals", "-s", type=int, default=100, help="Number of signals"
+    )
+    parser.add_argument(
+        "--rate",
+        "-r",
+        type=float,
+        default=10.0,
+        help="Update rate of the mockup and sending rate in Hz",
+    )
+    parser.add_argument(
+        "--duration",
+        "-d",
+        type=float,
+        default=30.0,
+        help="Duration of a measurement in seconds",
+    )
+    parser.add_argument(
+        "--warmup",
+        "-w",
+        type=float,
+        default=5.0,
+        help="Time to connect and subscribe before measuring in seconds",
+    )
+    parser.add_argument(
+        "--mode",
+        "-m",
+        action="append",
+        choices=[mode.name for mode in Mode],
+        help="Mode to benchmark, can be given multiple times (default: all)",
+    )
+    parser.add_argument(
+        "--port", "-p", type=int, default=4850, help="Port of the mockup"
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        help="Append results as JSON lines to a file instead of STDOUT",
+    )
+    parser.add_argument(
+        "--verbose", "-v", action="store_true", help="Show readout logs"
+    )
+
+    args = parser.parse_args()
+    modes = [Mode[name] for name in args.mode or [m.name for m in Mode]]
+
+    context = multiprocessing.get_context("spawn")
+    mockup = context.Process(
+        target=run_mockup, args=(args.signals, args.rate, args.port)
+    )
+    mockup.start()
+
+    results = []
+    try:
+        wait_for_port(args.port, timeout=60 + args.signals / 100)
+
+        for mode in modes:
+            receiver, sender = context.Pipe(duplex=False)
+            readout = context.Process(
+                target=run_readout, args=(mode, args, args.port, sender)
+            )
+            readout.start()
+            # Only the readout holds the sender, so recv fails if it dies
+            sender.close()
+            result = receiver.recv()
+            readout.join()
+
+            result["system"] = system_info()
+            results.append(result)
+    finally:
+        mockup.terminate()
+        mockup.join()
+
+    lines = "".join(json.dumps(result) + "\n" for result in results)
+    if args.output is None:
+        sys.stdout.write(lines)
+    else:
+        with open(args.output, "a", encoding="utf-8") as file:
+            file.write(lines)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
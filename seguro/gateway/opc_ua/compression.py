@@ -0,0 +1,120 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import numpy as np
+
+from seguro.gateway.opc_ua.frame import Frame
+
+# Default maximum interval in seconds between two emitted samples
+KEEPALIVE = 60.0
+
+
+class Compressor:
+    """
+    The Compressor suppresses samples which can be reconstructed from the
+    emitted samples within a tolerance per slot (report by exception).
+
+    It is used in place of the format of a PublishingHandler. As every sample
+    holds all slots, a sample is emitted as soon as one slot requires it, and
+    the state of all slots restarts from the emitted sample:
+
+    - deadband: A sample is emitted if a value differs by more than its
+      tolerance from the last emitted value. Holding the last emitted value
+      reconstructs the suppressed samples.
+    - swinging_door: A sample is emitted if the line from the last emitted
+      sample to the current one deviates by more than the tolerance from a
+      suppressed value. The previous sample is emitted then, as it is the
+      last one for which all lines stay within the tolerances. Linear
+      interpolation between emitted samples reconstructs the suppressed
+      samples, at the cost of delaying every sample by one.
+
+    Independent of the changes, a sample is emitted at least every keepalive
+    seconds.
+    """
+
+    methods = ["deadband", "swinging_door"]
+
+    def __init__(
+        self,
+        fmt,
+        frame: Frame,
+        tolerances: list,
+        method: str = "deadband",
+        keepalive: float = KEEPALIVE,
+    ):
+        self.format = fmt
+        self.method = method
+        self.keepalive = round(keepalive * 1e9)
+        self.tolerances = np.array(tolerances, dtype=np.float64)
+
+        # Frame of the emitted samples and a view on its values
+        self.frame = Frame(frame.names)
+        self.values = np.frombuffer(self.frame.values, dtype=np.float64)
+
+        # Last emitted sample
+        self.archived = None
+        # Previous sample and its values
+        self.previous = None
+        self.previous_values = np.zeros(len(frame))
+        # Bounds of the slopes of lines from the last emitted sample which
+        # stay within the tolerances of all suppressed values
+        self.upper = np.full(len(frame), np.inf)
+        self.lower = np.full(len(frame), -np.inf)
+
+        self.received = 0
+        self.emitted = 0
+
+    def __emit(self, output, timestamp_ns: int, values: np.ndarray):
+        self.values[:] = values
+        self.format.write(output, timestamp_ns, self.frame)
+        self.emitted += 1
+        self.archived = timestamp_ns
+        self.upper.fill(np.inf)
+        self.lower.fill(-np.inf)
+
+    def __swinging_door(self, output, timestamp_ns: int, values: np.ndarray):
+        elapsed = (timestamp_ns - self.archived) / 1e9
+        slopes = (values - self.values) / elapsed
+        if np.any(slopes > self.upper) or np.any(slopes < self.lower):
+            self.__emit(output, self.previous, self.previous_values)
+            elapsed = (timestamp_ns - self.archived) / 1e9
+
+        # Narrow the doors by the tolerances of the current values
+        np.minimum(
+            self.upper,
+            (values + self.tolerances - self.values) / elapsed,
+            out=self.upper,
+        )
+        np.maximum(
+            self.lower,
+            (values - self.tolerances - self.values) / elapsed,
+            out=self.lower,
+        )
+
+    def write(self, output, timestamp_ns: int, frame: Frame):
+        """Write a sample to the output if it is required to reconstruct the
+        values within their tolerances.
+
+        Arguments:
+            output {Output} -- Output to write the sample to
+            timestamp_ns {int} -- Timestamp of the sample in nanoseconds
+            frame {Frame} -- Frame holding the values of the sample
+        """
+        values = np.frombuffer(frame.values, dtype=np.float64)
+        self.received += 1
+
+        if self.archived is None or timestamp_ns <= self.archived:
+            self.__emit(output, timestamp_ns, values)
+        else:
+            if self.method == "swinging_door":
+                self.__swinging_door(output, timestamp_ns, values)
+                changed = False
+            else:
+                changed = np.any(
+                    np.abs(values - self.values) > self.tolerances
+                )
+
+            if changed or timestamp_ns - self.archived >= self.keepalive:
+                self.__emit(output, timestamp_ns, values)
+
+        self.previous = timestamp_ns
+        self.previous_values[:] = values
@@ -142,6 +142,76 @@ opcua_objects = {
 }
 
 
+deadband_schema = Schema(
+    {
+        "type": Or("absolute", "percent"),
+        "value": Or(int, float),
+    }
+)
+
+aggregation_schema = Schema(
+    {
+        "window": Or(int, float),
+        Optional("percentiles"): [Or(int, float)],
+    }
+)
+
+compression_schema = Schema(
+    {
+        "method": Or("deadband", "swinging_door"),
+        "tolerance": Or(int, float),
+        Optional("keepalive"): Or(int, float),
+    }
+)
+
+redundancy_schema = Schema(
+    {
+        "endpoints": [{"uri": str, "port": Or(int, str)}],
+        Optional("timeout"): Or(int, float),
+    }
+)
+
+backfill_schema = Schema(
+    {
+        Optional("rate"): Or(int, float),
+        Optional("batch"): int,
+        Optional("max_duration"): Or(int, float),
+    }
+)
+
+monitoring_keys = [
+    "sampling_interval",
+    "queue_size",
+    "deadband",
+    "window",
+    "tolerance",
+]
+
+mqtt_schema = Schema(
+    {
+        "type": "mqtt",
+        "out": {"publish": str},
+        Optional("format"): Or("villas.human", "protobuf"),
+        Optional("host"): str,
+        Optional("port"): int,
+        Optional("qos"): Or(0, 1),
+        Optional("retain"): bool,
+        Optional("keepalive"): int,
+        Optional("username"): str,
+        Optional("password"): str,
+        Optional("ssl"): {
+            Optional("enabled"): bool,
+            Optional("insecure"): bool,
+            Optional("cafile"): str,
+            Optional("capath"): str,
+            Optional("certfile"): str,
+            Optional("keyfile"): str,
+            Optional("ciphers"): str,
+        },
+    },
+    ignore_extra_keys=True,
+)
+
 config_schema = Schema(
     {
         "uid": str,
@@ -151,9 +221,48 @@ config_schema = Schema(
         "port": Or(int, str),
         Optional("sending_rate"): float,
         Optional("mode"): Or("SUBSCRIBE", "GATHER"),
+        Optional("output"): str,
+        Optional("format"): Or("villas.human", "protobuf"),
+        Optional("publishing_interval"): Or(int, float),
+        Optional("sampling_interval"): Or(int, float),
+        Optional("queue_size"): int,
+        Optional("deadband"): deadband_schema,
+        Optional("node_cache"): str,
+        Optional("discover"): bool,
+        Optional("buffered"): bool,
+        Optional("buffer_size"): int,
+        Optional("output_queue"): int,
+        Optional("spool"): str,
+        Optional("spool_size"): int,
+        Optional("catchup_rate"): Or(int, float),
+        Optional("mqtt"): str,
+        Optional("mqtt_batch"): int,
+        Optional("mqtt_linger"): Or(int, float),
+        Optional("mqtt_inflight"): int,
+        Optional("shmem"): str,
+        Optional("shmem_size"): int,
+        Optional("aggregation"): aggregation_schema,
+        Optional("compression"): compression_schema,
+        Optional("derive"): bool,
+        Optional("redundancy"): redundancy_schema,
+        Optional("backfill"): backfill_schema,
+        Optional("record"): str,
     }
 )
 
+signal_schema = Schema(
+    {
+        "opcua_obj": str,
+        "opcua_attr": str,
+        Optional("sampling_interval"): Or(int, float),
+        Optional("queue_size"): int,
+        Optional("deadband"): deadband_schema,
+        Optional("window"): Or(int, float),
+        Optional("tolerance"): Or(int, float),
+    },
+    ignore_extra_keys=True,
+)
+
 
 def read_config(path: str):
     """Read config from file.
@@ -194,3 +303,23 @@ def parse_opcua_objects(config: dict):
 
         ids[signal["opcua_obj"]].append(signal["opcua_attr"])
     return ids
+
+
+def parse_monitoring_parameters(config: dict):
+    """Parse per-signal monitoring parameters from config.
+
+    Arguments:
+        config {dict} -- Configuration to parse
+
+    Returns:
+        dict -- Parsed parameters as {(opc id, opc attribute): parameters}"""
+    params = {}
+    for signal in config["in"]["signals"]:
+        validate_config(signal, signal_schema)
+
+        overrides = {
+            key: signal[key] for key in monitoring_keys if key in signal
+        }
+        if overrides:
+            params[(signal["opcua_obj"], signal["opcua_attr"])] = overrides
+    return params
@@ -0,0 +1,232 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import re
+
+import numpy as np
+
+from seguro.gateway.opc_ua.frame import Frame
+
+# Rotation by 120 degrees
+ROTATION = np.exp(2j * np.pi / 3)
+# Transformation of the phasors of U1, U2 and U3 into their zero, positive
+# and negative sequence
+SEQUENCES = (
+    np.array(
+        [
+            [1, 1, 1],
+            [1, ROTATION, ROTATION**2],
+            [1, ROTATION**2, ROTATION],
+        ]
+    )
+    / 3
+)
+SEQUENCE_NAMES = ["Zero", "Positive", "Negative"]
+UNBALANCE_NAMES = ["Unbalance", "ZeroUnbalance"]
+
+# Current channels of a phase, e.g. IG1_I2 or Module1_IG1_I2
+PHASE_CURRENT = re.compile(r"^(?:Module\d+_)?IG\d+_I([123])$")
+
+
+def split_name(name: str):
+    """Split the name of a column into its measurement and attribute.
+
+    Arguments:
+        name {str} -- Name of a column, e.g. md1/U1/ULNComplex/Momentary
+
+    Returns:
+        tuple -- (uid, measurement, attribute), None for other names
+    """
+    parts = name.split("/")
+    if len(parts) != 4:
+        return None
+    uid, measurement, _, attribute = parts
+    return uid, measurement, attribute
+
+
+def derived_name(name: str, quantity: str):
+    """Name of a quantity derived from a column.
+
+    Arguments:
+        name {str} -- Name of the column
+        quantity {str} -- Derived quantity, e.g. Magnitude
+
+    Returns:
+        str -- Name with the value type replaced by the quantity, or the
+            quantity appended for other names
+    """
+    parts = split_name(name)
+    if parts is None:
+        return f"{name}/{quantity}"
+    uid, measurement, attribute = parts
+    return f"{uid}/{measurement}/{quantity}/{attribute}"
+
+
+class Derivation:
+    """
+    The Derivation appends electrical quantities derived from the complex
+    values of a frame as extra columns.
+
+    It is used in place of the format of a PublishingHandler. The complex
+    columns of every sample are gathered into a complex128 array, and all
+    quantities are computed for all channels at once:
+
+    - magnitude and phase angle in degrees of every voltage and current
+    - apparent power S and power factor PF of every power measurement, and
+      of the current channels I1 to I3 without one from U * conj(I)
+    - magnitudes of the zero, positive and negative sequence of U1 to U3,
+      and the negative and zero sequence unbalance in percent
+
+    The derived frame holds the values of the source frame followed by the
+    derived quantities, and is written with the wrapped format.
+    """
+
+    def __init__(self, fmt, frame: Frame):
+        """
+        Arguments:
+            fmt {Format} -- Format of the derived samples
+            frame {Frame} -- Frame of the raw samples
+        """
+        self.format = fmt
+
+        # Complex columns by (uid, measurement, attribute)
+        complex_columns = {}
+        real, imag, column_names = [], [], []
+        for (real_slot, imag_slot), name in zip(
+            frame.columns, frame.column_names
+        ):
+            if imag_slot is None:
+                continue
+            parts = split_name(name)
+            if parts is not None:
+                complex_columns[parts] = len(real)
+            real.append(real_slot)
+            imag.append(imag_slot)
+            column_names.append(name)
+        self.real = np.array(real, dtype=np.intp)
+        self.imag = np.array(imag, dtype=np.intp)
+        self.phasors = np.empty(len(real), dtype=np.complex128)
+
+        names = []
+        phasors, measured, voltages, currents, sequences = [], [], [], [], []
+        for index, name in enumerate(column_names):
+            parts = split_name(name)
+            if parts is not None and parts[1].endswith("_Power"):
+                measured.append(index)
+                continue
+
+            phasors.append(index)
+            if parts is None:
+                continue
+
+            uid, measurement, attribute = parts
+            match = PHASE_CURRENT.match(measurement)
+            voltage = (uid, f"U{match.group(1)}", attribute) if match else None
+            power = (uid, f"{measurement}_Power", attribute)
+            if voltage in complex_columns and power not in complex_columns:
+                voltages.append(complex_columns[voltage])
+                currents.append(index)
+
+            if measurement == "U1":
+                phases = [(uid, f"U{i}", attribute) for i in (1, 2, 3)]
+                if all(phase in complex_columns for phase in phases):
+                    sequences.append([complex_columns[p] for p in phases])
+
+        names += [derived_name(column_names[i], "Magnitude") for i in phasors]
+        names += [derived_name(column_names[i], "Phase") for i in phasors]
+        # Power measurements S and PF are derived for, including the ones
+        # computed from voltage and current
+        power_names = [column_names[i] for i in measured]
+        for i in currents:
+            uid, measurement, attribute = split_name(column_names[i])
+            power_names.append(
+                f"{uid}/{measurement}_Power/PowerComplex/{attribute}"
+            )
+        names += [derived_name(name, "S") for name in power_names]
+        names += [derived_name(name, "PF") for name in power_names]
+        for index in sequences:
+            uid, _, attribute = split_name(column_names[index[0]])
+            names += [
+                f"{uid}/U/{quantity}/{attribute}"
+                for quantity in SEQUENCE_NAMES + UNBALANCE_NAMES
+            ]
+
+        self.phasor_index = np.array(phasors, dtype=np.intp)
+        self.measured = np.array(measured, dtype=np.intp)
+        self.voltages = np.array(voltages, dtype=np.intp)
+        self.currents = np.array(currents, dtype=np.intp)
+        self.sequences = np.array(sequences, dtype=np.intp).reshape(-1, 3)
+        self.power = np.empty(len(power_names), dtype=np.complex128)
+
+        self.frame = Frame(frame.names + names)
+        values = np.frombuffer(self.frame.values, dtype=np.float64)
+        self.source = values[: len(frame)]
+
+        # Views on the blocks of the derived quantities
+        blocks = [
+            len(phasors),
+            len(phasors),
+            len(power_names),
+            len(power_names),
+            len(SEQUENCE_NAMES + UNBALANCE_NAMES) * len(sequences),
+        ]
+        offsets = np.cumsum([len(frame)] + blocks)
+        (
+            self.magnitude,
+            self.phase,
+            self.apparent,
+            self.power_factor,
+            symmetrical,
+        ) = [
+            values[start:stop]
+            for start, stop in zip(offsets[:-1], offsets[1:])
+        ]
+        self.symmetrical = symmetrical.reshape(
+            len(sequences), len(SEQUENCE_NAMES + UNBALANCE_NAMES)
+        )
+
+    def write(self, output, timestamp_ns: int, frame: Frame):
+        """Derive the quantities of a sample and write it to the output.
+
+        Arguments:
+            output {Output} -- Output to write derived samples to
+            timestamp_ns {int} -- Timestamp of the sample in nanoseconds
+            frame {Frame} -- Frame holding the values of the sample
+        """
+        values = np.frombuffer(frame.values, dtype=np.float64)
+        self.source[:] = values
+
+        z = self.phasors
+        z.real = values[self.real]
+        z.imag = values[self.imag]
+
+        phasors = z[self.phasor_index]
+        np.abs(phasors, out=self.magnitude)
+        self.phase[:] = np.angle(phasors, deg=True)
+
+        power = self.power
+        measured = len(self.measured)
+        power[:measured] = z[self.measured]
+        power[measured:] = z[self.voltages] * np.conj(z[self.currents])
+        np.abs(power, out=self.apparent)
+        self.power_factor.fill(0.0)
+        np.divide(
+            power.real,
+            self.apparent,
+            out=self.power_factor,
+            where=self.apparent > 0,
+        )
+
+        if len(self.sequences) > 0:
+            symmetrical = self.symmetrical
+            stop = len(SEQUENCE_NAMES)
+            np.abs(z[self.sequences] @ SEQUENCES.T, out=symmetrical[:, :stop])
+            positive = symmetrical[:, 1:2]
+            symmetrical[:, stop:] = 0.0
+            np.divide(
+                100 * symmetrical[:, [2, 0]],
+                positive,
+                out=symmetrical[:, stop:],
+                where=positive > 0,
+            )
+
+        self.format.write(output, timestamp_ns, self.frame)
@@ -0,0 +1,86 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import argparse
+import asyncio
+import json
+import sys
+
+from asyncua import Client
+
+from seguro.gateway.opc_ua.address_space import (
+    DISCOVERY_ROOTS,
+    discover_signals,
+)
+from seguro.gateway.opc_ua.logger import log_msg
+
+
+async def discover(url: str, roots: list, max_references: int = 0):
+    """Connect to a device and discover its signals.
+
+    Arguments:
+        url {str} -- Endpoint of the device
+        roots {list} -- Browse paths of the root nodes
+        max_references {int} -- References per node and Browse response
+
+    Returns:
+        dict -- NodeIds as {browse path: NodeId string}
+    """
+    async with Client(url=url) as client:
+        signals = await discover_signals(client, roots, max_references)
+
+    return {path: node_id.to_string() for path, node_id in signals.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Discover the signals of a measurement device"
+    )
+    parser.add_argument(
+        "--url",
+        "-u",
+        type=str,
+        default="opc.tcp://127.0.0.1:4840/",
+        help="Endpoint of the device",
+    )
+    parser.add_argument(
+        "--root",
+        "-r",
+        action="append",
+        help="Comma-separated browse path of a root node, can be given "
+        + "multiple times (default: Device/Measurements and Device/Modules)",
+    )
+    parser.add_argument(
+        "--max-references",
+        type=int,
+        default=0,
+        help="References per node and Browse response (default: server limit)",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        help="Write the signals to a file instead of STDOUT",
+    )
+
+    args = parser.parse_args()
+    roots = (
+        [root.split(",") for root in args.root]
+        if args.root
+        else DISCOVERY_ROOTS
+    )
+
+    signals = asyncio.run(discover(args.url, roots, args.max_references))
+    log_msg(f"Discovered {len(signals)} signals")
+
+    content = json.dumps(signals, indent=2) + "\n"
+    if args.output is None:
+        sys.stdout.write(content)
+    else:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(content)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
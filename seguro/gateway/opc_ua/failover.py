@@ -0,0 +1,118 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import math
+import time
+from collections import deque
+
+from seguro.gateway.opc_ua.logger import log_msg
+
+
+class Failover:
+    """
+    The Failover selects which of the sessions to redundant endpoints of a
+    device delivers the values that are emitted.
+
+    Every session keeps a subscription with the same monitored items. Only the
+    notifications of the active session are emitted. The notifications of the
+    standby sessions are held for two timeouts. If the active session has not
+    received a publish response, including keepalives, for longer than the
+    timeout, the next notification of a standby session makes it active.
+    As the values of a device may not change for a while, the check is also
+    run every emit cycle, switching to the standby session with the latest
+    publish response within the timeout. Held notifications are emitted
+    first, so values the previous session did not deliver before it stalled
+    are not lost. The SubscriptionHandler drops the duplicates of values
+    which both sessions delivered around a switchover by their source
+    timestamps.
+    """
+
+    def __init__(self, sessions: list, timeout: float, telemetry=None):
+        """
+        Arguments:
+            sessions {list} -- Sessions to the endpoints, the first one is
+                active initially
+            timeout {float} -- Time in seconds without publish responses
+                after which the active session is considered stalled
+            telemetry {DeviceTelemetry} -- Telemetry of the device, optional
+        """
+        self.sessions = sessions
+        self.timeout = timeout
+        self.telemetry = telemetry
+        self.active = 0
+        # Notifications of every session as (reception time, notification)
+        self.held = [deque() for _ in sessions]
+        # SubscriptionHandlers of the current subscriptions of the sessions
+        self.handlers = [None for _ in sessions]
+
+    def select(self, index: int, notification):
+        """Select the notifications to emit after receiving a notification.
+
+        Arguments:
+            index {int} -- Index of the session receiving the notification
+            notification {ua.DataChangeNotification} -- Notification message
+
+        Returns:
+            list -- Notifications to emit in order, empty if the session is
+                standing by
+        """
+        if index == self.active:
+            return [notification]
+
+        now = time.monotonic()
+        held = self.held[index]
+        held.append((now, notification))
+        while held[0][0] < now - 2 * self.timeout:
+            held.popleft()
+
+        silence = now - self.sessions[self.active].last_publish
+        if silence <= self.timeout:
+            return []
+
+        self.__switch(index, silence)
+        notifications = [notification for _, notification in held]
+        held.clear()
+        return notifications
+
+    def check(self):
+        """
+        Switch to a responsive standby session if the active session has
+        stalled, independent of notifications.
+        """
+        now = time.monotonic()
+        silence = now - self.sessions[self.active].last_publish
+        if silence <= self.timeout:
+            return
+
+        standby = [
+            index
+            for index, session in enumerate(self.sessions)
+            if index != self.active
+            and self.handlers[index] is not None
+            and now - session.last_publish <= self.timeout
+        ]
+        if not standby:
+            return
+
+        index = max(standby, key=lambda i: self.sessions[i].last_publish)
+        self.__switch(index, silence)
+        held = self.held[index]
+        while held:
+            received, notification = held.popleft()
+            if received >= now - 2 * self.timeout:
+                self.handlers[index].store(notification)
+
+    def __switch(self, index: int, silence: float):
+        active = self.sessions[self.active]
+        if math.isinf(silence):
+            log_msg(
+                f"No publish response from {active.url} yet, "
+                + f"switching to {self.sessions[index].url}"
+            )
+        else:
+            log_msg(
+                f"No publish response from {active.url} for {silence:.3f} "
+                + f"seconds, switching to {self.sessions[index].url}"
+            )
+        self.active = index
+        if self.telemetry is not None:
+            self.telemetry.failovers.inc()
@@ -0,0 +1,173 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import struct
+
+
+def encode_varint(value: int):
+    """Encode an unsigned integer as protobuf varint.
+
+    Arguments:
+        value {int} -- Value to encode
+
+    Returns:
+        bytes -- Encoded value
+    """
+    encoded = bytearray()
+    while value > 0x7F:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+class VillasHuman:
+    """
+    The villas.human format prints one line per sample:
+    {timestamp_s}.{timestamp_ns} {value1} {value2} ...
+
+    Complex values are formatted as {re}+{im}i.
+    """
+
+    name = "villas.human"
+
+    def write(self, output, timestamp_ns: int, frame):
+        """Write a sample to the output.
+
+        Arguments:
+            output {Output} -- Output to write the sample to
+            timestamp_ns {int} -- Timestamp of the sample in nanoseconds
+            frame {Frame} -- Frame holding the values of the sample
+        """
+        values = frame.values
+        epoch_s, epoch_ns = divmod(timestamp_ns, 1_000_000_000)
+        line = (
+            f"{epoch_s}.{epoch_ns:09d} "
+            + " ".join(
+                str(values[real])
+                if imag is None
+                else f"{values[real]}{values[imag]:+}i"
+                for real, imag in frame.columns
+            )
+            + "\n"
+        )
+        output.send(line.encode())
+
+
+class Protobuf:
+    """
+    The protobuf format encodes samples as villas.node.Message as used by the
+    protobuf format of VILLASnode.
+
+    Values are packed into a reusable buffer with a fixed layout. Real values
+    are encoded as double, complex values as pair of floats. Only the small
+    header containing sequence number and timestamp is encoded per sample.
+    """
+
+    name = "protobuf"
+
+    # Key of the repeated Sample.values field (field 100, length-delimited)
+    VALUE_KEY = encode_varint(100 << 3 | 2)
+    # Sample.values[] = Value { f: double }
+    REAL_PREFIX = VALUE_KEY + b"\x09\x09"
+    # Sample.values[] = Value { z: Complex { real: float, imag: float } }
+    COMPLEX_PREFIX = VALUE_KEY + b"\x0c\x22\x0a\x0d"
+    COMPLEX_INFIX = b"\x15"
+
+    def __init__(self):
+        self.sequence = 0
+        self.frame = None
+        self.struct = None
+        self.args = None
+        self.positions = None
+        self.buffer = None
+
+    def __layout(self, frame):
+        """
+        Prepare struct, argument list and buffer for the columns of a frame.
+        """
+        fmt = "<"
+        args = []
+        positions = []
+        for real, imag in frame.columns:
+            if imag is None:
+                fmt += f"{len(self.REAL_PREFIX)}sd"
+                args += [self.REAL_PREFIX, 0.0]
+                positions.append((len(args) - 1, real))
+            else:
+                fmt += (
+                    f"{len(self.COMPLEX_PREFIX)}sf{len(self.COMPLEX_INFIX)}sf"
+                )
+                args += [self.COMPLEX_PREFIX, 0.0, self.COMPLEX_INFIX, 0.0]
+                positions.append((len(args) - 3, real))
+                positions.append((len(args) - 1, imag))
+
+        self.frame = frame
+        self.struct = struct.Struct(fmt)
+        self.args = args
+        self.positions = positions
+        self.buffer = bytearray(self.struct.size)
+
+    def header(self, timestamp_ns: int):
+        """Encode the message header up to the first value.
+
+        Arguments:
+            timestamp_ns {int} -- Timestamp of the sample in nanoseconds
+
+        Returns:
+            bytes -- Encoded header
+        """
+        epoch_s, epoch_ns = divmod(timestamp_ns, 1_000_000_000)
+        ts = (
+            b"\x08"
+            + encode_varint(epoch_s)
+            + b"\x10"
+            + encode_varint(epoch_ns)
+        )
+        sample = (
+            b"\x08\x01"
+            + b"\x10"
+            + encode_varint(self.sequence)
+            + b"\x1a"
+            + encode_varint(len(ts))
+            + ts
+        )
+        length = len(sample) + len(self.buffer)
+        return b"\x0a" + encode_varint(length) + sample
+
+    def write(self, output, timestamp_ns: int, frame):
+        """Write a sample to the output.
+
+        Arguments:
+            output {Output} -- Output to write the sample to
+            timestamp_ns {int} -- Timestamp of the sample in nanoseconds
+            frame {Frame} -- Frame holding the values of the sample
+        """
+        if frame is not self.frame:
+            self.__layout(frame)
+
+        args = self.args
+        values = frame.values
+        for pos, slot in self.positions:
+            args[pos] = values[slot]
+
+        self.struct.pack_into(self.buffer, 0, *args)
+        output.send(self.header(timestamp_ns), self.buffer)
+        self.sequence += 1
+
+
+formats = {
+    VillasHuman.name: VillasHuman,
+    Protobuf.name: Protobuf,
+}
+
+
+def make_format(name: str):
+    """Create a format by its VILLASnode name.
+
+    Arguments:
+        name {str} -- Name of the format
+
+    Returns:
+        Format instance
+    """
+    return formats[name]()
@@ -0,0 +1,88 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+from array import array
+
+
+def complex_columns(names: list):
+    """
+    Pair real and imaginary parts of complex values into columns.
+
+    The imaginary part of a value is identified by "Im" in its name, the
+    real part by the same name with "Re" instead.
+
+    Arguments:
+        names {list} -- Names of the values, e.g. the keys of the browse paths
+
+    Returns:
+        dict -- Columns as {name: (real_slot, imag_slot)}, imag_slot is None
+            for real values
+    """
+    columns = {}
+    for slot, name in enumerate(names):
+        real_name = name.replace("Im", "Re")
+        if "Im" in name and real_name in columns:
+            real_slot, _ = columns.pop(real_name)
+            columns[name.replace("Im", "")] = (real_slot, slot)
+        else:
+            columns[name] = (slot, None)
+    return columns
+
+
+class Frame:
+    """
+    The Frame holds the latest value of every measurement in a preallocated
+    array. Each measurement has a fixed slot, and the layout of the emitted
+    columns is computed once on creation.
+    """
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.slots = {name: slot for slot, name in enumerate(self.names)}
+
+        columns = complex_columns(self.names)
+        self.column_names = list(columns.keys())
+        self.columns = list(columns.values())
+
+        self.values = array("d", bytes(8 * len(self.names)))
+        self.__is_set = bytearray(len(self.names))
+        self.filled = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def complete(self):
+        """
+        True if every slot has received at least one value.
+        """
+        return self.filled == len(self.values)
+
+    def clear(self):
+        """
+        Mark all slots as unset, e.g. after a new session has been created.
+        """
+        self.__is_set[:] = bytes(len(self.__is_set))
+        self.filled = 0
+
+    def assign(self, other: "Frame"):
+        """Copy the values and set slots of a frame with the same layout.
+
+        Arguments:
+            other {Frame} -- Frame to copy
+        """
+        self.values[:] = other.values
+        self.__is_set[:] = other.__is_set
+        self.filled = other.filled
+
+    def set(self, slot: int, value):
+        """Store a value in a slot.
+
+        Arguments:
+            slot {int} -- Slot of the measurement
+            value {float} -- Value to store, booleans and integers are
+                converted to float
+        """
+        self.values[slot] = value
+        if not self.__is_set[slot]:
+            self.__is_set[slot] = 1
+            self.filled += 1
@@ -3,159 +3,587 @@
 
 import asyncio
 import logging
+import math
 import random
 import sys
+import time
 import argparse
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
 
-from asyncua import Server
+from asyncua import Server, ua
+from asyncua.server.binary_server_asyncio import OPCUAProtocol
+from asyncua.server.history import HistoryStorageInterface
+from asyncua.server.internal_session import InternalSession, SessionState
+from asyncua.server.uaprocessor import UaProcessor
+from asyncua.ua.ua_binary import struct_from_binary
 
+from seguro.gateway.opc_ua.config_parser import (
+    opcua_objects,
+    parse_opcua_objects,
+    read_config,
+)
+from seguro.gateway.opc_ua.subscription_handler import construct_browse_paths
 
-async def run_server(rate: float, endpoint: str, uri):
-    _logger = logging.getLogger(__name__)
-    server = Server()
-    await server.init()
-    server.set_endpoint(endpoint)
-    server.set_server_name("OPC UA Mockup Measurement Device")
+# Value ranges of the variables by the name of the measured quantity
+# Freq: 49.9 - 50.1 Hz
+# ULN: 227.0 - 235.0 V
+# IG: 0.0 - 1.15 A
+# Power factor: 0.95 - 1.0
+RANGES = {
+    "Freq": (49.9, 50.1),
+    "ULNComplexRe": (227.0, 235.0),
+    "ULNComplexIm": (0.0, 11.5),
+    "IComplexRe": (22.7, 23.5),
+    "IComplexIm": (0.0, 1.15),
+    "P": (5152.9, 5522.5),
+    "Q": (0.0, 17.25),
+}
 
-    idx = await server.register_namespace(uri)
+ACTIVATE_SESSION = ua.NodeId(
+    ua.ObjectIds.ActivateSessionRequest_Encoding_DefaultBinary
+)
+TRANSFER_SUBSCRIPTIONS = ua.NodeId(
+    ua.ObjectIds.TransferSubscriptionsRequest_Encoding_DefaultBinary
+)
+
+_logger = logging.getLogger(__name__)
+
+
+def catalog_browse_paths():
+    """
+    Browse paths of all objects of the catalog in config_parser.
+
+    Returns:
+        list -- Browse paths
+    """
+    paths = []
+    for obj in opcua_objects:
+        paths += construct_browse_paths(
+            "mockup", {obj: ["Momentary"]}
+        ).values()
+    return paths
+
+
+def config_browse_paths(path: str):
+    """Browse paths of the signals of all nodes in a VILLASnode config.
+
+    Arguments:
+        path {str} -- Path to the VILLASnode config
+
+    Returns:
+        list -- Browse paths
+    """
+    paths = []
+    for node in read_config(path)["nodes"].values():
+        if "opcua_config" not in node:
+            continue
+
+        uid = node["opcua_config"]["uid"]
+        for obj, attributes in parse_opcua_objects(node).items():
+            for attr in attributes:
+                paths += construct_browse_paths(uid, {obj: [attr]}).values()
+    return paths
+
+
+def value_range(browse_path: list):
+    """Value range of a variable.
+
+    Arguments:
+        browse_path {list} -- Browse path of the variable
+
+    Returns:
+        tuple -- Minimum and maximum value
+    """
+    for name in reversed(browse_path[-2:]):
+        name = name.split(":", 1)[-1]
+        if name in RANGES:
+            return RANGES[name]
+    return (0.0, 1.0)
+
+
+class Waveform:
+    """
+    The Waveform generates the values of all variables for a tick.
+
+    Values only depend on the tick, the index of the variable and the seed,
+    so runs are reproducible and received values can be verified:
+
+    - random: uniformly distributed within the range of the variable
+    - sine: sine across the range, phase shifted by the index of the variable
+    - step: alternating between minimum and maximum, shifted by the index
+    """
+
+    kinds = ["random", "sine", "step"]
+
+    def __init__(
+        self, kind: str, ranges: list, rate: float, frequency=1.0, seed=0
+    ):
+        self.kind = kind
+        self.ranges = ranges
+        self.rate = rate
+        self.frequency = frequency
+        self.seed = seed
+
+    def values(self, tick: int):
+        """Values of all variables at a tick.
+
+        Arguments:
+            tick {int} -- Number of the tick
+
+        Returns:
+            list -- Values in the order of the ranges
+        """
+        t = tick / self.rate
+        count = len(self.ranges)
+
+        if self.kind == "random":
+            # Seeded per tick, so skipped ticks do not shift later values
+            generator = random.Random(hash((self.seed, tick)))
+            return [generator.uniform(low, high) for low, high in self.ranges]
+
+        if self.kind == "sine":
+            angle = 2 * math.pi * self.frequency * t
+            return [
+                low
+                + (high - low)
+                * (1 + math.sin(angle + 2 * math.pi * i / count))
+                / 2
+                for i, (low, high) in enumerate(self.ranges)
+            ]
+
+        step = math.floor(2 * self.frequency * t)
+        return [
+            high if (step + i) % 2 else low
+            for i, (low, high) in enumerate(self.ranges)
+        ]
+
+
+class TickHistory(HistoryStorageInterface):
+    """
+    The TickHistory keeps the values of the variables written in the last
+    seconds in memory for HistoryRead requests.
 
-    device = await server.nodes.objects.add_object(idx, "Device")
-    measurements = await device.add_object(idx, "Measurements")
+    Unlike the default storage of asyncua, values are stored by the tick loop
+    directly instead of an internal subscription, so no value is lost at high
+    rates, and the number of values per node of a request is limited with a
+    continuation point pointing to the next value. Values are only read
+    forward in time.
+    """
 
-    # Voltages
-    ug = await measurements.add_object(idx, "UG")
+    def __init__(self, duration: float):
+        super().__init__()
+        self.duration = timedelta(seconds=duration)
+        self.timestamps = {}
+        self.values = {}
 
+    async def init(self):
+        pass
+
+    async def new_historized_node(self, node_id, period, count=0):
+        self.timestamps[node_id] = []
+        self.values[node_id] = []
+
+    async def save_node_value(self, node_id, datavalue):
+        timestamps = self.timestamps[node_id]
+        values = self.values[node_id]
+        timestamps.append(datavalue.SourceTimestamp)
+        values.append(datavalue)
+
+        # Remove expired values in chunks to keep appending cheap
+        expired = bisect_left(timestamps, timestamps[-1] - self.duration)
+        if expired > len(timestamps) // 2:
+            del timestamps[:expired]
+            del values[:expired]
+
+    async def read_node_history(self, node_id, start, end, nb_values):
+        if node_id not in self.values:
+            return [], None
+
+        timestamps = self.timestamps[node_id]
+        values = self.values[node_id]
+        epoch = ua.get_win_epoch()
+        limit = nb_values or self.max_history_data_response_size
+
+        # Values are only read forward in time
+        first = 0
+        if start is not None and start != epoch:
+            first = bisect_left(timestamps, start)
+        stop = len(values)
+        if end is not None and end != epoch:
+            stop = bisect_right(timestamps, end)
+
+        if stop - first > limit:
+            cut = first + limit
+            return values[first:cut], timestamps[cut]
+        return values[first:stop], None
+
+    async def new_historized_event(self, source_id, evtypes, period, count=0):
+        # Events are not historized by the mockup
+        pass
+
+    async def save_event(self, event):
+        pass
+
+    async def read_event_history(
+        self, source_id, start, end, nb_values, evfilter
+    ):
+        return [], None
+
+    async def stop(self):
+        pass
+
+
+async def historize(server: Server, storage: TickHistory, variables: list):
+    """Mark variables as historizing and store their values in the storage.
+
+    Arguments:
+        server {Server} -- Server of the variables
+        storage {TickHistory} -- Storage of the values
+        variables {list} -- Variables to historize
+    """
+    server.iserver.history_manager.set_storage(storage)
+    for var in variables:
+        await var.write_attribute(
+            ua.AttributeIds.Historizing, ua.DataValue(True)
+        )
+        await var.set_attr_bit(
+            ua.AttributeIds.AccessLevel, ua.AccessLevel.HistoryRead
+        )
+        await var.set_attr_bit(
+            ua.AttributeIds.UserAccessLevel, ua.AccessLevel.HistoryRead
+        )
+        await storage.new_historized_node(var.nodeid, storage.duration)
+
+
+async def add_variables(server: Server, idx: int, browse_paths: list):
+    """Create the objects and variables of the browse paths.
+
+    Arguments:
+        server {Server} -- Server to add the nodes to
+        idx {int} -- Namespace index of the nodes
+        browse_paths {list} -- Browse paths starting at the objects folder
+
+    Returns:
+        dict -- Variables as {browse path: Node}
+    """
+    nodes = {("0:Objects",): server.nodes.objects}
     variables = {}
-    variables["freq"] = await ug.add_variable(idx, "Freq", 50.0)
-
-    u1 = await ug.add_object(idx, "U1")
-    variables["uln1_im"] = await u1.add_variable(idx, "ULNComplexIm", 0.0)
-    variables["uln1_re"] = await u1.add_variable(idx, "ULNComplexRe", 0.0)
-
-    u2 = await ug.add_object(idx, "U2")
-    variables["uln2_im"] = await u2.add_variable(idx, "ULNComplexIm", 0.0)
-    variables["uln2_re"] = await u2.add_variable(idx, "ULNComplexRe", 0.0)
-
-    u3 = await ug.add_object(idx, "U3")
-    variables["uln3_im"] = await u3.add_variable(idx, "ULNComplexIm", 0.0)
-    variables["uln3_re"] = await u3.add_variable(idx, "ULNComplexRe", 0.0)
-
-    # Currents
-    ig1 = await measurements.add_object(idx, "IG1")
-    ig1_i1 = await ig1.add_object(idx, "I1")
-    variables["ig1_i1_im"] = await ig1_i1.add_variable(idx, "IComplexIm", 0.0)
-    variables["ig1_i1_re"] = await ig1_i1.add_variable(idx, "IComplexRe", 0.0)
-    variables["ig1_i1_p"] = await ig1_i1.add_variable(idx, "P", 0.0)
-    variables["ig1_i1_q"] = await ig1_i1.add_variable(idx, "Q", 0.0)
-
-    ig1_i2 = await ig1.add_object(idx, "I2")
-    variables["ig1_i2_im"] = await ig1_i2.add_variable(idx, "IComplexIm", 0.0)
-    variables["ig1_i2_re"] = await ig1_i2.add_variable(idx, "IComplexRe", 0.0)
-    variables["ig1_i2_p"] = await ig1_i2.add_variable(idx, "P", 0.0)
-    variables["ig1_i2_q"] = await ig1_i2.add_variable(idx, "Q", 0.0)
-
-    ig1_i3 = await ig1.add_object(idx, "I3")
-    variables["ig1_i3_im"] = await ig1_i3.add_variable(idx, "IComplexIm", 0.0)
-    variables["ig1_i3_re"] = await ig1_i3.add_variable(idx, "IComplexRe", 0.0)
-    variables["ig1_i3_p"] = await ig1_i3.add_variable(idx, "P", 0.0)
-    variables["ig1_i3_q"] = await ig1_i3.add_variable(idx, "Q", 0.0)
-
-    # Module
-    modules = await device.add_object(idx, "Modules")
-    module1 = await modules.add_object(idx, "Module1")
-    mod1_measurements = await module1.add_object(idx, "Measurements")
-    mod1_ig1 = await mod1_measurements.add_object(idx, "IG1")
-    mod1_ig1_i1 = await mod1_ig1.add_object(idx, "I1")
-    variables["mod1_ig1_i1_im"] = await mod1_ig1_i1.add_variable(
-        idx, "IComplexIm", 0.0
-    )
-    variables["mod1_ig1_i1_re"] = await mod1_ig1_i1.add_variable(
-        idx, "IComplexRe", 0.0
-    )
-    variables["mod1_ig1_i1_p"] = await mod1_ig1_i1.add_variable(idx, "P", 0.0)
-    variables["mod1_ig1_i1_q"] = await mod1_ig1_i1.add_variable(idx, "Q", 0.0)
 
-    mod1_ig1_i2 = await mod1_ig1.add_object(idx, "I2")
-    variables["mod1_ig1_i2_im"] = await mod1_ig1_i2.add_variable(
-        idx, "IComplexIm", 0.0
-    )
-    variables["mod1_ig1_i2_re"] = await mod1_ig1_i2.add_variable(
-        idx, "IComplexRe", 0.0
-    )
-    variables["mod1_ig1_i2_p"] = await mod1_ig1_i2.add_variable(idx, "P", 0.0)
-    variables["mod1_ig1_i2_q"] = await mod1_ig1_i2.add_variable(idx, "Q", 0.0)
+    # Create shorter paths first, so variables with attributes as children
+    # exist before their children
+    for path in sorted(set(map(tuple, browse_paths)), key=len):
+        for depth in range(2, len(path)):
+            parent = path[:depth]
+            if parent not in nodes:
+                name = parent[-1].split(":", 1)[-1]
+                nodes[parent] = await nodes[parent[:-1]].add_object(idx, name)
 
-    mod1_ig1_i3 = await mod1_ig1.add_object(idx, "I3")
-    variables["mod1_ig1_i3_im"] = await mod1_ig1_i3.add_variable(
-        idx, "IComplexIm", 0.0
-    )
-    variables["mod1_ig1_i3_re"] = await mod1_ig1_i3.add_variable(
-        idx, "IComplexRe", 0.0
-    )
-    variables["mod1_ig1_i3_p"] = await mod1_ig1_i3.add_variable(idx, "P", 0.0)
-    variables["mod1_ig1_i3_q"] = await mod1_ig1_i3.add_variable(idx, "Q", 0.0)
+        if path not in nodes:
+            name = path[-1].split(":", 1)[-1]
+            nodes[path] = await nodes[path[:-1]].add_variable(idx, name, 0.0)
+            variables[path] = nodes[path]
 
-    mod1_ig2 = await mod1_measurements.add_object(idx, "IG2")
-    mod1_ig2_i1 = await mod1_ig2.add_object(idx, "I1")
-    variables["mod1_ig2_i1_im"] = await mod1_ig2_i1.add_variable(
-        idx, "IComplexIm", 0.0
-    )
-    variables["mod1_ig2_i1_re"] = await mod1_ig2_i1.add_variable(
-        idx, "IComplexRe", 0.0
-    )
-    variables["mod1_ig2_i1_p"] = await mod1_ig2_i1.add_variable(idx, "P", 0.0)
-    variables["mod1_ig2_i1_q"] = await mod1_ig2_i1.add_variable(idx, "Q", 0.0)
+    return variables
 
-    mod1_ig2_i2 = await mod1_ig2.add_object(idx, "I2")
-    variables["mod1_ig2_i2_im"] = await mod1_ig2_i2.add_variable(
-        idx, "IComplexIm", 0.0
-    )
-    variables["mod1_ig2_i2_re"] = await mod1_ig2_i2.add_variable(
-        idx, "IComplexRe", 0.0
-    )
-    variables["mod1_ig2_i2_p"] = await mod1_ig2_i2.add_variable(idx, "P", 0.0)
-    variables["mod1_ig2_i2_q"] = await mod1_ig2_i2.add_variable(idx, "Q", 0.0)
 
-    mod1_ig2_i3 = await mod1_ig2.add_object(idx, "I3")
-    variables["mod1_ig2_i3_im"] = await mod1_ig2_i3.add_variable(
-        idx, "IComplexIm", 0.0
-    )
-    variables["mod1_ig2_i3_re"] = await mod1_ig2_i3.add_variable(
-        idx, "IComplexRe", 0.0
+def make_write(variables: list):
+    """
+    Prepare a single Write request updating the values of all variables.
+
+    Returns:
+        ua.WriteParameters -- Request parameters
+    """
+    params = ua.WriteParameters()
+    for var in variables:
+        write_value = ua.WriteValue()
+        write_value.NodeId = var.nodeid
+        write_value.AttributeId = ua.AttributeIds.Value
+        params.NodesToWrite.append(write_value)
+    return params
+
+
+class KeepingProcessor(UaProcessor):
+    """
+    The KeepingProcessor keeps the session of a lost connection like a device
+    does until the session times out, where asyncua closes it immediately:
+
+    - close: the session and its subscriptions are closed (asyncua)
+    - keep: the session is reactivated by an ActivateSession request with its
+      authentication token on a new connection
+    - orphan: the session is closed, but its subscriptions are kept to be
+      transferred to a new session by a TransferSubscriptions request
+
+    Notification messages sent on the lost connection stay in the
+    retransmission queues of the subscriptions for Republish requests.
+    Initial values are not sent again on a transfer.
+    """
+
+    modes = ["close", "keep", "orphan"]
+
+    # Seconds a session or its subscriptions are kept after a connection loss
+    TIMEOUT = 60.0
+
+    def __init__(self, iserver, transport, limits, mode: str, kept: dict):
+        super().__init__(iserver, transport, limits)
+        self.mode = mode
+        # Processors of lost connections by the authentication token of
+        # their session, shared by all connections of a server
+        self.kept = kept
+        self.expiry = None
+
+    async def close(self):
+        if (
+            self.mode == "close"
+            or self.session is None
+            or not self.session.is_activated()
+        ):
+            await super().close()
+            return
+
+        token = self.session.auth_token
+        _logger.info(f"Keeping session {token} of lost connection")
+        if self.mode == "orphan":
+            subscriptions = self.session.subscriptions
+            self.session.subscriptions = []
+            await self.session.close_session()
+            self.session.subscriptions = subscriptions
+
+        self.kept[token] = self
+        self.expiry = asyncio.create_task(self.__expire(token))
+
+    async def __expire(self, token):
+        await asyncio.sleep(self.TIMEOUT)
+        if self.kept.get(token) is self:
+            del self.kept[token]
+            # Deletes the subscriptions which have not been transferred
+            await super().close()
+
+    async def _process_message(self, typeid, requesthdr, seqhdr, body):
+        if (
+            typeid == ACTIVATE_SESSION
+            and self.session is None
+            and self.mode == "keep"
+        ):
+            processor = self.kept.pop(requesthdr.AuthenticationToken, None)
+            if processor is not None:
+                self.__reactivate(processor)
+        elif (
+            typeid == TRANSFER_SUBSCRIPTIONS
+            and self.session is not None
+            and self.session.is_activated()
+        ):
+            self.__transfer(requesthdr, seqhdr, body)
+            return True
+
+        return await super()._process_message(typeid, requesthdr, seqhdr, body)
+
+    def __reactivate(self, processor):
+        """
+        Take over the kept session of a lost connection to activate it again.
+        """
+        session = processor.session
+        _logger.info(f"Reactivating session {session.auth_token}")
+        session.state = SessionState.Created
+        # The session is counted again once activated
+        InternalSession._current_connections -= 1
+        self.session = session
+        self.__adopt(processor, session.subscriptions)
+
+    def __transfer(self, requesthdr, seqhdr, body):
+        """
+        Transfer subscriptions of kept sessions to the session of this
+        connection.
+        """
+        params = struct_from_binary(ua.TransferSubscriptionsParameters, body)
+        subscriptions = self.iserver.subscription_service.subscriptions
+
+        response = ua.TransferSubscriptionsResponse()
+        for subscription_id in params.SubscriptionIds:
+            result = ua.TransferResult()
+            processor = next(
+                (
+                    processor
+                    for processor in self.kept.values()
+                    if subscription_id in processor.session.subscriptions
+                ),
+                None,
+            )
+            if processor is None or subscription_id not in subscriptions:
+                result.StatusCode = ua.StatusCode(
+                    ua.StatusCodes.BadSubscriptionIdInvalid
+                )
+            else:
+                _logger.info(f"Transferring subscription {subscription_id}")
+                processor.session.subscriptions.remove(subscription_id)
+                self.session.subscriptions.append(subscription_id)
+                self.__adopt(processor, [subscription_id])
+                result.AvailableSequenceNumbers = list(
+                    subscriptions[subscription_id]._not_acknowledged_results
+                )
+            response.Parameters.Results.append(result)
+
+        self.send_response(requesthdr.RequestHandle, seqhdr, response)
+
+    def __adopt(self, processor, subscription_ids: list):
+        """
+        Publish the subscriptions of a lost connection on this connection.
+        """
+        subscriptions = self.iserver.subscription_service.subscriptions
+        for subscription_id in subscription_ids:
+            subscription = subscriptions.get(subscription_id)
+            if subscription is None:
+                continue
+
+            subscription.pub_result_callback = self.forward_publish_response
+            subscription.pub_request_callback = self.get_publish_request
+            # Results waiting for a publish request of the lost connection
+            if processor._publish_results_subs.pop(subscription_id, False):
+                self._publish_results_subs[subscription_id] = True
+
+
+class KeepingProtocol(OPCUAProtocol):
+    """
+    The KeepingProtocol processes the messages of a connection with a
+    KeepingProcessor.
+    """
+
+    def __init__(self, mode: str, kept: dict, **kwargs):
+        super().__init__(**kwargs)
+        self.mode = mode
+        self.kept = kept
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        self.processor = KeepingProcessor(
+            self.iserver, self.transport, self.limits, self.mode, self.kept
+        )
+        self.processor.set_policies(self.policies)
+
+
+class MockupServer(Server):
+    """
+    The MockupServer handles the sessions of lost connections by a mode of
+    the KeepingProcessor.
+    """
+
+    def __init__(self, sessions: str = "close"):
+        super().__init__()
+        self.sessions = sessions
+        self.kept = {}
+
+    async def start(self):
+        await super().start()
+        if self.sessions == "close":
+            return
+
+        # asyncua creates the listener in start, so it is started again with
+        # the protocol keeping the sessions
+        bserver = self.bserver
+        await bserver.stop()
+        bserver._make_protocol = lambda: KeepingProtocol(
+            self.sessions,
+            self.kept,
+            iserver=bserver.iserver,
+            policies=bserver._policies,
+            clients=bserver.clients,
+            closing_tasks=bserver.closing_tasks,
+            limits=bserver.limits,
+        )
+        await bserver.start()
+
+
+async def run_server(
+    rate: float,
+    endpoint: str,
+    uri,
+    signals: int = 0,
+    config: str = None,
+    waveform: str = "random",
+    frequency: float = 1.0,
+    seed: int = 0,
+    history: float = 0.0,
+    sessions: str = "close",
+):
+    server = MockupServer(sessions)
+    await server.init()
+    server.set_endpoint(endpoint)
+    server.set_server_name("OPC UA Mockup Measurement Device")
+
+    idx = await server.register_namespace(uri)
+
+    browse_paths = (
+        config_browse_paths(config)
+        if config is not None
+        else catalog_browse_paths()
     )
-    variables["mod1_ig2_i3_p"] = await mod1_ig2_i3.add_variable(idx, "P", 0.0)
-    variables["mod1_ig2_i3_q"] = await mod1_ig2_i3.add_variable(idx, "Q", 0.0)
 
-    for _, var in variables.items():
+    # Generic signals carrying the time of their last update, e.g. to
+    # measure the latency of the readout
+    clock_paths = [
+        ["0:Objects", f"{idx}:Device", f"{idx}:Signals", f"{idx}:Signal{i}"]
+        for i in range(signals)
+    ]
+
+    nodes = await add_variables(server, idx, browse_paths + clock_paths)
+    for var in nodes.values():
         await var.set_writable()
+    _logger.info(f"Created {len(nodes)} variables")
+
+    clocks = {tuple(path): nodes[tuple(path)] for path in clock_paths}
+    variables = {
+        path: var for path, var in nodes.items() if path not in clocks
+    }
+
+    generator = Waveform(
+        waveform,
+        [value_range(list(path)) for path in variables],
+        rate,
+        frequency,
+        seed,
+    )
+    params = make_write(list(variables.values()) + list(clocks.values()))
+    writes = params.NodesToWrite
+
+    storage = None
+    if history > 0:
+        storage = TickHistory(history)
+        await historize(server, storage, list(nodes.values()))
+        _logger.info(f"Keeping {history} seconds of history")
 
     _logger.info("Starting server!")
 
     async with server:
+        start = time.monotonic()
+        start_time = datetime.utcnow()
+        tick = 0
         while True:
-            await asyncio.sleep(1 / rate)
-            # Update variables with random values within realistic boundaries
-            # Freq: 49.9 - 50.1 Hz
-            # ULN: 227.0 - 235.0 V
-            # IG: 0.0 - 1.15 A
-            # Power factor: 0.95 - 1.0
-            for var, obj in variables.items():
-                if "freq" in var.lower():
-                    await obj.write_value(random.uniform(49.9, 50.1))
-                if "uln" in var.lower():
-                    if "im" in var.lower():
-                        await obj.write_value(random.uniform(0.0, 11.5))
-                    if "re" in var.lower():
-                        await obj.write_value(random.uniform(227.0, 235.0))
-                if "ig" in var.lower():
-                    if "im" in var.lower():
-                        await obj.write_value(random.uniform(0.0, 1.15))
-                    if "re" in var.lower():
-                        await obj.write_value(random.uniform(22.7, 23.5))
-                    if "p" in var.lower():
-                        await obj.write_value(random.uniform(5152.9, 5522.5))
-                    if "q" in var.lower():
-                        await obj.write_value(random.uniform(0.0, 17.25))
+            # Pace the ticks by absolute deadlines, skip ticks which have
+            # passed already
+            delay = start + tick / rate - time.monotonic()
+            if delay <= 0:
+                tick = max(tick, math.floor((time.monotonic() - start) * rate))
+            # Always yield, the write does not await any I/O
+            await asyncio.sleep(max(delay, 0))
+
+            # All values of a tick share the source timestamp
+            timestamp = start_time + timedelta(seconds=tick / rate)
+            values = generator.values(tick)
+            values += [time.time()] * len(clocks)
+
+            for write_value, value in zip(writes, values):
+                write_value.Value = ua.DataValue(
+                    ua.Variant(value, ua.VariantType.Double),
+                    SourceTimestamp=timestamp,
+                    ServerTimestamp=timestamp,
+                )
+            await server.iserver.isession.write(params)
+            if storage is not None:
+                for write_value in writes:
+                    await storage.save_node_value(
+                        write_value.NodeId, write_value.Value
+                    )
+            tick += 1
 
 
 def main() -> int:
@@ -172,10 +600,67 @@ def main() -> int:
     parser.add_argument(
         "--endpoint", "-e", type=str, default="opc.tcp://0.0.0.0:4840/"
     )
+    parser.add_argument(
+        "--signals",
+        "-s",
+        type=int,
+        default=0,
+        help="Number of additional signals in Device/Signals",
+    )
+    parser.add_argument(
+        "--config",
+        "-c",
+        type=str,
+        help="Create the variables of the signals of a VILLASnode config "
+        + "instead of all objects of the catalog",
+    )
+    parser.add_argument(
+        "--waveform",
+        "-w",
+        choices=Waveform.kinds,
+        default="random",
+        help="Waveform of the values",
+    )
+    parser.add_argument(
+        "--frequency",
+        "-f",
+        type=float,
+        default=1.0,
+        help="Frequency of the sine and step waveforms in Hz",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed of the random waveform"
+    )
+    parser.add_argument(
+        "--history",
+        type=float,
+        default=0.0,
+        help="Keep the values of the last seconds for HistoryRead requests",
+    )
+
+    parser.add_argument(
+        "--sessions",
+        choices=KeepingProcessor.modes,
+        default="close",
+        help="Handling of the sessions of lost connections",
+    )
 
     args = parser.parse_args()
 
-    asyncio.run(run_server(args.rate, args.endpoint, args.uri))
+    asyncio.run(
+        run_server(
+            args.rate,
+            args.endpoint,
+            args.uri,
+            args.signals,
+            args.config,
+            args.waveform,
+            args.frequency,
+            args.seed,
+            args.history,
+            args.sessions,
+        )
+    )
 
     return 0
 
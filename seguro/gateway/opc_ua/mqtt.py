@@ -0,0 +1,354 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import asyncio
+import ssl
+import struct
+import time
+from collections import deque
+
+from seguro.gateway.opc_ua.formats import encode_varint
+from seguro.gateway.opc_ua.logger import log_msg
+
+# Default number of samples packed into one MQTT message
+MQTT_BATCH = 10
+# Default maximum delay in seconds of a sample before its batch is sent
+MQTT_LINGER = 1.0
+# Default number of QoS 1 messages awaiting their acknowledgement
+MQTT_INFLIGHT = 16
+# Default number of messages queued while the broker is unreachable
+MQTT_QUEUE_SIZE = 1000
+
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+PUBACK = 0x40
+PINGREQ = 0xC0
+
+UINT16 = struct.Struct(">H")
+
+
+def encode_string(value: str):
+    """Encode a string as UTF-8 prefixed by its length.
+
+    Arguments:
+        value {str} -- String to encode
+
+    Returns:
+        bytes -- Encoded string
+    """
+    encoded = value.encode()
+    return UINT16.pack(len(encoded)) + encoded
+
+
+def encode_packet(packet_type: int, *parts):
+    """Prefix the parts of a packet by its fixed header.
+
+    Arguments:
+        packet_type {int} -- Packet type and flags
+        parts {bytes} -- Variable header and payload
+
+    Returns:
+        list -- Fixed header followed by the parts
+    """
+    length = sum(len(part) for part in parts)
+    return [bytes([packet_type]) + encode_varint(length), *parts]
+
+
+def make_ssl_context(ssl_conf: dict):
+    """Create the TLS context of the ssl settings of a VILLASnode mqtt node.
+
+    Arguments:
+        ssl_conf {dict} -- ssl settings, None to connect without TLS
+
+    Returns:
+        ssl.SSLContext -- Context, None without TLS
+    """
+    if ssl_conf is None or not ssl_conf.get("enabled", True):
+        return None
+
+    context = ssl.create_default_context(
+        cafile=ssl_conf.get("cafile"), capath=ssl_conf.get("capath")
+    )
+    if "certfile" in ssl_conf:
+        context.load_cert_chain(ssl_conf["certfile"], ssl_conf.get("keyfile"))
+    if ssl_conf.get("insecure", False):
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    if "ciphers" in ssl_conf:
+        context.set_ciphers(ssl_conf["ciphers"])
+    return context
+
+
+class MqttOutput:
+    """
+    The MqttOutput publishes samples directly to an MQTT broker with the
+    settings of a VILLASnode mqtt node.
+
+    Encoded samples are packed into one message until it holds the batch
+    size or its oldest sample is older than the linger time. Concatenated
+    protobuf messages decode as a single message holding all samples, and
+    villas.human samples are separate lines, so VILLASnode decodes batches
+    like messages of single samples.
+
+    With QoS 1, up to inflight messages are published without waiting for
+    their acknowledgement. Messages which are not acknowledged when the
+    connection is lost are published again after reconnecting. While the
+    broker is unreachable, up to queue_size messages are queued, dropping
+    the oldest ones once the queue is full.
+    """
+
+    # Interval in seconds of reports on queued and dropped messages
+    REPORT_INTERVAL = 60.0
+
+    def __init__(
+        self,
+        node: dict,
+        client_id: str,
+        batch: int = MQTT_BATCH,
+        linger: float = MQTT_LINGER,
+        inflight: int = MQTT_INFLIGHT,
+        queue_size: int = MQTT_QUEUE_SIZE,
+    ):
+        self.host = node.get("host", "localhost")
+        self.port = node.get("port", 1883)
+        self.topic = encode_string(node["out"]["publish"])
+        self.qos = node.get("qos", 1)
+        self.retain = node.get("retain", False)
+        self.keepalive = node.get("keepalive", 60)
+        self.username = node.get("username")
+        self.password = node.get("password")
+        self.ssl = make_ssl_context(node.get("ssl"))
+        self.client_id = client_id
+        self.name = client_id
+
+        self.batch_size = batch
+        self.linger = linger
+        self.inflight_size = inflight
+        self.queue_size = queue_size
+
+        # Parts and number of samples of the message being packed
+        self.batch = []
+        self.samples = 0
+        self.flush_handle = None
+
+        self.queue = deque()
+        # Published messages awaiting their PUBACK as {packet id: payload}
+        self.inflight = {}
+        self.packet_id = 0
+        self.ready = asyncio.Event()
+
+        self.spool = None
+        self.dropped = 0
+        self.task = None
+        self.last_report = time.monotonic()
+
+    @property
+    def backlog(self):
+        """
+        Number of messages which have not been acknowledged yet.
+        """
+        return len(self.queue) + len(self.inflight)
+
+    def send(self, *parts):
+        """Add an encoded sample to the message being packed.
+
+        Arguments:
+            parts {bytes} -- Parts of the encoded sample
+        """
+        self.batch += [bytes(part) for part in parts]
+        self.samples += 1
+
+        if self.samples >= self.batch_size:
+            self.flush()
+        elif self.flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self.flush_handle = loop.call_later(self.linger, self.flush)
+
+        if self.task is None:
+            self.task = asyncio.create_task(self.__run())
+            self.task.add_done_callback(self.__stopped)
+
+    def __stopped(self, task):
+        """
+        Restart publishing with the next sample after an unexpected error.
+        """
+        self.task = None
+        if not task.cancelled() and task.exception() is not None:
+            log_msg(f"{self.name}: Publishing failed: {task.exception()}")
+
+    def flush(self):
+        """
+        Queue the message being packed for publishing.
+        """
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.samples == 0:
+            return
+
+        if len(self.queue) >= self.queue_size:
+            self.queue.popleft()
+            self.dropped += 1
+        self.queue.append(b"".join(self.batch))
+        self.batch = []
+        self.samples = 0
+
+        self.ready.set()
+        self.report()
+
+    def __next_packet_id(self):
+        # Packet identifiers are non-zero 16 bit integers
+        self.packet_id = self.packet_id % 0xFFFF + 1
+        while self.packet_id in self.inflight:
+            self.packet_id = self.packet_id % 0xFFFF + 1
+        return self.packet_id
+
+    def __publish(self, writer, payload: bytes, packet_id: int, dup=False):
+        flags = self.qos << 1 | (0x08 if dup else 0) | int(self.retain)
+        variable = self.topic
+        if self.qos > 0:
+            variable += UINT16.pack(packet_id)
+        writer.writelines(encode_packet(PUBLISH | flags, variable, payload))
+
+    async def __connect(self):
+        reader, writer = await asyncio.open_connection(
+            self.host, self.port, ssl=self.ssl
+        )
+
+        flags = 0x02  # Clean session
+        payload = encode_string(self.client_id)
+        if self.username is not None:
+            flags |= 0x80
+            payload += encode_string(self.username)
+        if self.password is not None:
+            flags |= 0x40
+            payload += encode_string(self.password)
+
+        variable = (
+            encode_string("MQTT")
+            + bytes([4, flags])
+            + UINT16.pack(self.keepalive)
+        )
+        writer.writelines(encode_packet(CONNECT, variable, payload))
+        await writer.drain()
+
+        packet_type, body = await self.__read_packet(reader)
+        if packet_type != CONNACK or body[1] != 0:
+            writer.close()
+            raise ConnectionError(f"Connection refused by broker: {body}")
+
+        return reader, writer
+
+    @staticmethod
+    async def __read_packet(reader):
+        header = await reader.readexactly(1)
+        length = 0
+        shift = 0
+        while True:
+            (byte,) = await reader.readexactly(1)
+            length |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+        return header[0] & 0xF0, await reader.readexactly(length)
+
+    async def __receive(self, reader):
+        while True:
+            packet_type, body = await self.__read_packet(reader)
+            if packet_type == PUBACK:
+                (packet_id,) = UINT16.unpack_from(body)
+                self.inflight.pop(packet_id, None)
+                self.ready.set()
+
+    async def __transmit(self, writer):
+        last = time.monotonic()
+        while True:
+            # Wake up again for messages queued while draining
+            self.ready.clear()
+
+            sent = False
+            while self.queue and len(self.inflight) < self.inflight_size:
+                payload = self.queue.popleft()
+                if self.qos > 0:
+                    packet_id = self.__next_packet_id()
+                    self.inflight[packet_id] = payload
+                else:
+                    packet_id = 0
+                self.__publish(writer, payload, packet_id)
+                sent = True
+
+            now = time.monotonic()
+            if sent:
+                last = now
+            elif self.keepalive and now - last >= self.keepalive / 2:
+                writer.writelines(encode_packet(PINGREQ))
+                last = now
+            await writer.drain()
+
+            try:
+                await asyncio.wait_for(
+                    self.ready.wait(), self.keepalive / 2 or None
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    async def __run(self):
+        """
+        Publish queued messages, reconnecting after connection losses.
+
+        Any error of a connection, e.g. a malformed packet of the broker,
+        leads to a reconnect, so the task publishes until it is cancelled.
+        """
+        backoff = 1
+        while True:
+            try:
+                reader, writer = await self.__connect()
+            except Exception as e:
+                log_msg(f"{self.name}: Failed to connect to broker: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+                continue
+
+            log_msg(f"{self.name}: Connected to {self.host}:{self.port}")
+            backoff = 1
+
+            tasks = [
+                asyncio.create_task(self.__receive(reader)),
+                asyncio.create_task(self.__transmit(writer)),
+            ]
+            try:
+                # Publish unacknowledged messages again in the order they
+                # were published, which differs from the order of their
+                # packet ids once these wrapped around
+                for packet_id, payload in self.inflight.items():
+                    self.__publish(writer, payload, packet_id, dup=True)
+
+                done, _ = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_EXCEPTION
+                )
+                for task in done:
+                    task.result()
+            except Exception as e:
+                log_msg(f"{self.name}: Lost connection to broker: {e}")
+            finally:
+                for task in tasks:
+                    task.cancel()
+                writer.close()
+
+            await asyncio.sleep(backoff)
+
+    def report(self):
+        """
+        Log queued, unacknowledged and dropped messages once per report
+        interval.
+        """
+        now = time.monotonic()
+        if now - self.last_report < self.REPORT_INTERVAL:
+            return
+
+        log_msg(
+            f"{self.name}: {len(self.queue)} queued messages, "
+            + f"{len(self.inflight)} unacknowledged messages, "
+            + f"{self.dropped} dropped messages"
+        )
+        self.last_report = now
@@ -0,0 +1,379 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import asyncio
+import errno
+import os
+import socket
+import stat
+import sys
+import time
+from collections import deque
+
+from seguro.gateway.opc_ua.logger import log_msg
+from seguro.gateway.opc_ua.mqtt import (
+    MQTT_BATCH,
+    MQTT_INFLIGHT,
+    MQTT_LINGER,
+    MQTT_QUEUE_SIZE,
+    MqttOutput,
+)
+from seguro.gateway.opc_ua.spool import Spool
+
+# Default number of messages queued in memory while the output stalls
+QUEUE_SIZE = 10000
+# Default size of the spool in bytes
+SPOOL_SIZE = 64 * 1024 * 1024
+
+
+class StreamOutput:
+    """
+    The StreamOutput writes messages to a stream like STDOUT or a file.
+
+    Pipes and FIFOs are switched to non-blocking mode, so a stalled reader
+    does not block the event loop. The mode is shared by all descriptors of
+    the pipe, so a pipe shared with STDERR is kept blocking, as the log
+    messages would be lost otherwise.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.fd = stream.fileno()
+
+        status = os.fstat(self.fd)
+        if stat.S_ISFIFO(status.st_mode) or stat.S_ISSOCK(status.st_mode):
+            if shares_stderr(status):
+                log_msg("Output shares its pipe with STDERR, writes block")
+            else:
+                os.set_blocking(self.fd, False)
+
+    def fileno(self):
+        return self.fd
+
+    def write(self, parts):
+        """Write a message without joining its parts.
+
+        Arguments:
+            parts {list} -- Parts of the message as bytes
+
+        Returns:
+            int -- Number of bytes written, 0 if the stream is full
+        """
+        try:
+            return os.writev(self.fd, parts)
+        except BlockingIOError:
+            return 0
+
+
+class FifoOutput:
+    """
+    The FifoOutput writes messages to a FIFO, e.g. one read by a VILLASnode
+    file node.
+
+    The FIFO is opened in non-blocking mode once a reader has opened it, so
+    waiting for the reader does not block the event loop. Until then, and
+    after the reader has closed it, writes fail and messages are queued.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fd = None
+
+    def fileno(self):
+        return self.fd
+
+    def write(self, parts):
+        """Write a message without joining its parts.
+
+        Arguments:
+            parts {list} -- Parts of the message as bytes
+
+        Returns:
+            int -- Number of bytes written, 0 if the FIFO is full
+        """
+        if self.fd is None:
+            try:
+                self.fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    raise OSError(e.errno, "FIFO has no reader", self.path)
+                raise
+
+        try:
+            return os.writev(self.fd, parts)
+        except BlockingIOError:
+            return 0
+        except BrokenPipeError:
+            # Open the FIFO again for the next reader
+            os.close(self.fd)
+            self.fd = None
+            raise
+
+
+class DatagramOutput:
+    """
+    The DatagramOutput sends every message as single datagram to a Unix
+    socket, e.g. the local socket of a VILLASnode socket-node.
+    """
+
+    def __init__(self, path: str):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.connect(path)
+        self.socket.setblocking(False)
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def write(self, parts):
+        """Send a message without joining its parts.
+
+        Arguments:
+            parts {list} -- Parts of the message as bytes
+
+        Returns:
+            int -- Number of bytes sent, 0 if the socket buffer is full
+        """
+        try:
+            return self.socket.sendmsg(parts)
+        except BlockingIOError:
+            return 0
+
+
+class QueuedOutput:
+    """
+    The QueuedOutput decouples the readout from a stalling output.
+
+    Messages are written to the output directly as long as it accepts them.
+    Otherwise they are queued in memory and, once the queue is full, in an
+    optional spool file. A background task forwards queued messages in order
+    as soon as the output is writable again, limited to the catch-up rate.
+    If the queue is full and no spool is configured, the oldest messages are
+    dropped.
+    """
+
+    # Interval in seconds of reports on backlog and dropped messages
+    REPORT_INTERVAL = 60.0
+
+    def __init__(
+        self,
+        sink,
+        queue_size: int = QUEUE_SIZE,
+        spool: Spool = None,
+        catchup_rate: float = None,
+        name: str = "",
+    ):
+        self.sink = sink
+        self.queue = deque()
+        self.queue_size = queue_size
+        self.spool = spool
+        self.catchup_rate = catchup_rate
+        self.name = name
+
+        self.dropped = 0
+        self.task = None
+        self.last_report = time.monotonic()
+
+    @property
+    def backlog(self):
+        """
+        Number of queued and spooled messages.
+        """
+        spooled = len(self.spool) if self.spool is not None else 0
+        return len(self.queue) + spooled
+
+    def send(self, *parts):
+        """Write a message or queue it if the output is stalled.
+
+        Arguments:
+            parts {bytes} -- Parts of the message
+        """
+        if self.backlog == 0:
+            try:
+                written = self.sink.write(parts)
+            except OSError as e:
+                log_msg(f"{self.name}: Failed to write output: {e}")
+                written = 0
+
+            size = sum(len(part) for part in parts)
+            if written == size:
+                return
+            message = b"".join(parts)[written:]
+        else:
+            message = b"".join(parts)
+
+        self.__enqueue(message)
+        if self.task is None:
+            self.task = asyncio.create_task(self.__forward())
+
+        self.report()
+
+    def __enqueue(self, message: bytes):
+        if self.spool is not None and len(self.spool) > 0:
+            # Keep the order of messages which are already spooled
+            self.spool.append(message)
+        elif len(self.queue) < self.queue_size:
+            self.queue.append(message)
+        elif self.spool is not None:
+            self.spool.append(message)
+        else:
+            self.queue.popleft()
+            self.queue.append(message)
+            self.dropped += 1
+
+    def __peek(self):
+        if self.queue:
+            return self.queue[0]
+        return self.spool.peek()
+
+    def __pop(self, remainder: bytes = b""):
+        """
+        Remove the oldest message, or replace it by its unwritten remainder.
+        """
+        if self.queue:
+            if remainder:
+                self.queue[0] = remainder
+            else:
+                self.queue.popleft()
+        elif remainder:
+            self.spool.pop()
+            self.queue.appendleft(remainder)
+        else:
+            self.spool.pop()
+
+    async def __writable(self):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        fd = self.sink.fileno()
+        loop.add_writer(fd, future.set_result, None)
+        try:
+            await future
+        finally:
+            loop.remove_writer(fd)
+
+    async def __forward(self):
+        """
+        Forward queued messages until the backlog is empty.
+        """
+        rate = self.catchup_rate
+        # Allow bursts of up to 100 ms at the catch-up rate
+        burst = max(rate * 0.1, 1.0) if rate else 0.0
+        budget = burst
+        last = time.monotonic()
+
+        try:
+            while self.backlog > 0:
+                if rate:
+                    now = time.monotonic()
+                    budget = min(budget + (now - last) * rate, burst)
+                    last = now
+                    if budget < 1.0:
+                        await asyncio.sleep((1.0 - budget) / rate)
+                        continue
+
+                message = self.__peek()
+                try:
+                    written = self.sink.write([message])
+                except OSError as e:
+                    # E.g. the socket of the consumer is not bound yet
+                    log_msg(f"{self.name}: Failed to write output: {e}")
+                    await asyncio.sleep(1.0)
+                    continue
+
+                if written == 0:
+                    await self.__writable()
+                    continue
+
+                self.__pop(message[written:])
+                budget -= 1.0
+        finally:
+            self.task = None
+
+    def report(self):
+        """
+        Log the backlog, the fill level of the spool and dropped messages once
+        per report interval.
+        """
+        now = time.monotonic()
+        if now - self.last_report < self.REPORT_INTERVAL:
+            return
+
+        dropped = self.dropped
+        msg = f"{self.name}: {len(self.queue)} queued messages"
+        if self.spool is not None:
+            dropped += self.spool.dropped
+            msg += (
+                f", {len(self.spool)} spooled messages "
+                + f"({self.spool.fill:.1%} of {self.spool.path})"
+            )
+        msg += f", {dropped} dropped messages"
+
+        log_msg(msg)
+        self.last_report = now
+
+
+def shares_stderr(status: os.stat_result):
+    """
+    True if STDERR refers to the same file as the status, e.g. one pipe.
+    """
+    try:
+        stderr = os.fstat(sys.stderr.fileno())
+    except (OSError, ValueError):
+        return False
+    return (stderr.st_dev, stderr.st_ino) == (status.st_dev, status.st_ino)
+
+
+def is_socket(path: str):
+    """
+    True if the path is a Unix socket, e.g. of a VILLASnode socket node.
+    """
+    return os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode)
+
+
+def open_output(device_conf: dict):
+    """Open the output of a device.
+
+    Arguments:
+        device_conf {dict} -- Device configuration
+
+    Returns:
+        Output -- Broker of the configured mqtt node, otherwise the
+            configured output, STDOUT if none is configured
+    """
+    if "mqtt" in device_conf:
+        mqtt = device_conf["mqtt"]
+        log_msg(f"Publishing to {mqtt['out']['publish']} ...")
+        return MqttOutput(
+            mqtt,
+            f"opcua-readout-{device_conf['uid']}",
+            device_conf.get("mqtt_batch", MQTT_BATCH),
+            device_conf.get("mqtt_linger", MQTT_LINGER),
+            device_conf.get("mqtt_inflight", MQTT_INFLIGHT),
+            device_conf.get("output_queue", MQTT_QUEUE_SIZE),
+        )
+
+    if "output" not in device_conf.keys():
+        sink = StreamOutput(sys.stdout)
+    else:
+        path = device_conf["output"]
+        log_msg(f"Opening output {path} ...")
+
+        if is_socket(path):
+            sink = DatagramOutput(path)
+        elif os.path.exists(path) and stat.S_ISFIFO(os.stat(path).st_mode):
+            sink = FifoOutput(path)
+        else:
+            # Keep the samples of previous runs
+            sink = StreamOutput(open(path, "ab"))
+
+    spool = None
+    if "spool" in device_conf:
+        spool = Spool(
+            device_conf["spool"], device_conf.get("spool_size", SPOOL_SIZE)
+        )
+
+    return QueuedOutput(
+        sink,
+        device_conf.get("output_queue", QUEUE_SIZE),
+        spool,
+        device_conf.get("catchup_rate"),
+        device_conf["uid"],
+    )
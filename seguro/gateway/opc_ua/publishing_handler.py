@@ -1,53 +1,56 @@
 # SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
 # SPDX-License-Identifier: Apache-2.0
 
+import sys
 import time
 
+from seguro.gateway.opc_ua.formats import VillasHuman
+from seguro.gateway.opc_ua.outputs import QueuedOutput, StreamOutput
+
 
 class PublishingHandler:
     """
     The PublishingHandler is used to handle the sending of data to the broker.
     """
 
-    def __init__(self, values):
-        self.values = values
+    def __init__(self, frame, output=None, fmt=None, telemetry=None):
+        self.frame = frame
+        self.output = (
+            output
+            if output is not None
+            else QueuedOutput(StreamOutput(sys.stdout))
+        )
+        self.format = fmt if fmt is not None else VillasHuman()
+        self.telemetry = telemetry
         self.last_time = 0
 
-    def __reduce_complex(self, values):
+    def emit(self):
         """
-        Reduce complex values to a single value.
+        Encode the current frame in the configured format (villas.human by
+        default) and write it to the output.
+
+        Returns:
+            bool -- True if the frame was complete and has been sent
         """
-        reduced_complex = {}
-        for key, value in values.items():
-            if (
-                "Im" in key
-                and reduced_complex.get(key.replace("Im", "Re")) is not None
-            ):
-                if str(value).startswith("-"):
-                    reduced_complex[key.replace("Im", "")] = (
-                        str(reduced_complex[key.replace("Im", "Re")])
-                        + str(value)
-                        + "i"
-                    )
-                else:
-                    reduced_complex[key.replace("Im", "")] = (
-                        str(reduced_complex[key.replace("Im", "Re")])
-                        + "+"
-                        + str(value)
-                        + "i"
-                    )
-                del reduced_complex[key.replace("Im", "Re")]
-            else:
-                reduced_complex[key] = value
-        return reduced_complex
+        if not self.frame.complete:
+            # If there are still unset values, do not send anything
+            if self.telemetry is not None:
+                self.telemetry.skipped.inc()
+            return False
+
+        self.format.write(self.output, time.time_ns(), self.frame)
+        if self.telemetry is not None:
+            self.telemetry.sent()
+        return True
 
     def send_values(self, _time, rate):
         """
         Send values to broker if the time delta is greater than the sending
         rate.
 
-        Convert data to string in the villas.human format and print
-        it to STDOUT to be captured by an exec-type VILLASnode.
+        Encode data in the configured format (villas.human by default) and
+        write it to the output (STDOUT by default) to be captured by an
+        exec-type VILLASnode.
 
         Arguments:
             _time {float} -- Current time
@@ -57,23 +60,44 @@ class PublishingHandler:
             float -- Time delta to the last sending
         """
         time_delta = _time - self.last_time
-        if None in self.values.values():
-            # If there are still None values, do not send anything
-            return time_delta
-
         if time_delta > 1 / rate:
-            # Print the values to STDOUT in the villas.human format:
-            # {timestamp_s}.{timestamp_ns} {value1} {value2} ...
-            reduced_values = self.__reduce_complex(self.values)
-            epoch_time = time.time_ns()
-            epoch_s = str(epoch_time // 1_000_000_000)
-            epoch_ns = str(epoch_time % 1_000_000_000).zfill(9)
-            print(f"{epoch_s}.{epoch_ns}", end=" ")
-
-            print(
-                " ".join(str(x) for x in list(reduced_values.values())),
-                flush=True,
-            )
-
+            # Also wait a full period after an incomplete frame instead of
+            # polling until the frame is complete
+            self.emit()
             self.last_time = _time
         return time_delta
+
+    def drain(self, buffer):
+        """
+        Emit all buffered values in the order of their source timestamps.
+
+        Values sharing a source timestamp are emitted as one sample stamped
+        with this timestamp. Measurements without a new value at this
+        timestamp keep their previous value.
+
+        Arguments:
+            buffer {SampleBuffer} -- Buffer of received values
+
+        Returns:
+            int -- Number of samples sent
+        """
+        frame = self.frame
+        samples = buffer.drain()
+        last = len(samples) - 1
+
+        sent = 0
+        for i, (timestamp_ns, slot, value) in enumerate(samples):
+            frame.set(slot, value)
+
+            if i < last and samples[i + 1][0] == timestamp_ns:
+                continue
+
+            if frame.complete:
+                self.format.write(self.output, timestamp_ns, frame)
+                sent += 1
+            elif self.telemetry is not None:
+                self.telemetry.skipped.inc()
+
+        if sent > 0 and self.telemetry is not None:
+            self.telemetry.sent(sent)
+        return sent
@@ -1,26 +1,59 @@
 # SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
 # SPDX-License-Identifier: Apache-2.0
+import argparse
 import asyncio
 import os
 
 from seguro.gateway.opc_ua.config_parser import (
+    mqtt_schema,
     read_config,
+    parse_monitoring_parameters,
     parse_opcua_objects,
     validate_config,
 )
 from seguro.gateway.opc_ua.logger import log_msg
+from seguro.gateway.opc_ua.outputs import is_socket, open_output
 from seguro.gateway.opc_ua.subscription_handler import Mode, read_measurements
+from seguro.gateway.opc_ua.telemetry import serve_metrics
 
 
-def main():
-    VILLAS_NODE_CONFIG = os.environ["VILLAS_NODE_CONFIG"]
-    VILLAS_NODE_NAME = os.environ["VILLAS_NODE_NAME"]
-    log_msg(VILLAS_NODE_CONFIG)
-    log_msg(VILLAS_NODE_NAME)
-    log_msg(f"Parsing config from {VILLAS_NODE_CONFIG}#{VILLAS_NODE_NAME}")
+def select_nodes(vn_config: dict, node_names: list = None):
+    """Select the VILLASnode nodes which are read by this process.
+
+    Arguments:
+        vn_config {dict} -- VILLASnode configuration
+        node_names {list} -- Names of the nodes to read, all nodes with an
+            opcua_config if None
+
+    Returns:
+        dict -- Selected node configurations as {name: config}
+    """
+    nodes = vn_config["nodes"]
+    if node_names is None:
+        node_names = [
+            name for name, node in nodes.items() if "opcua_config" in node
+        ]
+
+    selected = {}
+    for name in node_names:
+        if "opcua_config" not in nodes[name]:
+            raise ValueError(f"Node {name} has no opcua_config")
+        selected[name] = nodes[name]
+    return selected
+
 
-    vn_conf = read_config(VILLAS_NODE_CONFIG)["nodes"][VILLAS_NODE_NAME]
+def prepare_device(vn_conf: dict):
+    """Parse the configuration of a single device.
+
+    Arguments:
+        vn_conf {dict} -- Configuration of the VILLASnode exec-node
+
+    Returns:
+        tuple -- Device configuration, OPC UA objects, monitoring parameters
+            and read mode
+    """
     opcua_objects = parse_opcua_objects(vn_conf)
+    monitoring = parse_monitoring_parameters(vn_conf)
     device_conf = validate_config(vn_conf["opcua_config"])
     mode = (
         Mode[device_conf["mode"]]
@@ -32,11 +65,133 @@ def main():
     log_msg(f"Device configuration: {device_conf}")
     log_msg(f"OPC UA IDs: {opcua_objects}")
 
+    return device_conf, opcua_objects, monitoring, mode
+
+
+def load_devices(config_path: str, node_names: list = None):
+    """Parse the configuration of all devices read by this process.
+
+    Arguments:
+        config_path {str} -- Path to the VILLASnode configuration
+        node_names {list} -- Names of the nodes to read, all nodes with an
+            opcua_config if None
+
+    The mqtt node a device publishes to is resolved to its configuration.
+    The protobuf format is only accepted for outputs which delimit messages.
+
+    Returns:
+        list -- List of (device_conf, opcua_objects, monitoring, mode)
+    """
+    vn_config = read_config(config_path)
+    vn_nodes = select_nodes(vn_config, node_names)
+
+    devices = []
+    for name, vn_conf in vn_nodes.items():
+        log_msg(f"Preparing node {name} ...")
+        device = prepare_device(vn_conf)
+
+        device_conf = device[0]
+        if "mqtt" in device_conf:
+            mqtt_name = device_conf["mqtt"]
+            if mqtt_name not in vn_config["nodes"]:
+                raise ValueError(f"Node {name}: Unknown mqtt node {mqtt_name}")
+            device_conf["mqtt"] = validate_config(
+                vn_config["nodes"][mqtt_name], mqtt_schema
+            )
+        elif (
+            device_conf.get("format") == "protobuf"
+            and "shmem" not in device_conf
+            and not is_socket(device_conf.get("output", ""))
+        ):
+            # Protobuf messages are not delimited, so they can only be sent
+            # as datagrams or MQTT messages
+            raise ValueError(
+                f"Node {name}: The protobuf format requires an mqtt node or "
+                + "a Unix datagram socket as output"
+            )
+        devices.append(device)
+
+    stdout_devices = [
+        device
+        for device in devices
+        if not any(key in device[0] for key in ("output", "shmem", "mqtt"))
+    ]
+    if len(stdout_devices) > 1:
+        raise ValueError(
+            "Only one device can write to STDOUT, "
+            + "configure an output for the other devices"
+        )
+    return devices
+
+
+async def read_devices(devices: list, metrics: str = None):
+    """Read all devices concurrently on a shared event loop.
+
+    Each device runs its own read_measurements task and therefore keeps its
+    own connection, reconnect backoff and output stream.
+
+    Arguments:
+        devices {list} -- List of (device_conf, opcua_objects, monitoring,
+            mode, output)
+        metrics {str} -- Address to serve metrics on, optional
+    """
+    tasks = [
+        read_measurements(device_conf, opcua_objects, mode, output, monitoring)
+        for device_conf, opcua_objects, monitoring, mode, output in devices
+    ]
+    if metrics is not None:
+        tasks.append(serve_metrics(metrics))
+
+    await asyncio.gather(*tasks)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--config",
+        "-c",
+        type=str,
+        default=os.environ.get("VILLAS_NODE_CONFIG"),
+        help="Path to the VILLASnode configuration",
+    )
+    parser.add_argument(
+        "--node",
+        "-n",
+        type=str,
+        action="append",
+        help="Name of a node to read, can be given multiple times",
+    )
+    parser.add_argument(
+        "--all",
+        "-a",
+        action="store_true",
+        help="Read all nodes with an opcua_config in a single process",
+    )
+    parser.add_argument(
+        "--metrics",
+        "-m",
+        type=str,
+        default=os.environ.get("OPCUA_READOUT_METRICS"),
+        help="Serve Prometheus metrics on host:port or a Unix socket path",
+    )
+
+    args = parser.parse_args()
+
+    if args.config is None:
+        parser.error("No VILLASnode configuration given")
+
+    node_names = args.node
+    if node_names is None and not args.all:
+        node_names = [os.environ["VILLAS_NODE_NAME"]]
+
+    log_msg(f"Parsing config from {args.config}#{node_names or 'all'}")
+
+    devices = load_devices(args.config, node_names)
+
     asyncio.run(
-        read_measurements(
-            device_conf,
-            opcua_objects,
-            mode,
+        read_devices(
+            [(*device, open_output(device[0])) for device in devices],
+            args.metrics,
         )
     )
 
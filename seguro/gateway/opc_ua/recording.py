@@ -0,0 +1,241 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import json
+import math
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+from asyncua import ua
+
+from seguro.gateway.opc_ua.logger import log_msg
+from seguro.gateway.opc_ua.sample_buffer import datetime_to_ns, ns_to_datetime
+from seguro.gateway.opc_ua.shmem import align
+
+MAGIC = b"SGNR"
+VERSION = 1
+# Magic, version, size of a record, length of the names
+HEADER = struct.Struct("<4sIII")
+NAMES_OFFSET = 64
+# Reception time, source and server timestamp, value, client handle, status
+RECORD = struct.Struct("<qqqdII")
+RECORD_DTYPE = np.dtype(
+    [
+        ("received", "<i8"),
+        ("source", "<i8"),
+        ("server", "<i8"),
+        ("value", "<f8"),
+        ("handle", "<u4"),
+        ("status", "<u4"),
+    ]
+)
+# Maximum number of records and delay in seconds before records are written
+RECORD_BATCH = 1024
+RECORD_LINGER = 1.0
+
+
+def timestamp_or_zero(timestamp):
+    return 0 if timestamp is None else datetime_to_ns(timestamp)
+
+
+class Recorder:
+    """
+    The Recorder appends the data change notifications of a subscription to a
+    file for a later replay.
+
+    Every value is stored as a record of fixed size holding its reception
+    time, source and server timestamps in nanoseconds, the value as double,
+    the client handle of its monitored item and its status code. The values
+    of a notification share the reception time. Missing timestamps are
+    stored as 0, missing or non-numeric values as NaN. The header holds the
+    names of the monitored items in the order of their client handles.
+
+    Records are written in batches. A recording of the same monitored items
+    is continued, e.g. after a restart. Another file at the path, e.g. the
+    recording of other monitored items, is kept by renaming it to the first
+    free path with a numeric suffix, e.g. notifications.rec.1.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.names = None
+        self.file = None
+        self.buffer = bytearray()
+        self.pending = 0
+        self.last_write = time.monotonic()
+
+    def open(self, names: list):
+        """Open the recording for the monitored items of a subscription.
+
+        Arguments:
+            names {list} -- Names of the monitored items by client handle
+        """
+        names = list(names)
+        if self.file is not None and names == self.names:
+            return
+        self.close()
+
+        encoded = json.dumps(names).encode()
+        header = HEADER.pack(MAGIC, VERSION, RECORD.size, len(encoded))
+        data = align(NAMES_OFFSET + len(encoded))
+        stop = NAMES_OFFSET + len(encoded)
+
+        file = open(self.path, "a+b")
+        file.seek(0)
+        existing = file.read(data)
+        if (
+            existing[: HEADER.size] == header
+            and existing[NAMES_OFFSET:stop] == encoded
+        ):
+            # Drop a record which has been written partially
+            records = (os.fstat(file.fileno()).st_size - data) // RECORD.size
+            file.truncate(data + records * RECORD.size)
+            log_msg(f"Continuing {self.path} after {records} values")
+        else:
+            if existing:
+                file.close()
+                self.__rotate()
+                file = open(self.path, "a+b")
+            file.write(header.ljust(NAMES_OFFSET, b"\0"))
+            file.write(encoded.ljust(data - NAMES_OFFSET, b"\0"))
+            file.flush()
+            log_msg(f"Recording notifications to {self.path}")
+
+        self.file = file
+        self.names = names
+
+    def __rotate(self):
+        """
+        Keep the file at the path by renaming it to the first free path with
+        a numeric suffix.
+        """
+        suffix = 1
+        while os.path.exists(f"{self.path}.{suffix}"):
+            suffix += 1
+        rotated = f"{self.path}.{suffix}"
+        os.rename(self.path, rotated)
+        log_msg(f"Moved {self.path} of other signals to {rotated}")
+
+    def write(self, notification: ua.DataChangeNotification):
+        """Append the values of a notification.
+
+        Arguments:
+            notification {ua.DataChangeNotification} -- Notification message
+        """
+        received_ns = time.time_ns()
+        pack = RECORD.pack
+
+        for item in notification.MonitoredItems:
+            data_value = item.Value
+            value = data_value.Value.Value
+            if not isinstance(value, (int, float)):
+                value = math.nan
+
+            self.buffer += pack(
+                received_ns,
+                timestamp_or_zero(data_value.SourceTimestamp),
+                timestamp_or_zero(data_value.ServerTimestamp),
+                value,
+                item.ClientHandle,
+                data_value.StatusCode.value,
+            )
+        self.pending += len(notification.MonitoredItems)
+
+        if (
+            self.pending >= RECORD_BATCH
+            or time.monotonic() - self.last_write > RECORD_LINGER
+        ):
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered records to the file.
+        """
+        if self.file is not None and self.buffer:
+            self.file.write(self.buffer)
+            self.file.flush()
+        self.buffer.clear()
+        self.pending = 0
+        self.last_write = time.monotonic()
+
+    def close(self):
+        if self.file is None:
+            return
+        self.flush()
+        self.file.close()
+        self.file = None
+
+
+class Recording:
+    """
+    The Recording maps a file of a Recorder into memory. Its records are
+    accessible as numpy structured array without copying them.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, record_size, names_length = HEADER.unpack_from(
+            self.map
+        )
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            raise ValueError(f"{path} is not a notification recording")
+
+        stop = NAMES_OFFSET + names_length
+        self.names = json.loads(self.map[NAMES_OFFSET:stop])
+        data = align(stop)
+        count = (len(self.map) - data) // RECORD.size
+        self.records = np.frombuffer(self.map, RECORD_DTYPE, count, data)
+
+    def __len__(self):
+        return len(self.records)
+
+    def notifications(self):
+        """
+        Rebuild the recorded notifications.
+
+        Returns:
+            Iterator -- Notifications as (reception time in nanoseconds,
+                ua.DataChangeNotification)
+        """
+        received = self.records["received"]
+        bounds = (np.flatnonzero(np.diff(received)) + 1).tolist()
+
+        for start, stop in zip([0] + bounds, bounds + [len(received)]):
+            yield int(received[start]), make_notification(
+                self.records[start:stop]
+            )
+
+
+def make_notification(records: np.ndarray):
+    """Create the notification of records.
+
+    Arguments:
+        records {np.ndarray} -- Records of a notification
+
+    Returns:
+        ua.DataChangeNotification -- Notification message
+    """
+    notification = ua.DataChangeNotification()
+    items = notification.MonitoredItems
+
+    for _, source, server, value, handle, status in records.tolist():
+        # Values which were missing or not numeric are replayed as missing
+        data_value = ua.DataValue(
+            (
+                ua.Variant()
+                if math.isnan(value)
+                else ua.Variant(value, ua.VariantType.Double)
+            ),
+            StatusCode_=ua.StatusCode(status),
+            SourceTimestamp=ns_to_datetime(source) if source else None,
+            ServerTimestamp=ns_to_datetime(server) if server else None,
+        )
+        items.append(
+            ua.MonitoredItemNotification(ClientHandle=handle, Value=data_value)
+        )
+    return notification
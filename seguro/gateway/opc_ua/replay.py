@@ -0,0 +1,219 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from seguro.gateway.opc_ua.formats import VillasHuman, formats, make_format
+from seguro.gateway.opc_ua.frame import Frame
+from seguro.gateway.opc_ua.logger import log_msg
+from seguro.gateway.opc_ua.publishing_handler import PublishingHandler
+from seguro.gateway.opc_ua.recording import Recording
+from seguro.gateway.opc_ua.sample_buffer import SampleBuffer
+from seguro.gateway.opc_ua.shmem import BinaryOutput
+from seguro.gateway.opc_ua.subscription_handler import (
+    BUFFER_SIZE,
+    SubscriptionHandler,
+)
+from seguro.gateway.opc_ua.telemetry import DeviceTelemetry
+
+
+class DiscardOutput:
+    """
+    The DiscardOutput counts the samples written to it and drops them.
+    """
+
+    def __init__(self):
+        self.samples = 0
+
+    def send(self, *_parts):
+        self.samples += 1
+
+
+class Replay:
+    """
+    The Replay feeds the notifications of a Recording into a
+    SubscriptionHandler and emits samples with a PublishingHandler, as the
+    readout does in subscription mode, but without an OPC UA stack.
+
+    Samples are emitted every 1 / rate seconds of recorded time, so the same
+    samples are emitted at every speed. With a speed, notifications are
+    delivered at speed times the pace they have been received. With a
+    speed of 0, they are delivered as fast as possible.
+    """
+
+    def __init__(
+        self,
+        recording: Recording,
+        rate: float,
+        output,
+        fmt,
+        buffer: SampleBuffer = None,
+    ):
+        """
+        Arguments:
+            recording {Recording} -- Recorded notifications
+            rate {float} -- Sending rate in Hz
+            output {Output} -- Output the samples are written to
+            fmt {Format} -- Format of the samples
+            buffer {SampleBuffer} -- Sample buffer in buffered mode, optional
+        """
+        self.recording = recording
+        self.period = round(1e9 / rate)
+        self.buffer = buffer
+
+        frame = Frame(recording.names)
+        self.pub_handler = PublishingHandler(frame, output, fmt)
+        self.pub_handler.telemetry = DeviceTelemetry("replay", output)
+        self.handler = SubscriptionHandler(
+            list(range(len(frame))), self.pub_handler, buffer
+        )
+
+        self.notifications = 0
+        self.values = 0
+        self.handler_time = 0.0
+        self.emit_time = 0.0
+
+    def __emit(self):
+        start = time.perf_counter()
+        if self.buffer is None:
+            self.pub_handler.emit()
+        else:
+            self.pub_handler.drain(self.buffer)
+        self.emit_time += time.perf_counter() - start
+
+    async def run(self, speed: float = 1.0):
+        """Replay all notifications.
+
+        Arguments:
+            speed {float} -- Factor of the recorded pace, 0 for maximum speed
+
+        Returns:
+            dict -- Results
+        """
+        started = time.monotonic()
+        cpu_start = time.process_time()
+        first = None
+        received_ns = None
+
+        for received_ns, notification in self.recording.notifications():
+            if first is None:
+                first = received_ns
+                next_emit = first + self.period
+
+            while received_ns >= next_emit:
+                self.__emit()
+                next_emit += self.period
+
+            if speed > 0:
+                delay = (
+                    started
+                    + (received_ns - first) / 1e9 / speed
+                    - time.monotonic()
+                )
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            start = time.perf_counter()
+            await self.handler.datachange_notifications(notification)
+            self.handler_time += time.perf_counter() - start
+            self.notifications += 1
+            self.values += len(notification.MonitoredItems)
+
+        if first is not None:
+            self.__emit()
+
+        duration = time.monotonic() - started
+        return {
+            "notifications": self.notifications,
+            "values": self.values,
+            "samples": int(self.pub_handler.telemetry.emitted.value),
+            "recorded_duration": (
+                (received_ns - first) / 1e9 if first is not None else 0.0
+            ),
+            "duration": duration,
+            "cpu": time.process_time() - cpu_start,
+            "values_per_s": self.values / duration if duration else None,
+            "handler_us_per_value": (
+                self.handler_time / self.values * 1e6 if self.values else None
+            ),
+            "emit_time": self.emit_time,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay recorded notifications through the readout"
+    )
+    parser.add_argument("path", type=str, help="Path of the recording")
+    parser.add_argument(
+        "--rate", "-r", type=float, default=10, help="Sending rate in Hz"
+    )
+    parser.add_argument(
+        "--speed",
+        "-s",
+        type=float,
+        default=1.0,
+        help="Factor of the recorded pace, 0 for maximum speed",
+    )
+    parser.add_argument(
+        "--buffered",
+        action="store_true",
+        help="Emit the values by source timestamp as in buffered mode",
+    )
+    parser.add_argument(
+        "--buffer-size",
+        type=int,
+        default=BUFFER_SIZE,
+        help="Number of values in the sample buffer",
+    )
+    parser.add_argument(
+        "--format",
+        "-f",
+        choices=list(formats.keys()),
+        default=VillasHuman.name,
+        help="Format of the samples",
+    )
+    parser.add_argument(
+        "--samples",
+        type=str,
+        help="File the samples are written to, - for STDOUT, "
+        + "discarded if not given",
+    )
+
+    args = parser.parse_args()
+    recording = Recording(args.path)
+    log_msg(
+        f"Replaying {len(recording)} values of {len(recording.names)} "
+        + f"signals from {args.path}"
+    )
+
+    samples = None
+    if args.samples == "-":
+        output = BinaryOutput(sys.stdout.buffer)
+    elif args.samples is not None:
+        samples = open(args.samples, "wb")
+        output = BinaryOutput(samples)
+    else:
+        output = DiscardOutput()
+
+    buffer = None
+    if args.buffered:
+        buffer = SampleBuffer(len(recording.names), args.buffer_size)
+
+    replay = Replay(
+        recording, args.rate, output, make_format(args.format), buffer
+    )
+    results = asyncio.run(replay.run(args.speed))
+
+    if samples is not None:
+        samples.close()
+    # Keep the samples on STDOUT apart from the results
+    stream = sys.stderr if args.samples == "-" else sys.stdout
+    print(json.dumps(results), file=stream)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
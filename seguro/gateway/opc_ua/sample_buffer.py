@@ -0,0 +1,116 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+from array import array
+from datetime import datetime, timedelta, timezone
+
+UNIX_EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def datetime_to_ns(dt: datetime):
+    """Convert an OPC UA DateTime to nanoseconds since the Unix epoch.
+
+    Arguments:
+        dt {datetime} -- Timestamp, naive datetimes are interpreted as UTC
+
+    Returns:
+        int -- Timestamp in nanoseconds
+    """
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return (dt - UNIX_EPOCH) // MICROSECOND * 1000
+
+
+def ns_to_datetime(timestamp_ns: int):
+    """Convert nanoseconds since the Unix epoch to an OPC UA DateTime.
+
+    Arguments:
+        timestamp_ns {int} -- Timestamp in nanoseconds
+
+    Returns:
+        datetime -- Naive timestamp in UTC with microsecond resolution
+    """
+    return UNIX_EPOCH + timestamp_ns // 1000 * MICROSECOND
+
+
+class SampleBuffer:
+    """
+    The SampleBuffer keeps the received values of every slot together with
+    their source timestamps in preallocated ring buffers of fixed size.
+
+    If a ring buffer is full, its oldest value is overwritten and counted as
+    dropped.
+    """
+
+    def __init__(self, slots: int, size: int):
+        self.size = size
+        self.timestamps = [array("q", bytes(8 * size)) for _ in range(slots)]
+        self.values = [array("d", bytes(8 * size)) for _ in range(slots)]
+        self.heads = [0] * slots
+        self.counts = [0] * slots
+        self.dropped = 0
+
+    def __len__(self):
+        return sum(self.counts)
+
+    def push(self, slot: int, timestamp_ns: int, value):
+        """Append a value to the ring buffer of a slot.
+
+        Arguments:
+            slot {int} -- Slot of the measurement
+            timestamp_ns {int} -- Source timestamp in nanoseconds
+            value {float} -- Value to store
+        """
+        head = self.heads[slot]
+        count = self.counts[slot]
+        pos = (head + count) % self.size
+
+        if count == self.size:
+            self.heads[slot] = (head + 1) % self.size
+            self.dropped += 1
+        else:
+            self.counts[slot] = count + 1
+
+        self.timestamps[slot][pos] = timestamp_ns
+        self.values[slot][pos] = value
+
+    def discard(self, timestamp_ns: int):
+        """Remove the values up to a timestamp.
+
+        Arguments:
+            timestamp_ns {int} -- Source timestamp in nanoseconds of the last
+                value to remove
+        """
+        for slot, count in enumerate(self.counts):
+            head = self.heads[slot]
+            timestamps = self.timestamps[slot]
+            while count > 0 and timestamps[head] <= timestamp_ns:
+                head = (head + 1) % self.size
+                count -= 1
+
+            self.heads[slot] = head
+            self.counts[slot] = count
+
+    def drain(self):
+        """Remove all buffered values.
+
+        Returns:
+            list -- Values as (timestamp_ns, slot, value) in timestamp order
+        """
+        samples = []
+        for slot, count in enumerate(self.counts):
+            if count == 0:
+                continue
+
+            head = self.heads[slot]
+            timestamps = self.timestamps[slot]
+            values = self.values[slot]
+            for i in range(head, head + count):
+                pos = i % self.size
+                samples.append((timestamps[pos], slot, values[pos]))
+
+            self.heads[slot] = 0
+            self.counts[slot] = 0
+
+        samples.sort()
+        return samples
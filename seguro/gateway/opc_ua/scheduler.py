@@ -0,0 +1,108 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import asyncio
+import math
+import time
+
+from seguro.gateway.opc_ua.logger import log_msg
+
+
+class DeadlineScheduler:
+    """
+    The DeadlineScheduler paces a periodic read/emit cycle by absolute
+    deadlines on the monotonic clock.
+
+    Deadlines are computed as start + cycle * period, so sleep inaccuracies
+    do not accumulate into drift. Each read is started early enough to
+    complete just before the emit deadline, based on a moving estimate of the
+    read duration. Reads finishing after their deadline are counted as
+    overruns, deadlines which passed meanwhile as skipped cycles.
+    """
+
+    # Weight of the latest read duration in the moving estimate
+    ALPHA = 0.2
+    # Factor applied to the estimated read duration to start reads early
+    LEAD = 1.25
+
+    def __init__(self, rate: float, name: str = "", report_interval=60.0):
+        self.period = 1 / rate
+        self.name = name
+        self.report_interval = report_interval
+
+        self.start = None
+        # The first deadline is a period after the start, so the first read
+        # has time to complete
+        self.cycle = 1
+        self.read_estimate = None
+        self.read_started = 0.0
+
+        self.overruns = 0
+        self.skipped = 0
+        self.last_report = time.monotonic()
+
+    @property
+    def deadline(self):
+        """
+        Monotonic time of the next emit deadline.
+        """
+        return self.start + self.cycle * self.period
+
+    async def wait_for_read(self):
+        """
+        Sleep until the next read has to be started to meet the deadline.
+        """
+        now = time.monotonic()
+        if self.start is None:
+            # Start the first read immediately to estimate its duration
+            self.start = now
+        else:
+            lead = min(self.LEAD * self.read_estimate, self.period)
+            delay = self.deadline - lead - now
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        self.read_started = time.monotonic()
+
+    async def wait_for_emit(self):
+        """
+        Sleep until the emit deadline. If the read overran the deadline,
+        return immediately and skip all deadlines which passed meanwhile.
+        """
+        now = time.monotonic()
+        duration = now - self.read_started
+        if self.read_estimate is None:
+            self.read_estimate = duration
+        else:
+            self.read_estimate += self.ALPHA * (duration - self.read_estimate)
+
+        deadline = self.deadline
+        if now <= deadline:
+            await asyncio.sleep(deadline - now)
+            self.cycle += 1
+        else:
+            self.overruns += 1
+            cycle = math.floor((now - self.start) / self.period) + 1
+            self.skipped += cycle - self.cycle - 1
+            self.cycle = cycle
+
+        self.report()
+
+    def report(self):
+        """
+        Log overruns and skipped cycles once per report interval.
+        """
+        now = time.monotonic()
+        if now - self.last_report < self.report_interval:
+            return
+
+        if self.overruns > 0:
+            log_msg(
+                f"{self.name}: {self.overruns} overruns and {self.skipped} "
+                + f"skipped cycles in the last {now - self.last_report:.0f} s "
+                + f"(read duration {self.read_estimate:.3f} s, "
+                + f"period {self.period:.3f} s)"
+            )
+
+        self.overruns = 0
+        self.skipped = 0
+        self.last_report = now
@@ -0,0 +1,329 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import asyncio
+import time
+from importlib.metadata import version
+
+from asyncua import Client, ua
+from asyncua.ua.ua_binary import struct_from_binary
+
+from seguro.gateway.opc_ua.logger import log_msg
+
+# Version of asyncua the private attributes below have been checked with
+ASYNCUA_VERSION = "1.0.4"
+# Private attributes of asyncua the Session relies on, by the name of the
+# object they are looked up on
+ASYNCUA_INTERNALS = {
+    "client": [
+        "_monitor_server_task",
+        "_renew_channel_task",
+        "_monitor_server_loop",
+        "_renew_channel_loop",
+        "_username",
+        "_password",
+    ],
+    "uaclient": [
+        "_publish_task",
+        "_publish_loop",
+        "_subscription_callbacks",
+        "protocol",
+    ],
+    "protocol": ["authentication_token", "send_request"],
+}
+
+
+def check_asyncua(client: Client):
+    """
+    Check that asyncua still has the private attributes the Session relies
+    on, so a changed version of asyncua fails with a clear error instead of a
+    broken resume.
+
+    Arguments:
+        client {Client} -- Connected client
+
+    Raises:
+        RuntimeError -- An attribute is missing
+    """
+    objects = {
+        "client": client,
+        "uaclient": client.uaclient,
+        "protocol": client.uaclient.protocol,
+    }
+    missing = [
+        f"{name}.{attribute}"
+        for name, attributes in ASYNCUA_INTERNALS.items()
+        for attribute in attributes
+        if not hasattr(objects[name], attribute)
+    ]
+    if missing:
+        raise RuntimeError(
+            f"asyncua {version('asyncua')} lacks private attributes the "
+            + f"readout relies on (checked with {ASYNCUA_VERSION}): "
+            + ", ".join(missing)
+        )
+
+
+class Session:
+    """
+    The Session wraps the client of a device and keeps its session and
+    subscription across connection losses.
+
+    After a connection loss, a new secure channel is opened and the existing
+    session is reactivated on it. If the server has dropped the session, a new
+    session is created and the subscription is transferred to it. Notifications
+    which were sent but not received in the meantime are recovered from the
+    retransmission queue of the server with Republish requests.
+
+    Note: asyncua (pinned to 1.0.4) neither implements TransferSubscriptions
+    nor Republish on the client side, so the requests are sent on the
+    protocol of the underlying UaClient directly. The private attributes of
+    asyncua this relies on are checked by check_asyncua on every connect.
+    """
+
+    # Maximum number of notification messages recovered after a resume
+    MAX_REPUBLISH = 100
+
+    def __init__(self, url: str):
+        self.url = url
+        self.client = None
+        self.subscription = None
+        self.last_sequence = None
+        # Monotonic time of the last publish response, including keepalives
+        self.last_publish = float("-inf")
+
+    async def open(self):
+        """
+        Resume the previous session or connect with a new session.
+
+        Returns:
+            bool -- True if the subscription of the previous session was
+                resumed and does not need to be created again
+        """
+        if self.client is not None:
+            try:
+                if await self.__resume():
+                    return True
+            except Exception as e:
+                log_msg(f"Failed to resume session to {self.url}: {e}")
+                await self.close()
+
+        if self.client is None:
+            client = Client(url=self.url)
+            await client.connect()
+            try:
+                check_asyncua(client)
+            except RuntimeError:
+                await client.disconnect()
+                raise
+            self.client = client
+
+        self.subscription = None
+        self.last_sequence = None
+        return False
+
+    async def close(self):
+        """
+        Close the session and its subscription, ignoring errors of an already
+        lost connection.
+        """
+        if self.client is None:
+            return
+
+        try:
+            await self.client.disconnect()
+        except Exception:
+            self.client.disconnect_socket()
+
+        self.client = None
+        self.subscription = None
+        self.last_sequence = None
+
+    def attach(self, subscription):
+        """
+        Attach a subscription to the session to resume it after a connection
+        loss. The sequence number of every received notification message is
+        recorded for a later Republish, and the time of every publish response
+        to detect a stalled server.
+
+        Arguments:
+            subscription {Subscription} -- Subscription created on the client
+        """
+        self.subscription = subscription
+
+        callbacks = self.client.uaclient._subscription_callbacks
+        callback = callbacks[subscription.subscription_id]
+
+        async def track(result: ua.PublishResult):
+            self.last_publish = time.monotonic()
+            message = result.NotificationMessage
+            if message.NotificationData:
+                self.last_sequence = message.SequenceNumber
+            await callback(result)
+
+        callbacks[subscription.subscription_id] = track
+
+    async def __stop_tasks(self):
+        """
+        Stop the background tasks of the client bound to the lost connection.
+        """
+        client = self.client
+        tasks = [
+            client._monitor_server_task,
+            client._renew_channel_task,
+            client.uaclient._publish_task,
+        ]
+        for task in tasks:
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+
+        # The client awaits finished tasks before every request
+        client._monitor_server_task = None
+        client._renew_channel_task = None
+        client.uaclient._publish_task = None
+
+    def __start_tasks(self, publish: bool):
+        """
+        Restart the background tasks of the client on the new connection.
+        """
+        client = self.client
+        client._monitor_server_task = asyncio.create_task(
+            client._monitor_server_loop()
+        )
+        client._renew_channel_task = asyncio.create_task(
+            client._renew_channel_loop()
+        )
+        if publish:
+            client.uaclient._publish_task = asyncio.create_task(
+                client.uaclient._publish_loop()
+            )
+
+    async def __send(self, request, response_type):
+        data = await self.client.uaclient.protocol.send_request(request)
+        response = struct_from_binary(response_type, data)
+        response.ResponseHeader.ServiceResult.check()
+        return response
+
+    async def __activate(self):
+        client = self.client
+        return await client.activate_session(
+            username=client._username,
+            password=client._password,
+            certificate=client.user_certificate,
+        )
+
+    async def __resume(self):
+        """
+        Reopen the secure channel and reactivate or replace the session.
+
+        Returns:
+            bool -- True if the subscription has been resumed
+        """
+        client = self.client
+        token = client.uaclient.protocol.authentication_token
+
+        await self.__stop_tasks()
+        client.disconnect_socket()
+
+        await client.connect_socket()
+        await client.send_hello()
+        await client.open_secure_channel()
+
+        try:
+            client.uaclient.protocol.authentication_token = token
+            await self.__activate()
+            log_msg(f"Reactivated session to {self.url}")
+            self.__start_tasks(publish=False)
+        except ua.UaStatusCodeError as e:
+            log_msg(f"Failed to reactivate session to {self.url}: {e}")
+            await client.create_session()
+            await self.__activate()
+
+            if self.subscription is not None and not await self.__transfer():
+                client.uaclient._subscription_callbacks.pop(
+                    self.subscription.subscription_id, None
+                )
+                self.subscription = None
+
+        if self.subscription is None:
+            return False
+
+        await self.__republish()
+        client.uaclient._publish_task = asyncio.create_task(
+            client.uaclient._publish_loop()
+        )
+        return True
+
+    async def __transfer(self):
+        """
+        Transfer the subscription from the lost session to the new session.
+
+        Returns:
+            bool -- True if the subscription has been transferred
+        """
+        request = ua.TransferSubscriptionsRequest()
+        request.Parameters.SubscriptionIds = [
+            self.subscription.subscription_id
+        ]
+        request.Parameters.SendInitialValues = True
+
+        try:
+            response = await self.__send(
+                request, ua.TransferSubscriptionsResponse
+            )
+            response.Parameters.Results[0].StatusCode.check()
+        except ua.UaStatusCodeError as e:
+            log_msg(f"Failed to transfer subscription to {self.url}: {e}")
+            return False
+
+        log_msg(f"Transferred subscription to new session to {self.url}")
+        return True
+
+    async def __republish(self):
+        """
+        Recover the notification messages following the last received one from
+        the retransmission queue of the server.
+        """
+        if self.last_sequence is None:
+            return
+
+        subscription_id = self.subscription.subscription_id
+        callback = self.client.uaclient._subscription_callbacks[
+            subscription_id
+        ]
+
+        recovered = 0
+        for sequence in range(
+            self.last_sequence + 1, self.last_sequence + 1 + self.MAX_REPUBLISH
+        ):
+            request = ua.RepublishRequest()
+            request.Parameters.SubscriptionId = subscription_id
+            request.Parameters.RetransmitSequenceNumber = sequence
+
+            try:
+                response = await self.__send(request, ua.RepublishResponse)
+            except ua.UaStatusCodeError as e:
+                if e.code == ua.StatusCodes.BadSubscriptionIdInvalid:
+                    # The subscription has been deleted by the server
+                    raise
+                # BadMessageNotAvailable: no further messages in the queue
+                break
+            if response.NotificationMessage.SequenceNumber != sequence:
+                # Some servers answer with an empty message instead
+                break
+
+            result = ua.PublishResult()
+            result.SubscriptionId = subscription_id
+            result.NotificationMessage = response.NotificationMessage
+            try:
+                await callback(result)
+            except Exception as e:
+                log_msg(
+                    f"Exception in handling recovered message {sequence}: {e}"
+                )
+            recovered += 1
+
+        log_msg(f"Recovered {recovered} notification messages from {self.url}")
@@ -0,0 +1,298 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+
+from seguro.gateway.opc_ua.formats import VillasHuman, formats, make_format
+from seguro.gateway.opc_ua.frame import Frame
+from seguro.gateway.opc_ua.logger import log_msg
+
+# Default number of samples in the ring
+SHMEM_SIZE = 4096
+
+MAGIC = b"SGSR"
+VERSION = 2
+# Magic, version, number of slots, values per sample, length of the names
+HEADER = struct.Struct("<4sIIII")
+# Number of samples written, on its own cache line
+WRITTEN = struct.Struct("<Q")
+WRITTEN_OFFSET = 64
+NAMES_OFFSET = 128
+# Sequence number plus one (0 while the slot is written), timestamp and
+# CRC-32 of both and the values
+SLOT_HEADER = struct.Struct("<QqI4x")
+SLOT_KEY = struct.Struct("<Qq")
+
+
+def align(offset: int, alignment: int = 64):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def checksum(stored: int, timestamp_ns: int, values):
+    """
+    CRC-32 of the sequence number, timestamp and values of a slot.
+    """
+    return zlib.crc32(values, zlib.crc32(SLOT_KEY.pack(stored, timestamp_ns)))
+
+
+class SharedMemoryWriter:
+    """
+    The SharedMemoryWriter writes samples into a ring of fixed-size slots in
+    a memory-mapped file, e.g. in /dev/shm, for a local SharedMemoryReader.
+    The layout is specific to the gateway and cannot be read by the shmem
+    node of VILLASnode.
+
+    It is used in place of the format of a PublishingHandler. The values of a
+    frame are copied into a slot as they are, without any encoding. A header
+    holds the names of the values and the number of samples written. Every
+    slot starts with the sequence number of its sample, which is cleared
+    while the slot is written, and a checksum. Python has no memory
+    barriers, so on weakly ordered CPUs like ARM readers may observe the
+    stores to a slot out of order. Readers therefore verify the checksum of
+    the copied values instead of relying on the sequence number alone. If
+    the layout of an existing file matches, the sequence continues after a
+    restart.
+    """
+
+    def __init__(self, path: str, size: int = SHMEM_SIZE):
+        self.path = path
+        self.size = size
+        self.frame = None
+        self.map = None
+
+    def __layout(self, frame: Frame):
+        names = json.dumps(frame.names).encode()
+        self.values = len(frame)
+        self.slot_size = SLOT_HEADER.size + 8 * self.values
+        self.data = align(NAMES_OFFSET + len(names))
+        length = self.data + self.size * self.slot_size
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            resume = os.fstat(fd).st_size == length
+            os.ftruncate(fd, length)
+            self.map = mmap.mmap(fd, length)
+        finally:
+            os.close(fd)
+
+        header = HEADER.pack(
+            MAGIC, VERSION, self.size, self.values, len(names)
+        )
+        stop = NAMES_OFFSET + len(names)
+        if (
+            resume
+            and self.map[: HEADER.size] == header
+            and self.map[NAMES_OFFSET:stop] == names
+        ):
+            (self.written,) = WRITTEN.unpack_from(self.map, WRITTEN_OFFSET)
+            log_msg(f"Resuming {self.path} at sample {self.written}")
+        else:
+            # Invalidate the header while the layout is written
+            self.map[: len(MAGIC)] = bytes(len(MAGIC))
+            self.map[NAMES_OFFSET:stop] = names
+            data = self.data
+            self.map[data:length] = bytes(length - data)
+            self.written = 0
+            WRITTEN.pack_into(self.map, WRITTEN_OFFSET, 0)
+            self.map[: HEADER.size] = header
+
+        self.frame = frame
+
+    def write(self, _output, timestamp_ns: int, frame: Frame):
+        """Write a sample into the next slot.
+
+        Arguments:
+            _output {Output} -- Unused, samples are written to the ring
+            timestamp_ns {int} -- Timestamp of the sample in nanoseconds
+            frame {Frame} -- Frame holding the values of the sample
+        """
+        if frame is not self.frame:
+            if self.map is not None:
+                self.map.close()
+            self.__layout(frame)
+
+        sequence = self.written
+        offset = self.data + sequence % self.size * self.slot_size
+        start = offset + SLOT_HEADER.size
+        stop = start + 8 * self.values
+
+        SLOT_HEADER.pack_into(self.map, offset, 0, timestamp_ns, 0)
+        self.map[start:stop] = frame.values
+        SLOT_HEADER.pack_into(
+            self.map,
+            offset,
+            sequence + 1,
+            timestamp_ns,
+            checksum(sequence + 1, timestamp_ns, frame.values),
+        )
+
+        self.written = sequence + 1
+        WRITTEN.pack_into(self.map, WRITTEN_OFFSET, self.written)
+
+
+class SharedMemoryReader:
+    """
+    The SharedMemoryReader reads the samples of a SharedMemoryWriter.
+
+    The values of a sample are copied out of the ring, and only returned if
+    the checksum of the copy matches the one of its slot, so samples which
+    were being written or overwritten while they were copied are discarded.
+    Such samples, and samples which were overwritten before they were read,
+    are counted as lost. If the writer changes the layout of the ring, e.g.
+    because the configured signals changed, the reader has to be created
+    again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.header = self.map[: HEADER.size]
+        magic, version, size, values, names_length = HEADER.unpack(self.header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a sample ring")
+
+        self.size = size
+        self.values = values
+        stop = NAMES_OFFSET + names_length
+        self.encoded_names = self.map[NAMES_OFFSET:stop]
+        self.names = json.loads(self.encoded_names)
+        self.frame = Frame(self.names)
+        self.slot_size = SLOT_HEADER.size + 8 * values
+        self.data = align(NAMES_OFFSET + names_length)
+        self.view = memoryview(self.map)
+
+        # Start with the oldest sample in the ring
+        self.next = max(self.written - self.size, 0)
+        self.lost = 0
+
+    @property
+    def written(self):
+        (written,) = WRITTEN.unpack_from(self.map, WRITTEN_OFFSET)
+        return written
+
+    def valid(self, sequence: int):
+        """Check if the slot of a sample has not been overwritten yet.
+
+        Arguments:
+            sequence {int} -- Sequence number of the sample
+
+        Returns:
+            bool -- True if the sample is still in its slot
+        """
+        offset = self.data + sequence % self.size * self.slot_size
+        stored, _, _ = SLOT_HEADER.unpack_from(self.map, offset)
+        return stored == sequence + 1
+
+    def read(self):
+        """
+        Read all samples written since the last read.
+
+        Returns:
+            list -- Samples as (sequence, timestamp_ns, values) with values
+                as memoryview of doubles, copied out of the ring
+        """
+        stop = NAMES_OFFSET + len(self.encoded_names)
+        if (
+            self.map[: HEADER.size] != self.header
+            or self.map[NAMES_OFFSET:stop] != self.encoded_names
+        ):
+            raise ValueError(f"Layout of {self.path} has changed")
+
+        written = self.written
+        if written < self.next:
+            # The writer has been restarted with a new ring
+            self.next = max(written - self.size, 0)
+        elif written - self.next > self.size:
+            self.lost += written - self.size - self.next
+            self.next = written - self.size
+
+        samples = []
+        for sequence in range(self.next, written):
+            offset = self.data + sequence % self.size * self.slot_size
+            stored, timestamp_ns, crc = SLOT_HEADER.unpack_from(
+                self.map, offset
+            )
+            if stored != sequence + 1:
+                self.lost += 1
+                continue
+
+            start = offset + SLOT_HEADER.size
+            stop = start + 8 * self.values
+            values = bytes(self.view[start:stop])
+            if crc != checksum(stored, timestamp_ns, values):
+                # Torn by a concurrent write of the slot
+                self.lost += 1
+                continue
+            samples.append(
+                (sequence, timestamp_ns, memoryview(values).cast("d"))
+            )
+
+        self.next = written
+        return samples
+
+
+class BinaryOutput:
+    """
+    The BinaryOutput writes messages to a binary stream in blocking mode.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def send(self, *parts):
+        for part in parts:
+            self.stream.write(part)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Print the samples of a shared memory ring"
+    )
+    parser.add_argument("path", type=str, help="Path of the ring")
+    parser.add_argument(
+        "--format",
+        "-f",
+        choices=list(formats.keys()),
+        default=VillasHuman.name,
+        help="Format of the printed samples",
+    )
+    parser.add_argument(
+        "--interval",
+        "-i",
+        type=float,
+        default=0.01,
+        help="Polling interval in seconds",
+    )
+
+    args = parser.parse_args()
+    reader = SharedMemoryReader(args.path)
+    log_msg(f"Reading {reader.values} values: {', '.join(reader.names)}")
+
+    fmt = make_format(args.format)
+    output = BinaryOutput(sys.stdout.buffer)
+    frame = reader.frame
+    frame_values = memoryview(frame.values)
+
+    lost = 0
+    while True:
+        for _, timestamp_ns, values in reader.read():
+            frame_values[:] = values
+            fmt.write(output, timestamp_ns, frame)
+        sys.stdout.buffer.flush()
+
+        if reader.lost != lost:
+            log_msg(f"Lost {reader.lost - lost} samples")
+            lost = reader.lost
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,521 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+import tracemalloc
+from array import array
+
+from seguro.gateway.opc_ua import subscription_handler
+from seguro.gateway.opc_ua.benchmark import (
+    CaptureOutput,
+    current_rss,
+    percentile,
+    run_mockup,
+    signal_objects,
+    system_info,
+    wait_for_port,
+)
+from seguro.gateway.opc_ua.subscription_handler import Mode, read_measurements
+
+FAULTS = ["drop", "restart", "slow"]
+# Prefix of the names of the tasks of the harness itself
+TASK_PREFIX = "soak"
+
+
+class FaultProxy:
+    """
+    The FaultProxy forwards the connections of the readout to the mockup and
+    injects faults: drop() aborts all connections, and while delay is set,
+    every chunk the mockup sends is delayed by it.
+    """
+
+    def __init__(self, port: int, target_port: int):
+        self.port = port
+        self.target_port = target_port
+        self.delay = 0.0
+        self.connections = set()
+        self.tasks = set()
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(
+            self.__accept, "127.0.0.1", self.port
+        )
+
+    async def stop(self):
+        """
+        Stop accepting connections and drop the forwarded ones.
+        """
+        self.server.close()
+        self.drop()
+        if self.tasks:
+            await asyncio.wait(self.tasks, timeout=1)
+
+    def drop(self):
+        """
+        Abort all forwarded connections.
+        """
+        for downstream, upstream in list(self.connections):
+            downstream.transport.abort()
+            upstream.transport.abort()
+
+    async def __accept(self, reader, writer):
+        task = asyncio.current_task()
+        task.set_name(f"{TASK_PREFIX}-proxy")
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        try:
+            up_reader, up_writer = await asyncio.open_connection(
+                "127.0.0.1", self.target_port
+            )
+        except OSError:
+            writer.transport.abort()
+            return
+
+        connection = (writer, up_writer)
+        self.connections.add(connection)
+        pumps = [
+            asyncio.create_task(
+                self.__pump(reader, up_writer, False),
+                name=f"{TASK_PREFIX}-pump",
+            ),
+            asyncio.create_task(
+                self.__pump(up_reader, writer, True),
+                name=f"{TASK_PREFIX}-pump",
+            ),
+        ]
+        try:
+            await asyncio.wait(pumps, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for pump in pumps:
+                pump.cancel()
+            writer.transport.abort()
+            up_writer.transport.abort()
+            self.connections.discard(connection)
+
+    async def __pump(self, reader, writer, slow: bool):
+        try:
+            while data := await reader.read(65536):
+                if slow and self.delay > 0:
+                    await asyncio.sleep(self.delay)
+                writer.write(data)
+                await writer.drain()
+        except OSError:
+            pass
+
+
+class Mockup:
+    """
+    The Mockup runs the mockup in a separate process, which can be
+    restarted.
+    """
+
+    def __init__(self, args, port: int):
+        self.args = args
+        self.port = port
+        self.context = multiprocessing.get_context("spawn")
+        self.process = None
+
+    async def start(self):
+        self.process = self.context.Process(
+            target=run_mockup,
+            args=(self.args.signals, self.args.rate, self.port),
+        )
+        self.process.start()
+        await asyncio.to_thread(
+            wait_for_port, self.port, 60 + self.args.signals / 100
+        )
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+
+    async def restart(self):
+        self.stop()
+        await self.start()
+
+
+def open_fds():
+    """
+    Number of open file descriptors of the process.
+    """
+    return len(os.listdir("/proc/self/fd"))
+
+
+def readout_tasks():
+    """
+    Number of asyncio tasks of the readout, excluding the harness.
+    """
+    return sum(
+        not task.get_name().startswith(TASK_PREFIX)
+        for task in asyncio.all_tasks()
+    )
+
+
+def top_allocations(baseline, limit: int):
+    """Source lines whose allocations grew the most since the baseline.
+
+    Arguments:
+        baseline {tracemalloc.Snapshot} -- Snapshot to compare with
+        limit {int} -- Number of lines
+
+    Returns:
+        list -- Lines with the growth of their size in KiB and count
+    """
+    filters = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ]
+    snapshot = tracemalloc.take_snapshot().filter_traces(filters)
+    stats = snapshot.compare_to(baseline.filter_traces(filters), "lineno")
+    return [
+        {
+            "location": f"{stat.traceback[0].filename}:"
+            + f"{stat.traceback[0].lineno}",
+            "size_diff_kib": stat.size_diff / 1024,
+            "count_diff": stat.count_diff,
+        }
+        for stat in stats[:limit]
+    ]
+
+
+def latency_ms(latencies):
+    latencies = sorted(latencies)
+    return {
+        name: (percentile(latencies, q) * 1000 if latencies else None)
+        for name, q in [("p50", 50), ("p99", 99), ("max", 100)]
+    }
+
+
+class Soak:
+    """
+    The Soak runs the readout against the mockup for many cycles and injects
+    a fault in every cycle, in turn a dropped connection, a restart of the
+    mockup and slow responses.
+
+    A cycle measures the readout for a while, injects its fault and waits
+    until values updated after the fault are emitted again. After every
+    cycle, the resident memory, the memory traced by tracemalloc, the open
+    file descriptors, the asyncio tasks of the readout and the emission
+    latency are recorded. The growth is measured from the end of the warmup
+    cycles, and the soak fails if it exceeds a threshold, or if the readout
+    does not recover from a fault.
+    """
+
+    def __init__(self, args, output):
+        self.args = args
+        self.output = output
+        self.capture = CaptureOutput()
+        self.mockup = Mockup(args, args.port + 1)
+        self.proxy = FaultProxy(args.port, args.port + 1)
+        self.baseline = None
+        self.snapshot = None
+        self.failures = []
+
+    async def __recover(self, timeout: float):
+        """
+        Wait until a sample holding values updated after the fault is
+        emitted, returning the time it took. Samples of a stale frame emitted
+        until the readout notices a lost connection do not count.
+        """
+        fault = time.time()
+        start = time.monotonic()
+        while self.capture.updated <= fault:
+            if time.monotonic() - start > timeout:
+                return None
+            await asyncio.sleep(0.05)
+        return time.monotonic() - start
+
+    async def __measure(self, duration: float):
+        self.capture.latencies = array("d")
+        await asyncio.sleep(duration)
+        return latency_ms(self.capture.latencies)
+
+    async def __inject(self, fault: str):
+        if fault == "drop":
+            self.proxy.drop()
+        elif fault == "restart":
+            await self.mockup.restart()
+        elif fault == "slow":
+            self.proxy.delay = self.args.delay
+            latency = await self.__measure(self.args.cycle)
+            self.proxy.delay = 0.0
+            return latency
+        return None
+
+    def __state(self):
+        return {
+            "rss_kib": current_rss(),
+            "traced_kib": tracemalloc.get_traced_memory()[0] / 1024,
+            "fds": open_fds(),
+            "tasks": readout_tasks(),
+        }
+
+    def __check(self, cycle: int, result: dict):
+        args = self.args
+        if result["recovery_s"] is None:
+            self.failures.append(f"cycle {cycle}: no recovery from fault")
+
+        p99 = result["latency_ms"]["p99"]
+        if p99 is not None and p99 > args.max_latency:
+            self.failures.append(
+                f"cycle {cycle}: p99 latency {p99:.1f} ms exceeds "
+                + f"{args.max_latency} ms"
+            )
+
+        if self.baseline is None:
+            return
+        for key, limit in [
+            ("rss_kib", args.max_rss_growth),
+            ("traced_kib", args.max_traced_growth),
+            ("fds", args.max_fd_growth),
+            ("tasks", args.max_task_growth),
+        ]:
+            growth = result[key] - self.baseline[key]
+            result[f"{key}_growth"] = growth
+            if growth > limit:
+                self.failures.append(
+                    f"cycle {cycle}: {key} grew by {growth:.0f} "
+                    + f"exceeding {limit}"
+                )
+
+    def __write(self, result: dict):
+        self.output.write(json.dumps(result) + "\n")
+        self.output.flush()
+
+    async def run(self):
+        """
+        Run all cycles.
+
+        Returns:
+            bool -- True if no threshold was exceeded
+        """
+        asyncio.current_task().set_name(TASK_PREFIX)
+        args = self.args
+        await self.mockup.start()
+        await self.proxy.start()
+
+        device = {
+            "uid": "soak",
+            "uri": "127.0.0.1",
+            "port": args.port,
+            "sending_rate": args.rate,
+            "mode": args.mode,
+        }
+        self.capture.active = True
+        readout = asyncio.create_task(
+            read_measurements(
+                device,
+                signal_objects(args.signals),
+                Mode[args.mode],
+                self.capture,
+            )
+        )
+
+        try:
+            if await self.__recover(args.recovery_timeout) is None:
+                self.failures.append("no samples after start")
+                return False
+
+            for cycle in range(args.cycles):
+                fault = FAULTS[cycle % len(FAULTS)]
+                latency = await self.__measure(args.cycle)
+                slow_latency = await self.__inject(fault)
+                recovery = await self.__recover(args.recovery_timeout)
+
+                result = {
+                    "cycle": cycle,
+                    "fault": fault,
+                    "recovery_s": recovery,
+                    "latency_ms": latency,
+                    "slow_latency_ms": slow_latency,
+                    **self.__state(),
+                }
+                if cycle + 1 == args.warmup_cycles:
+                    self.baseline = result
+                    self.snapshot = tracemalloc.take_snapshot()
+                elif (
+                    self.snapshot is not None
+                    and args.top > 0
+                    and (cycle + 1) % args.snapshot_interval == 0
+                ):
+                    result["top_allocations"] = top_allocations(
+                        self.snapshot, args.top
+                    )
+
+                self.__check(cycle, result)
+                self.__write(result)
+                if readout.done() or recovery is None:
+                    break
+        finally:
+            readout.cancel()
+            try:
+                await readout
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                self.failures.append(f"readout failed: {e}")
+            await self.proxy.stop()
+            self.mockup.stop()
+
+        return not self.failures
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Soak the readout against the mockup with injected faults"
+    )
+    parser.add_argument(
+        "--signals", "-s", type=int, default=100, help="Number of signals"
+    )
+    parser.add_argument(
+        "--rate",
+        "-r",
+        type=float,
+        default=10.0,
+        help="Update rate of the mockup and sending rate in Hz",
+    )
+    parser.add_argument(
+        "--mode",
+        "-m",
+        choices=[mode.name for mode in Mode],
+        default=Mode.SUBSCRIBE.name,
+        help="Mode of reading the measurements",
+    )
+    parser.add_argument(
+        "--cycles", "-c", type=int, default=1000, help="Number of cycles"
+    )
+    parser.add_argument(
+        "--cycle",
+        type=float,
+        default=5.0,
+        help="Duration of the measurement of a cycle in seconds",
+    )
+    parser.add_argument(
+        "--warmup-cycles",
+        type=int,
+        default=3,
+        help="Cycles before the baseline of the growth is taken",
+    )
+    parser.add_argument(
+        "--delay",
+        type=float,
+        default=0.5,
+        help="Delay of the responses of the mockup in slow cycles in seconds",
+    )
+    parser.add_argument(
+        "--recovery-timeout",
+        type=float,
+        default=60.0,
+        help="Time for the readout to recover from a fault in seconds",
+    )
+    parser.add_argument(
+        "--healthy-duration",
+        type=float,
+        default=1.0,
+        help="Time in seconds after which a connection is resumed without "
+        + "backoff, shortened so faults in consecutive cycles are not "
+        + "delayed by the exponential backoff",
+    )
+    parser.add_argument(
+        "--max-rss-growth",
+        type=float,
+        default=20480,
+        help="Maximum growth of the resident memory in KiB",
+    )
+    parser.add_argument(
+        "--max-traced-growth",
+        type=float,
+        default=10240,
+        help="Maximum growth of the memory traced by tracemalloc in KiB",
+    )
+    parser.add_argument(
+        "--max-fd-growth",
+        type=int,
+        default=8,
+        help="Maximum growth of the open file descriptors",
+    )
+    parser.add_argument(
+        "--max-task-growth",
+        type=int,
+        default=8,
+        help="Maximum growth of the asyncio tasks of the readout",
+    )
+    parser.add_argument(
+        "--max-latency",
+        type=float,
+        default=1000.0,
+        help="Maximum p99 latency of a cycle in milliseconds",
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=10,
+        help="Number of source lines with the largest allocation growth",
+    )
+    parser.add_argument(
+        "--snapshot-interval",
+        type=int,
+        default=10,
+        help="Cycles between the reports of the top allocations",
+    )
+    parser.add_argument(
+        "--traceback",
+        type=int,
+        default=1,
+        help="Number of frames stored by tracemalloc per allocation",
+    )
+    parser.add_argument(
+        "--port", "-p", type=int, default=4860, help="Port of the proxy"
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        help="Append results as JSON lines to a file instead of STDOUT",
+    )
+    parser.add_argument(
+        "--verbose", "-v", action="store_true", help="Show readout logs"
+    )
+
+    args = parser.parse_args()
+    subscription_handler.HEALTHY_DURATION = args.healthy_duration
+
+    if args.output is None:
+        output = sys.stdout
+    else:
+        output = open(args.output, "a", encoding="utf-8")
+    if not args.verbose:
+        # Silence log_msg, which is bound to the original STDERR
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stderr.fileno())
+
+    tracemalloc.start(args.traceback)
+    soak = Soak(args, output)
+    passed = asyncio.run(soak.run())
+
+    output.write(
+        json.dumps(
+            {
+                "passed": passed,
+                "failures": soak.failures,
+                "system": system_info(),
+            }
+        )
+        + "\n"
+    )
+    if output is not sys.stdout:
+        output.close()
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
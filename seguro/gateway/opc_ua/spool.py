@@ -0,0 +1,175 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import mmap
+import os
+import struct
+
+from seguro.gateway.opc_ua.logger import log_msg
+
+
+class Spool:
+    """
+    The Spool is a ring buffer of messages in a memory-mapped file of fixed
+    size.
+
+    Every message is stored with its length in front. Offsets of the oldest
+    message and of the next free byte are kept in a header at the start of the
+    file, so spooled messages survive a restart of the readout. If a message
+    does not fit, the oldest messages are dropped to make room for it.
+    """
+
+    MAGIC = b"SGSP"
+    # Magic, offset of the oldest message, offset of the next message and
+    # number of messages
+    HEADER = struct.Struct("<4s4xQQQ")
+    LENGTH = struct.Struct("<I")
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.dropped = 0
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            resume = os.fstat(fd).st_size == size
+            os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        self.offset = self.HEADER.size
+        self.capacity = size - self.offset
+
+        magic, head, tail, count = self.HEADER.unpack_from(self.map)
+        if resume and magic == self.MAGIC:
+            self.head, self.tail, self.count = head, tail, count
+            if count > 0:
+                log_msg(f"Resuming {count} spooled messages from {path}")
+        else:
+            self.head, self.tail, self.count = 0, 0, 0
+            self.__store()
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def used(self):
+        """
+        Number of bytes occupied by spooled messages.
+        """
+        if self.count == 0:
+            return 0
+        if self.tail > self.head:
+            return self.tail - self.head
+        return self.capacity - self.head + self.tail
+
+    @property
+    def fill(self):
+        """
+        Fraction of the spool occupied by spooled messages.
+        """
+        return self.used / self.capacity
+
+    def __store(self):
+        self.HEADER.pack_into(
+            self.map, 0, self.MAGIC, self.head, self.tail, self.count
+        )
+
+    def __fits(self, length: int):
+        """
+        Offset at which a message of length bytes including its length fits,
+        None if it does not fit without dropping messages.
+        """
+        if self.count == 0:
+            return 0
+        if self.tail > self.head:
+            if self.tail + length <= self.capacity:
+                return self.tail
+            if length <= self.head:
+                return 0
+            return None
+        if self.tail + length <= self.head:
+            return self.tail
+        return None
+
+    def append(self, message: bytes):
+        """Append a message, dropping the oldest messages if necessary.
+
+        Arguments:
+            message {bytes} -- Message to store
+        """
+        length = self.LENGTH.size + len(message)
+        if length > self.capacity:
+            self.dropped += 1
+            return
+
+        pos = self.__fits(length)
+        while pos is None:
+            self.pop()
+            self.dropped += 1
+            pos = self.__fits(length)
+
+        if pos < self.tail and self.tail + self.LENGTH.size <= self.capacity:
+            # Mark the unused end of the data area
+            self.LENGTH.pack_into(self.map, self.offset + self.tail, 0)
+
+        if self.count == 0:
+            self.head = pos
+
+        start = self.offset + pos
+        self.LENGTH.pack_into(self.map, start, len(message))
+        start += self.LENGTH.size
+        stop = start + len(message)
+        self.map[start:stop] = message
+
+        self.tail = pos + length
+        self.count += 1
+        self.__store()
+
+    def __locate(self):
+        """
+        Offset and length of the oldest message, skipping the unused end of
+        the data area.
+        """
+        head = self.head
+        if head + self.LENGTH.size > self.capacity:
+            head = 0
+
+        (length,) = self.LENGTH.unpack_from(self.map, self.offset + head)
+        if length == 0:
+            head = 0
+            (length,) = self.LENGTH.unpack_from(self.map, self.offset)
+        return head, length
+
+    def peek(self):
+        """
+        Oldest spooled message.
+
+        Returns:
+            bytes -- Message, None if the spool is empty
+        """
+        if self.count == 0:
+            return None
+
+        head, length = self.__locate()
+        start = self.offset + head + self.LENGTH.size
+        stop = start + length
+        return self.map[start:stop]
+
+    def pop(self):
+        """
+        Remove the oldest spooled message.
+        """
+        if self.count == 0:
+            return
+
+        head, length = self.__locate()
+        self.count -= 1
+        if self.count == 0:
+            self.head = self.tail = 0
+        else:
+            self.head = head + self.LENGTH.size + length
+        self.__store()
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
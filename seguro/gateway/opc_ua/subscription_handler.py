@@ -1,14 +1,49 @@
 # SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
 # SPDX-License-Identifier: Apache-2.0
 import asyncio
+import importlib.util
+import math
 import time
+from array import array
 
 from enum import Enum
-from asyncua import Client
+from typing import TYPE_CHECKING
+from asyncua import Client, ua
+from asyncua.common.subscription import Subscription
 
+from seguro.gateway.opc_ua.backfill import (
+    BACKFILL_BATCH,
+    BACKFILL_MAX_DURATION,
+    Backfill,
+)
+from seguro.gateway.opc_ua.address_space import (
+    STALE_NODE_ID_CODES,
+    NodeCache,
+    check_data_types,
+    read_operation_limit,
+    resolve_browse_paths,
+    split_batches,
+)
 from seguro.gateway.opc_ua.config_parser import Type, opcua_objects
+from seguro.gateway.opc_ua.failover import Failover
+from seguro.gateway.opc_ua.formats import make_format
+from seguro.gateway.opc_ua.frame import Frame
 from seguro.gateway.opc_ua.publishing_handler import PublishingHandler
+from seguro.gateway.opc_ua.sample_buffer import SampleBuffer, datetime_to_ns
 from seguro.gateway.opc_ua.logger import log_msg
+from seguro.gateway.opc_ua.scheduler import DeadlineScheduler
+from seguro.gateway.opc_ua.session import Session
+from seguro.gateway.opc_ua.shmem import SHMEM_SIZE, SharedMemoryWriter
+from seguro.gateway.opc_ua.telemetry import DeviceTelemetry
+
+if TYPE_CHECKING:
+    from seguro.gateway.opc_ua.recording import Recorder
+
+
+# Duration in seconds after which a connection is considered healthy
+HEALTHY_DURATION = 60
+# Default number of buffered values per measurement in buffered mode
+BUFFER_SIZE = 1024
 
 
 class Mode(Enum):
@@ -36,15 +71,6 @@ def exist_and_true(dct: dict, key: str):
         return False
 
 
-def nodeid_to_string(nodeid):
-    """Convert a nodeid object to string.
-
-    Arguments:
-        nodeid {NodeId} -- Nodeid to convert
-    """
-    return f"ns={nodeid.NamespaceIndex};i={nodeid.Identifier}"
-
-
 def construct_browse_paths(uid: str, measurements: dict):
     """
     Construct browse paths for the measurements of the device.
@@ -189,6 +215,98 @@ def construct_browse_paths(uid: str, measurements: dict):
     return paths
 
 
+def publishing_interval(device: dict):
+    """
+    Publishing interval of the subscription in milliseconds, defaults to the
+    sending rate of the device.
+
+    Arguments:
+        device {dict} -- Device configuration
+    """
+    return device.get("publishing_interval", 1000 / device["sending_rate"])
+
+
+def construct_monitoring_parameters(
+    uid: str, device: dict, browse_paths: dict, signal_params: dict
+):
+    """
+    Construct the monitoring parameters of every browse path from the device
+    defaults and the per-signal overrides. The parameters include the length
+    of the aggregation window and the tolerance of the compression, if
+    configured.
+
+    Arguments:
+        uid {str} -- Unique identifier of the device
+        device {dict} -- Device configuration
+        browse_paths {dict} -- Browse paths of the measurements
+        signal_params {dict} -- Per-signal parameters as
+            {(opc id, opc attribute): parameters}
+
+    Returns:
+        dict -- Monitoring parameters as {measurement: parameters}
+    """
+    sampling_interval = device.get(
+        "sampling_interval", publishing_interval(device)
+    )
+    if device.get("buffered", False):
+        # Keep all samples taken between two publishing cycles
+        queue_size = math.ceil(publishing_interval(device) / sampling_interval)
+    else:
+        queue_size = 1
+
+    defaults = {
+        "sampling_interval": sampling_interval,
+        "queue_size": device.get("queue_size", max(queue_size, 1)),
+        "deadband": device.get("deadband"),
+        "window": device.get("aggregation", {}).get("window"),
+        "tolerance": device.get("compression", {}).get("tolerance"),
+    }
+
+    params = {measurement: defaults for measurement in browse_paths.keys()}
+    for (obj, attr), overrides in signal_params.items():
+        for measurement in construct_browse_paths(uid, {obj: [attr]}):
+            params[measurement] = {**defaults, **overrides}
+
+    return params
+
+
+def make_monitored_item(handle: int, node, params: dict):
+    """
+    Create the request for a monitored item of the value of a node.
+
+    Arguments:
+        handle {int} -- Client handle of the monitored item
+        node {Node} -- Node to monitor
+        params {dict} -- Monitoring parameters
+
+    Returns:
+        ua.MonitoredItemCreateRequest -- Request for the monitored item
+    """
+    mparams = ua.MonitoringParameters()
+    mparams.ClientHandle = handle
+    mparams.SamplingInterval = params["sampling_interval"]
+    mparams.QueueSize = params["queue_size"]
+    mparams.DiscardOldest = True
+
+    if params["deadband"] is not None:
+        mfilter = ua.DataChangeFilter()
+        mfilter.Trigger = ua.DataChangeTrigger.StatusValue
+        mfilter.DeadbandType = (
+            ua.DeadbandType.Percent
+            if params["deadband"]["type"] == "percent"
+            else ua.DeadbandType.Absolute
+        )
+        mfilter.DeadbandValue = params["deadband"]["value"]
+        mparams.Filter = mfilter
+
+    item = ua.MonitoredItemCreateRequest()
+    item.ItemToMonitor.NodeId = node.nodeid
+    item.ItemToMonitor.AttributeId = ua.AttributeIds.Value
+    item.MonitoringMode = ua.MonitoringMode.Reporting
+    item.RequestedParameters = mparams
+    return item
+
+
 async def read_and_print(name, node):
     """
     Read a value from a node and print it.
@@ -201,91 +319,377 @@ async def read_and_print(name, node):
     print(f"{name}: {value}")
 
 
-async def read_and_store(name, node, publishing_handler):
+class BatchedReader:
+    """
+    The BatchedReader reads the values of all nodes with a single Read request,
+    split by the MaxNodesPerRead limit of the server, and stores the results in
+    the frame. The requests are built once and reused for every cycle.
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        nodes: dict,
+        frame,
+        max_nodes: int,
+        telemetry: DeviceTelemetry = None,
+    ):
+        self.client = client
+        self.frame = frame
+        self.telemetry = telemetry
+        self.requests = []
+
+        for batch in split_batches(list(nodes.items()), max_nodes):
+            params = ua.ReadParameters()
+            for _, node in batch:
+                read_value = ua.ReadValueId()
+                read_value.NodeId = node.nodeid
+                read_value.AttributeId = ua.AttributeIds.Value
+                params.NodesToRead.append(read_value)
+
+            slots = [frame.slots[name] for name, _ in batch]
+            self.requests.append((params, slots))
+
+    async def read(self):
+        """
+        Read all nodes and store their values in the frame. The batches are
+        sent concurrently so a cycle costs a single round trip.
+        """
+        results = await asyncio.gather(
+            *[self.client.uaclient.read(params) for params, _ in self.requests]
+        )
+
+        for (_, slots), data_values in zip(self.requests, results):
+            for slot, data_value in zip(slots, data_values):
+                data_value.StatusCode.check()
+                self.frame.set(slot, data_value.Value.Value)
+
+        if self.telemetry is not None:
+            self.telemetry.reads.inc(len(self.frame))
+            self.telemetry.received()
+
+
+async def resolve_nodes(
+    session: Session, device: dict, browse_paths: dict, cache=None
+):
+    """
+    Resolve the nodes of all measurements and check that they hold numeric
+    values.
+
+    Arguments:
+        session {Session} -- Connected session
+        device {dict} -- Device configuration
+        browse_paths {dict} -- Browse paths of the measurements
+        cache {NodeCache} -- Cache of resolved NodeIds, optional
+
+    Returns:
+        dict -- Nodes as {measurement: Node}
     """
-    Read a value from a node and store it in the publishing handler.
+    client = session.client
+
+    resolved = await resolve_browse_paths(
+        client,
+        session.url,
+        device["uid"],
+        browse_paths,
+        cache,
+        device.get("discover", False),
+    )
+    nodes = {
+        measurement: client.get_node(node_id)
+        for measurement, node_id in resolved.items()
+    }
+    await check_data_types(client, nodes)
+    return nodes
+
+
+def subscription_parameters(device: dict, keepalive_count: int):
+    """
+    Parameters of the subscription of a device.
 
     Arguments:
-        name {str} -- Name of the node, used as dict key
-        node {Node} -- Node to read from
-        publishing_handler {PublishingHandler} -- Publishing handler to store the value
+        device {dict} -- Device configuration
+        keepalive_count {int} -- Number of publishing intervals without data
+            changes after which the server sends a keepalive
+
+    Returns:
+        ua.CreateSubscriptionParameters -- Parameters of the subscription
     """
-    value = await node.read_value()
-    publishing_handler.values[name] = value
+    params = ua.CreateSubscriptionParameters()
+    params.RequestedPublishingInterval = publishing_interval(device)
+    params.RequestedLifetimeCount = 10000
+    params.RequestedMaxKeepAliveCount = keepalive_count
+    params.MaxNotificationsPerPublish = 10000
+    params.PublishingEnabled = True
+    params.Priority = 0
+    return params
 
 
-async def connect_and_publish(
-    url: str, device: dict, browse_paths: dict, mode: Mode
+def keepalive_parameters(device: dict):
+    """
+    Parameters of a subscription which requests the server to send a
+    keepalive in every publishing interval without data changes, so a stalled
+    server is detected within one interval.
+
+    Arguments:
+        device {dict} -- Device configuration
+
+    Returns:
+        ua.CreateSubscriptionParameters -- Parameters of the subscription
+    """
+    return subscription_parameters(device, 1)
+
+
+async def create_subscription(
+    client: Client, params: ua.CreateSubscriptionParameters, handler
 ):
-    values = dict.fromkeys(browse_paths.keys())
-    pub_handler = PublishingHandler(values)
+    """
+    Create a BatchedSubscription as Client.create_subscription does for a
+    Subscription.
 
-    async with Client(url=url) as client:
-        nodes = {}
-        node_ids = {}
+    Arguments:
+        client {Client} -- Connected client
+        params {ua.CreateSubscriptionParameters} -- Parameters of the
+            subscription
+        handler {SubscriptionHandler} -- Handler of the notifications
 
-        for measurement, browse_path in browse_paths.items():
-            nodes[measurement] = await client.nodes.root.get_child(browse_path)
-            node_ids[nodeid_to_string(nodes[measurement].nodeid)] = measurement
+    Returns:
+        BatchedSubscription -- Created subscription
+    """
+    sub = BatchedSubscription(client.uaclient, params, handler)
+    results = await sub.init()
+    revised = client.get_subscription_revised_params(params, results)
+    if revised:
+        await sub.update(revised)
+    return sub
 
-        if mode == Mode.SUBSCRIBE:
-            log_msg("Reading in subscription mode ...")
 
-            handler = SubscriptionHandler(node_ids, pub_handler)
-            sub = await client.create_subscription(0, handler)
+async def publish_cycle(
+    pub_handler: PublishingHandler,
+    device: dict,
+    buffer: SampleBuffer = None,
+    backfill: Backfill = None,
+):
+    """
+    Emit the received values and wait for the next sending time.
 
-            await asyncio.gather(
-                *[sub.subscribe_data_change(node) for _, node in nodes.items()]
-            )
+    Arguments:
+        pub_handler {PublishingHandler} -- Publishing handler of the device
+        device {dict} -- Device configuration
+        buffer {SampleBuffer} -- Sample buffer in buffered mode, optional
+        backfill {Backfill} -- Backfill of missed values, optional
+    """
+    if buffer is not None:
+        # Emit all values received since the last drain, after the values
+        # missed before
+        if backfill is None or not backfill.running:
+            pub_handler.drain(buffer)
+        await asyncio.sleep(1 / device["sending_rate"])
+        return
+
+    if backfill is not None and backfill.running:
+        # The backfilled samples pass the same format, e.g. an Aggregator,
+        # whose state would be mixed up by interleaved live samples
+        await asyncio.sleep(1 / device["sending_rate"])
+        return
 
-            while True:
-                await client.check_connection()
+    time_delta = pub_handler.send_values(time.time(), device["sending_rate"])
+    # Wait until the next sending time to avoid busy waiting
+    await asyncio.sleep(1 / device["sending_rate"] - time_delta)
+
+
+async def emit_samples(
+    pub_handler: PublishingHandler,
+    device: dict,
+    failover: Failover,
+    buffer: SampleBuffer = None,
+    backfill: Backfill = None,
+):
+    """
+    Emit the values of the sessions to redundant endpoints, independent of
+    their connections, and switch over from a stalled session before.
+    """
+    while True:
+        failover.check()
+        await publish_cycle(pub_handler, device, buffer, backfill)
 
-                time_delta = pub_handler.send_values(
-                    time.time(), device["sending_rate"]
+
+async def connect_and_publish(
+    session: Session,
+    device: dict,
+    browse_paths: dict,
+    mode: Mode,
+    pub_handler: PublishingHandler,
+    monitoring: dict = None,
+    cache: NodeCache = None,
+    buffer: SampleBuffer = None,
+    failover: Failover = None,
+    backfill: Backfill = None,
+    latest: array = None,
+    recorder: "Recorder" = None,
+):
+    telemetry = pub_handler.telemetry
+    with telemetry.phase("connect"):
+        resumed = await session.open()
+    client = session.client
+    frame = pub_handler.frame
+
+    if mode == Mode.SUBSCRIBE:
+        if resumed:
+            log_msg("Resumed subscription ...")
+        else:
+            log_msg(f"Reading {session.url} in subscription mode ...")
+
+            if failover is None and backfill is None:
+                # Do not emit values of a previous session
+                frame.clear()
+            with telemetry.phase("resolve"):
+                nodes = await resolve_nodes(
+                    session, device, browse_paths, cache
                 )
-                # Wait until the next sending time to avoid busy waiting
-                await asyncio.sleep(1 / device["sending_rate"] - time_delta)
 
-        elif mode == Mode.GATHER:
-            log_msg("Reading in gather mode ...")
+            # The client handle of a monitored item indexes its frame slot
+            slots = [frame.slots[measurement] for measurement in nodes]
+            if backfill is not None:
+                backfill.prepare(slots)
+            if recorder is not None:
+                recorder.open(nodes.keys())
 
-            while True:
-                await asyncio.gather(
-                    *[
-                        read_and_store(name, node, pub_handler)
-                        for name, node in nodes.items()
-                    ]
+            index = 0 if failover is None else failover.sessions.index(session)
+            handler = SubscriptionHandler(
+                slots, pub_handler, buffer, failover, index, latest, recorder
+            )
+            items = [
+                make_monitored_item(handle, node, monitoring[measurement])
+                for handle, (measurement, node) in enumerate(nodes.items())
+            ]
+
+            with telemetry.phase("subscribe"):
+                sub = await create_subscription(
+                    client,
+                    (
+                        subscription_parameters(
+                            device,
+                            client.get_keepalive_count(
+                                publishing_interval(device)
+                            ),
+                        )
+                        if failover is None
+                        else keepalive_parameters(device)
+                    ),
+                    handler,
                 )
-                pub_handler.send_values(time.time(), device["sending_rate"])
+                results = await sub.create_monitored_items(items)
+            for measurement, result in zip(nodes.keys(), results):
+                if isinstance(result, ua.StatusCode):
+                    log_msg(f"Failed to monitor {measurement}: {result}")
+                    result.check()
 
+            session.attach(sub)
 
-async def read_measurements(device, opcua_objs, mode: Mode):
-    """Create browse paths, connect to the device and read/publish the measurements at
-    given sample rate.
+            if backfill is not None:
+                with telemetry.phase("backfill"):
+                    await backfill.start(
+                        client,
+                        {
+                            slot: node.nodeid
+                            for slot, node in zip(slots, nodes.values())
+                        },
+                    )
+
+        while True:
+            await client.check_connection()
+
+            if failover is None:
+                await publish_cycle(pub_handler, device, buffer, backfill)
+            else:
+                # The samples of all sessions are emitted by emit_samples
+                await asyncio.sleep(1 / device["sending_rate"])
+
+    elif mode == Mode.GATHER:
+        log_msg("Reading in gather mode ...")
+
+        frame.clear()
+        with telemetry.phase("resolve"):
+            nodes = await resolve_nodes(session, device, browse_paths, cache)
+
+        max_nodes = await read_operation_limit(
+            client,
+            ua.ObjectIds.Server_ServerCapabilities_OperationLimits_MaxNodesPerRead,
+        )
+        reader = BatchedReader(client, nodes, frame, max_nodes, telemetry)
+        log_msg(
+            f"Reading {len(nodes)} nodes in {len(reader.requests)} batches"
+        )
+
+        scheduler = DeadlineScheduler(device["sending_rate"], device["uid"])
+        while True:
+            await scheduler.wait_for_read()
+            with telemetry.phase("read"):
+                await reader.read()
+            await scheduler.wait_for_emit()
+            pub_handler.emit()
+
+
+def endpoint_urls(device: dict):
+    """
+    URLs of the endpoints of a device, starting with the primary endpoint
+    followed by the redundant endpoints.
 
     Arguments:
-        device -- Device configuration
+        device {dict} -- Device configuration
+
+    Returns:
+        list -- URLs of the endpoints
     """
-    uid = device["uid"]
-    uri = device["uri"]
-    port = device["port"]
+    endpoints = [device] + device.get("redundancy", {}).get("endpoints", [])
+    return [
+        f"opc.tcp://{endpoint['uri']}:{endpoint['port']}"
+        for endpoint in endpoints
+    ]
 
-    url = f"opc.tcp://{uri}:{port}"
-    log_msg(f"Connecting to {url} ...")
 
-    browse_paths = construct_browse_paths(uid, opcua_objs)
-    log_msg(f"Browse paths: {browse_paths}")
+async def keep_connected(
+    uid: str, sessions: list, publish, telemetry: DeviceTelemetry
+):
+    """Publish with a session and reconnect it after failures.
 
+    After a connection loss, the session is resumed immediately if the
+    connection was healthy for at least HEALTHY_DURATION seconds. Otherwise
+    the next session is tried, and once all sessions failed, reconnects are
+    delayed by an exponential backoff.
+
+    Arguments:
+        uid {str} -- Unique identifier of the device
+        sessions {list} -- Sessions to the endpoints of the device
+        publish {callable} -- Coroutine function publishing with a session
+        telemetry {DeviceTelemetry} -- Telemetry of the device
+    """
+    index = 0
     backoff_duration = 1
     while True:
+        connected = time.monotonic()
         try:
-            await connect_and_publish(url, device, browse_paths, mode)
+            await publish(sessions[index])
 
         except Exception as e:
-            log_msg(f"Exception in read_measurements: {e}")
+            log_msg(f"Exception in read_measurements of {uid}: {e}")
+            telemetry.reconnects.inc()
+
+            if time.monotonic() - connected > HEALTHY_DURATION:
+                # Resume a previously healthy connection right away
+                backoff_duration = 1
+                log_msg(f"Trying to resume connection to {uid} ...")
+                continue
+
+            index = (index + 1) % len(sessions)
+            if index != 0:
+                log_msg(f"Trying {sessions[index].url} for {uid} ...")
+                continue
+
             log_msg(
-                f"Trying to re-establish connection in {backoff_duration} second..."
+                f"Trying to re-establish connection to {uid} in "
+                + f"{backoff_duration} second..."
             )
 
             await asyncio.sleep(backoff_duration)
@@ -294,20 +698,357 @@ async def read_measurements(device, opcua_objs, mode: Mode):
             )  # Exponential backoff, max 10 minutes
 
 
+def check_numpy(device: dict):
+    """Check that NumPy is installed if a device enables a stage using it.
+
+    Arguments:
+        device {dict} -- Device configuration
+
+    Raises:
+        ValueError -- NumPy is not installed
+    """
+    options = [
+        option
+        for option in ["compression", "aggregation", "record"]
+        if option in device
+    ]
+    if device.get("derive", False):
+        options.append("derive")
+
+    if options and importlib.util.find_spec("numpy") is None:
+        raise ValueError(
+            f"{', '.join(options)} of {device['uid']} requires NumPy, "
+            + "install the stages extra: pip install 'seguro-gateway[stages]'"
+        )
+
+
+async def read_measurements(
+    device, opcua_objs, mode: Mode, output=None, signal_params: dict = None
+):
+    """Create browse paths, connect to the device and read/publish the measurements at
+    given sample rate.
+
+    With redundant endpoints in subscription mode, a session to every
+    endpoint is kept and the Failover selects the session whose values are
+    emitted. In gather mode, the redundant endpoints are tried in order after
+    a connection loss.
+
+    Arguments:
+        device -- Device configuration
+        opcua_objs {dict} -- OPC UA objects and attributes to read
+        mode {Mode} -- Mode of reading the measurements
+        output {Output} -- Output the samples are written to, STDOUT if None
+        signal_params {dict} -- Per-signal monitoring parameters
+    """
+    uid = device["uid"]
+    urls = endpoint_urls(device)
+    log_msg(f"Connecting to {', '.join(urls)} ...")
+
+    browse_paths = construct_browse_paths(uid, opcua_objs)
+    log_msg(f"Browse paths: {browse_paths}")
+
+    monitoring = construct_monitoring_parameters(
+        uid, device, browse_paths, signal_params or {}
+    )
+    cache = NodeCache(device["node_cache"]) if "node_cache" in device else None
+
+    frame = Frame(browse_paths.keys())
+    if "shmem" in device:
+        fmt = SharedMemoryWriter(
+            device["shmem"], device.get("shmem_size", SHMEM_SIZE)
+        )
+    else:
+        # Publish to a broker in the format of the mqtt node by default
+        default_format = device.get("mqtt", {}).get("format", "villas.human")
+        fmt = make_format(device.get("format", default_format))
+    if "aggregation" in device and "compression" in device:
+        raise ValueError("Aggregation and compression cannot be combined")
+    if device.get("derive", False) and (
+        "aggregation" in device or "compression" in device
+    ):
+        raise ValueError(
+            "Derivation cannot be combined with aggregation or compression"
+        )
+    check_numpy(device)
+    # The stages processing samples with NumPy are only imported if enabled
+    if device.get("derive", False):
+        from seguro.gateway.opc_ua.derivation import Derivation
+
+        fmt = Derivation(fmt, frame)
+    if "compression" in device:
+        from seguro.gateway.opc_ua.compression import KEEPALIVE, Compressor
+
+        fmt = Compressor(
+            fmt,
+            frame,
+            [
+                monitoring[measurement]["tolerance"]
+                for measurement in frame.names
+            ],
+            device["compression"]["method"],
+            device["compression"].get("keepalive", KEEPALIVE),
+        )
+    elif "aggregation" in device:
+        from seguro.gateway.opc_ua.aggregation import Aggregator
+
+        fmt = Aggregator(
+            fmt,
+            frame,
+            [monitoring[measurement]["window"] for measurement in frame.names],
+            device["aggregation"].get("percentiles", []),
+        )
+    pub_handler = PublishingHandler(frame, output, fmt)
+    pub_handler.telemetry = DeviceTelemetry(uid, pub_handler.output)
+    sessions = [Session(url) for url in urls]
+
+    buffer = None
+    if mode == Mode.SUBSCRIBE and device.get("buffered", False):
+        buffer = SampleBuffer(
+            len(frame), device.get("buffer_size", BUFFER_SIZE)
+        )
+
+    failover = None
+    if mode == Mode.SUBSCRIBE and len(sessions) > 1:
+        timeout = device["redundancy"].get(
+            "timeout", 1.5 * publishing_interval(device) / 1000
+        )
+        failover = Failover(sessions, timeout, pub_handler.telemetry)
+
+    backfill = None
+    if mode == Mode.SUBSCRIBE and "backfill" in device:
+        backfill = Backfill(
+            pub_handler,
+            array("q", bytes(8 * len(frame))),
+            device["backfill"].get("rate", 10 * device["sending_rate"]),
+            device["backfill"].get("batch", BACKFILL_BATCH),
+            device["backfill"].get("max_duration", BACKFILL_MAX_DURATION),
+            buffer,
+        )
+
+    # Source timestamps of the latest values to drop duplicates and find
+    # missed values
+    latest = None
+    if backfill is not None:
+        latest = backfill.latest
+    elif failover is not None:
+        latest = array("q", bytes(8 * len(frame)))
+
+    recorder = None
+    if mode == Mode.SUBSCRIBE and "record" in device:
+        from seguro.gateway.opc_ua.recording import Recorder
+
+        recorder = Recorder(device["record"])
+
+    async def publish(session: Session):
+        try:
+            await connect_and_publish(
+                session,
+                device,
+                browse_paths,
+                mode,
+                pub_handler,
+                monitoring,
+                cache,
+                buffer,
+                failover,
+                backfill,
+                latest,
+                recorder,
+            )
+        except ua.UaStatusCodeError as e:
+            if cache is not None and e.code in STALE_NODE_ID_CODES:
+                # Resolve the browse paths again on the next connect
+                log_msg(f"Dropping cached NodeIds of {uid}: {e}")
+                cache.drop(uid)
+            raise
+
+    try:
+        if failover is None:
+            await keep_connected(uid, sessions, publish, pub_handler.telemetry)
+        else:
+            # Keep a session with the same subscription to every endpoint
+            await asyncio.gather(
+                emit_samples(pub_handler, device, failover, buffer, backfill),
+                *[
+                    keep_connected(
+                        uid, [session], publish, pub_handler.telemetry
+                    )
+                    for session in sessions
+                ],
+            )
+    finally:
+        pub_handler.telemetry.close()
+        if recorder is not None:
+            recorder.close()
+
+
+class BatchedSubscription(Subscription):
+    """
+    The BatchedSubscription passes whole data change notifications to the
+    datachange_notifications method of its handler, instead of calling
+    datachange_notification once per monitored item as Subscription does.
+
+    Exceptions of the handler are logged, so a failing notification does not
+    prevent the handling of the following ones.
+    """
+
+    def __init__(self, server, params, handler: "SubscriptionHandler"):
+        super().__init__(server, params, handler)
+        self.handler = handler
+
+    async def publish_callback(self, publish_result: ua.PublishResult):
+        """
+        Callback for a publish response of the subscription.
+
+        Arguments:
+            publish_result {ua.PublishResult} -- Result of the publish request
+        """
+        data = publish_result.NotificationMessage.NotificationData
+        for notification in data or []:
+            try:
+                if isinstance(notification, ua.DataChangeNotification):
+                    await self.handler.datachange_notifications(notification)
+                elif isinstance(notification, ua.StatusChangeNotification):
+                    self.handler.status_change_notification(notification)
+                else:
+                    log_msg(
+                        "Unsupported notification of subscription: "
+                        + type(notification).__name__
+                    )
+            except Exception as e:
+                log_msg(f"Exception in subscription handler: {e}")
+
+
 class SubscriptionHandler:
     """
     The SubscriptionHandler is used to handle the data that is received for the
     subscription.
+
+    Notifications are routed by the client handle of their monitored item,
+    which indexes a slot table built when subscribing. This works for NodeIds
+    of any type and does not allocate per notification.
+
+    In buffered mode, every value is stored with its source timestamp in the
+    sample buffer instead of overwriting the latest value in the frame.
+
+    With redundant endpoints, the Failover selects the notifications of the
+    active session. If the source timestamps of the latest values are
+    recorded, for redundant endpoints or a backfill, values which are not
+    newer than the latest value of their slot are dropped as duplicates.
+
+    With a Recorder, the notifications are recorded before their values are
+    stored, for a later replay.
     """
 
-    def __init__(self, node_ids: dict, publish_handler: PublishingHandler):
-        self.node_ids = node_ids
-        self.counter = 0
-        self.values = publish_handler.values
+    def __init__(
+        self,
+        slots: list,
+        publish_handler: PublishingHandler,
+        buffer: SampleBuffer = None,
+        failover: Failover = None,
+        index: int = 0,
+        latest: array = None,
+        recorder: "Recorder" = None,
+    ):
+        self.slots = slots
+        self.frame = publish_handler.frame
+        self.buffer = buffer
+        self.telemetry = publish_handler.telemetry
+        self.failover = failover
+        self.index = index
+        self.latest = latest
+        self.recorder = recorder
+        if failover is not None:
+            failover.handlers[index] = self
 
-    def datachange_notification(self, node, val, data):
+    async def datachange_notifications(
+        self, notification: ua.DataChangeNotification
+    ):
         """
-        Callback for the data change notification. Stores updated values in the
-        values dict.
+        Callback for a data change notification message of the subscription.
+
+        Arguments:
+            notification {ua.DataChangeNotification} -- Notification message
         """
-        self.values[self.node_ids[nodeid_to_string(node.nodeid)]] = val
+        if self.failover is None:
+            self.store(notification)
+            return
+
+        for selected in self.failover.select(self.index, notification):
+            self.store(selected)
+
+    def status_change_notification(self, status: ua.StatusChangeNotification):
+        """
+        Callback for a status change of the subscription, e.g. if the server
+        has closed it after a timeout.
+
+        Arguments:
+            status {ua.StatusChangeNotification} -- Notification message
+        """
+        log_msg(f"Status of subscription changed: {status.Status}")
+
+    def store(self, notification: ua.DataChangeNotification):
+        """
+        Store the updated values of all monitored items of a notification in
+        their slots of the frame or the sample buffer.
+
+        Arguments:
+            notification {ua.DataChangeNotification} -- Notification message
+        """
+        if self.recorder is not None:
+            self.recorder.write(notification)
+
+        slots = self.slots
+        buffer = self.buffer
+        set_value = self.frame.set
+        telemetry = self.telemetry
+        latest = self.latest
+        received_ns = time.time_ns()
+
+        for item in notification.MonitoredItems:
+            data_value = item.Value
+            value = data_value.Value.Value
+            if value is None:
+                # Bad quality values do not carry a value
+                continue
+
+            try:
+                slot = slots[item.ClientHandle]
+            except IndexError:
+                log_msg(
+                    f"Received value for unknown handle {item.ClientHandle}"
+                )
+                continue
+
+            timestamp_ns = received_ns
+            if (
+                buffer is not None
+                or telemetry is not None
+                or latest is not None
+            ):
+                timestamp = (
+                    data_value.SourceTimestamp or data_value.ServerTimestamp
+                )
+                if timestamp is not None:
+                    timestamp_ns = datetime_to_ns(timestamp)
+
+            if latest is not None:
+                if timestamp_ns <= latest[slot]:
+                    if telemetry is not None:
+                        telemetry.duplicates.inc()
+                    continue
+                latest[slot] = timestamp_ns
+
+            if telemetry is not None:
+                telemetry.source_latency.observe(
+                    (received_ns - timestamp_ns) / 1e9
+                )
+
+            if buffer is None:
+                set_value(slot, value)
+            else:
+                buffer.push(slot, timestamp_ns, value)
+
+        if telemetry is not None:
+            telemetry.notifications.inc(len(notification.MonitoredItems))
+            telemetry.received()
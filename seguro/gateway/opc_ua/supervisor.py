@@ -0,0 +1,273 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from multiprocessing.connection import wait
+
+from seguro.gateway.opc_ua.config_parser import read_config
+from seguro.gateway.opc_ua.logger import log_msg
+from seguro.gateway.opc_ua.outputs import open_output
+from seguro.gateway.opc_ua.readout import (
+    load_devices,
+    read_devices,
+    select_nodes,
+)
+
+# Duration in seconds after which a worker is considered healthy
+HEALTHY_DURATION = 60
+# Maximum delay in seconds before restarting a failed worker
+MAX_BACKOFF = 600
+
+
+def shard_nodes(vn_nodes: dict, workers: int):
+    """Split the nodes across workers, balancing the number of signals.
+
+    Arguments:
+        vn_nodes {dict} -- Node configurations as {name: config}
+        workers {int} -- Number of workers
+
+    Returns:
+        list -- Names of the nodes of every worker, without empty shards
+    """
+    shards = [[] for _ in range(workers)]
+    loads = [0] * workers
+
+    # Assign the largest nodes first, each to the least loaded worker
+    for name, node in sorted(
+        vn_nodes.items(),
+        key=lambda item: len(item[1]["in"]["signals"]),
+        reverse=True,
+    ):
+        index = loads.index(min(loads))
+        shards[index].append(name)
+        loads[index] += len(node["in"]["signals"])
+
+    return [shard for shard in shards if shard]
+
+
+def worker_address(address: str, index: int):
+    """Address of the metrics of a worker.
+
+    Arguments:
+        address {str} -- Address given to the supervisor
+        index {int} -- Index of the worker
+
+    Returns:
+        str -- Unix socket path with the index appended, or host:port with
+            the index added to the port
+    """
+    if address is None:
+        return None
+    if "/" in address:
+        return f"{address}.{index}"
+
+    host, _, port = address.rpartition(":")
+    return f"{host}:{int(port) + index}"
+
+
+def install_event_loop(name: str):
+    """Install the event loop implementation of a process.
+
+    Arguments:
+        name {str} -- asyncio or uvloop
+    """
+    if name != "uvloop":
+        return
+
+    try:
+        import uvloop
+    except ImportError:
+        log_msg("uvloop is not installed, using the asyncio event loop")
+        return
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+
+def run_worker(
+    config_path: str, node_names: list, event_loop: str, metrics: str
+):
+    """
+    Process target reading a shard of the nodes on its own event loop.
+    """
+    install_event_loop(event_loop)
+
+    devices = load_devices(config_path, node_names)
+    asyncio.run(
+        read_devices(
+            [(*device, open_output(device[0])) for device in devices],
+            metrics,
+        )
+    )
+
+
+class Worker:
+    """
+    The Worker is a process reading a shard of the nodes. Its devices write
+    to their outputs directly, so every output keeps a single writer and the
+    streams of the devices are not interleaved.
+    """
+
+    def __init__(self, index: int, node_names: list, args):
+        self.index = index
+        self.node_names = node_names
+        self.args = args
+
+        self.process = None
+        self.started = 0.0
+        self.backoff = 1
+        self.restart = None
+
+    def start(self, context):
+        self.process = context.Process(
+            target=run_worker,
+            args=(
+                self.args.config,
+                self.node_names,
+                self.args.event_loop,
+                worker_address(self.args.metrics, self.index),
+            ),
+            name=f"opcua-worker-{self.index}",
+            daemon=True,
+        )
+        self.process.start()
+        self.started = time.monotonic()
+        self.restart = None
+        log_msg(
+            f"Started worker {self.index} (pid {self.process.pid}) "
+            + f"reading {', '.join(self.node_names)}"
+        )
+
+    def failed(self):
+        """
+        Schedule the restart of the exited process. Workers which failed
+        before becoming healthy are restarted with an exponential backoff.
+        """
+        if time.monotonic() - self.started > HEALTHY_DURATION:
+            self.backoff = 1
+
+        log_msg(
+            f"Worker {self.index} exited with {self.process.exitcode}, "
+            + f"restarting in {self.backoff} seconds ..."
+        )
+        self.restart = time.monotonic() + self.backoff
+        self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+
+    def stop(self):
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+
+def supervise(workers: list, context):
+    """Run the workers and restart them when they exit.
+
+    Arguments:
+        workers {list} -- Workers to run
+        context {multiprocessing.context.BaseContext} -- Process context
+    """
+    for worker in workers:
+        worker.start(context)
+
+    while True:
+        running = [worker for worker in workers if worker.restart is None]
+        restarts = [
+            worker.restart for worker in workers if worker.restart is not None
+        ]
+
+        timeout = None
+        if restarts:
+            timeout = max(min(restarts) - time.monotonic(), 0.0)
+
+        exited = wait([worker.process.sentinel for worker in running], timeout)
+        for worker in running:
+            if worker.process.sentinel in exited:
+                worker.process.join()
+                worker.failed()
+
+        now = time.monotonic()
+        for worker in workers:
+            if worker.restart is not None and worker.restart <= now:
+                worker.start(context)
+
+
+def terminate(signum, _frame):
+    raise SystemExit(128 + signum)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Read devices with a pool of worker processes"
+    )
+    parser.add_argument(
+        "--config",
+        "-c",
+        type=str,
+        default=os.environ.get("VILLAS_NODE_CONFIG"),
+        help="Path to the VILLASnode configuration",
+    )
+    parser.add_argument(
+        "--node",
+        "-n",
+        type=str,
+        action="append",
+        help="Name of a node to read, can be given multiple times "
+        + "(default: all nodes with an opcua_config)",
+    )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of worker processes (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--event-loop",
+        "-e",
+        choices=["asyncio", "uvloop"],
+        default="asyncio",
+        help="Event loop of the workers",
+    )
+    parser.add_argument(
+        "--metrics",
+        "-m",
+        type=str,
+        default=os.environ.get("OPCUA_READOUT_METRICS"),
+        help="Serve Prometheus metrics of worker i on port + i of host:port "
+        + "or on a Unix socket path with .i appended",
+    )
+
+    args = parser.parse_args()
+
+    if args.config is None:
+        parser.error("No VILLASnode configuration given")
+
+    # Validate all devices before starting any worker
+    load_devices(args.config, args.node)
+
+    vn_nodes = select_nodes(read_config(args.config), args.node)
+    shards = shard_nodes(vn_nodes, max(args.workers, 1))
+    workers = [
+        Worker(index, node_names, args)
+        for index, node_names in enumerate(shards)
+    ]
+
+    signal.signal(signal.SIGTERM, terminate)
+    context = multiprocessing.get_context("spawn")
+    try:
+        supervise(workers, context)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.stop()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
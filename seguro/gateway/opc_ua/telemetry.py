@@ -0,0 +1,409 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import asyncio
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from seguro.gateway.opc_ua.logger import log_msg
+
+# Upper bounds in seconds of the buckets of all latency histograms
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def format_labels(names: tuple, values: tuple, extra: str = ""):
+    """Format labels in the Prometheus text format.
+
+    Arguments:
+        names {tuple} -- Names of the labels
+        values {tuple} -- Values of the labels
+        extra {str} -- Additional formatted label, e.g. le="0.1"
+
+    Returns:
+        str -- Formatted labels including braces, empty without labels
+    """
+    labels = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Value:
+    """
+    The Value holds a single sample of a counter or gauge.
+    """
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Buckets:
+    """
+    The Buckets hold the observations of a histogram for one set of labels.
+    """
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Metric:
+    """
+    The Metric is a family of values of the same name, one per set of label
+    values.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        self.children = {}
+        registry.append(self)
+
+    def labels(self, *values):
+        """Get the value of a set of label values, creating it if necessary.
+
+        Arguments:
+            values {str} -- Values of the labels
+
+        Returns:
+            Value or Buckets -- Value to update
+        """
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self.make_child()
+        return child
+
+    def make_child(self):
+        return Value()
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for values, child in self.children.items():
+            lines.append(
+                f"{self.name}{format_labels(self.label_names, values)} "
+                + f"{child.value}"
+            )
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS,
+    ):
+        self.buckets = buckets
+        super().__init__(name, documentation, labels)
+
+    def make_child(self):
+        return Buckets(self.buckets)
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for values, child in self.children.items():
+            cumulative = 0
+            bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, child.counts):
+                cumulative += count
+                labels = format_labels(
+                    self.label_names, values, f'le="{bound}"'
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+            labels = format_labels(self.label_names, values)
+            lines.append(f"{self.name}_sum{labels} {child.sum}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+registry = []
+# Telemetry of all devices by uid, used to update the output gauges on a
+# scrape
+devices = {}
+
+NOTIFICATIONS = Counter(
+    "opcua_readout_notifications_total",
+    "Values received with data change notifications",
+    ("device",),
+)
+READS = Counter(
+    "opcua_readout_reads_total",
+    "Values read in gather mode",
+    ("device",),
+)
+EMITTED = Counter(
+    "opcua_readout_samples_emitted_total",
+    "Samples written to the output",
+    ("device",),
+)
+SKIPPED = Counter(
+    "opcua_readout_samples_skipped_total",
+    "Samples not emitted because not all values were received yet",
+    ("device",),
+)
+RECONNECTS = Counter(
+    "opcua_readout_reconnects_total",
+    "Connection losses followed by a reconnect",
+    ("device",),
+)
+FAILOVERS = Counter(
+    "opcua_readout_failovers_total",
+    "Switches to a standby endpoint after the active one stalled",
+    ("device",),
+)
+DUPLICATES = Counter(
+    "opcua_readout_duplicates_total",
+    "Values received from several endpoints and emitted once",
+    ("device",),
+)
+BACKFILLED = Counter(
+    "opcua_readout_samples_backfilled_total",
+    "Samples missed during an outage and read from the history",
+    ("device",),
+)
+SOURCE_LATENCY = Histogram(
+    "opcua_readout_source_latency_seconds",
+    "Delay from the source timestamp to the reception of a value",
+    ("device",),
+)
+EMIT_LATENCY = Histogram(
+    "opcua_readout_emit_latency_seconds",
+    "Delay from the reception of a value to the emission of its sample",
+    ("device",),
+)
+PHASE_DURATION = Histogram(
+    "opcua_readout_phase_duration_seconds",
+    "Duration of the phases of connect_and_publish",
+    ("device", "phase"),
+)
+LOOP_LAG = Histogram(
+    "opcua_readout_event_loop_lag_seconds",
+    "Delay of the event loop in executing a scheduled callback",
+)
+OUTPUT_BACKLOG = Gauge(
+    "opcua_readout_output_backlog",
+    "Samples queued or spooled because the output stalled",
+    ("device",),
+)
+OUTPUT_DROPPED = Gauge(
+    "opcua_readout_output_dropped",
+    "Samples dropped because the output queue or spool overflowed",
+    ("device",),
+)
+SPOOL_FILL = Gauge(
+    "opcua_readout_spool_fill_ratio",
+    "Fraction of the spool occupied by spooled samples",
+    ("device",),
+)
+
+
+class DeviceTelemetry:
+    """
+    The DeviceTelemetry holds the metrics of a single device, resolved once
+    so updating them on the hot path is a plain attribute access.
+    """
+
+    def __init__(self, uid: str, output=None):
+        self.uid = uid
+        self.output = output
+
+        self.notifications = NOTIFICATIONS.labels(uid)
+        self.reads = READS.labels(uid)
+        self.emitted = EMITTED.labels(uid)
+        self.skipped = SKIPPED.labels(uid)
+        self.reconnects = RECONNECTS.labels(uid)
+        self.failovers = FAILOVERS.labels(uid)
+        self.duplicates = DUPLICATES.labels(uid)
+        self.backfilled = BACKFILLED.labels(uid)
+        self.source_latency = SOURCE_LATENCY.labels(uid)
+        self.emit_latency = EMIT_LATENCY.labels(uid)
+
+        # Reception time of the oldest value not emitted yet
+        self.pending = None
+
+        # Replaces the telemetry of a previous reading of the device
+        devices[uid] = self
+
+    def close(self):
+        """
+        Stop updating the gauges of the output once the device is no longer
+        read.
+        """
+        if devices.get(self.uid) is self:
+            del devices[self.uid]
+
+    def received(self):
+        """
+        Record the reception of values.
+        """
+        if self.pending is None:
+            self.pending = time.monotonic()
+
+    def sent(self, samples: int = 1):
+        """Record the emission of samples.
+
+        Arguments:
+            samples {int} -- Number of samples emitted
+        """
+        self.emitted.inc(samples)
+        if self.pending is not None:
+            self.emit_latency.observe(time.monotonic() - self.pending)
+            self.pending = None
+
+    @contextmanager
+    def phase(self, name: str):
+        """Measure the duration of a phase.
+
+        Arguments:
+            name {str} -- Name of the phase, e.g. connect
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            PHASE_DURATION.labels(self.uid, name).observe(
+                time.monotonic() - start
+            )
+
+    def collect(self):
+        """
+        Update the gauges of the output.
+        """
+        output = self.output
+        if output is None or not hasattr(output, "backlog"):
+            return
+
+        dropped = output.dropped
+        OUTPUT_BACKLOG.labels(self.uid).set(output.backlog)
+        if output.spool is not None:
+            dropped += output.spool.dropped
+            SPOOL_FILL.labels(self.uid).set(output.spool.fill)
+        OUTPUT_DROPPED.labels(self.uid).set(dropped)
+
+
+def render_metrics():
+    """
+    Render all metrics in the Prometheus text format.
+
+    Returns:
+        str -- Metrics
+    """
+    for device in devices.values():
+        device.collect()
+
+    lines = []
+    for metric in registry:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+async def monitor_event_loop(interval: float = 0.1):
+    """Measure the lag of the event loop.
+
+    Arguments:
+        interval {float} -- Interval of the measurements in seconds
+    """
+    lag = LOOP_LAG.labels()
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        lag.observe(max(time.monotonic() - start - interval, 0.0))
+
+
+async def handle_request(reader, writer):
+    """
+    Answer a HTTP request with the metrics.
+    """
+    try:
+        request = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+
+        parts = request.split()
+        if len(parts) >= 2 and parts[0] == b"GET" and parts[1] == b"/metrics":
+            status = "200 OK"
+            body = render_metrics().encode()
+        else:
+            status = "404 Not Found"
+            body = b""
+
+        writer.write(
+            (
+                f"HTTP/1.1 {status}\r\n"
+                + "Content-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\n"
+                + "Connection: close\r\n\r\n"
+            ).encode()
+            + body
+        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_metrics(address: str):
+    """Serve the metrics over HTTP and measure the event loop lag.
+
+    Arguments:
+        address {str} -- Path of a Unix socket if it contains a slash,
+            otherwise host:port of a TCP socket
+    """
+    if "/" in address:
+        server = await asyncio.start_unix_server(handle_request, address)
+    else:
+        host, _, port = address.rpartition(":")
+        server = await asyncio.start_server(
+            handle_request, host or "127.0.0.1", int(port)
+        )
+
+    log_msg(f"Serving metrics on {address}")
+    async with server:
+        await asyncio.gather(server.serve_forever(), monitor_event_loop())
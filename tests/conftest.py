@@ -0,0 +1,51 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import pytest
+
+from seguro.gateway.opc_ua.frame import Frame
+
+
+class CaptureFormat:
+    """
+    The CaptureFormat records the samples written by a stage in place of the
+    format of a PublishingHandler.
+    """
+
+    def __init__(self):
+        self.names = None
+        # Samples as (timestamp in nanoseconds, values)
+        self.samples = []
+
+    def write(self, _output, timestamp_ns: int, frame: Frame):
+        self.names = frame.names
+        self.samples.append((timestamp_ns, list(frame.values)))
+
+    def by_name(self):
+        """
+        Samples as (timestamp in nanoseconds, {name: value}).
+        """
+        return [
+            (timestamp_ns, dict(zip(self.names, values)))
+            for timestamp_ns, values in self.samples
+        ]
+
+
+@pytest.fixture
+def capture():
+    return CaptureFormat()
+
+
+@pytest.fixture
+def feed():
+    """
+    Write samples of (timestamp in nanoseconds, values of all slots) to a
+    stage, e.g. a Compressor.
+    """
+
+    def feed(stage, frame: Frame, samples: list):
+        for timestamp_ns, values in samples:
+            for slot, value in enumerate(values):
+                frame.set(slot, value)
+            stage.write(None, timestamp_ns, frame)
+
+    return feed
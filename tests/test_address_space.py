@@ -0,0 +1,22 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+from asyncua import ua
+
+from seguro.gateway.opc_ua.address_space import NodeCache
+
+
+def test_node_cache_drop(tmp_path):
+    cache = NodeCache(str(tmp_path / "nodes.json"))
+    node_ids = {"md1/U1/ULNComplexRe/Momentary": ua.NodeId(1, 2)}
+    cache.put("md1", "key", node_ids)
+    cache.put("md1#signals", "key", {"0:Objects,2:U1": ua.NodeId(1, 2)})
+    cache.put("md2", "key", node_ids)
+
+    assert cache.get("md1", "key") == node_ids
+    assert cache.get("md1", "other") is None
+
+    cache.drop("md1")
+    assert cache.get("md1", "key") is None
+    assert cache.get("md1#signals", "key") is None
+    # Other devices are kept
+    assert cache.get("md2", "key") == node_ids
@@ -0,0 +1,111 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import numpy as np
+import pytest
+
+from seguro.gateway.opc_ua.aggregation import WINDOW_CAPACITY, Aggregator
+from seguro.gateway.opc_ua.frame import Frame
+
+SECOND = 1_000_000_000
+# An arbitrary time which is not aligned to the windows of the tests
+START = 1_700_000_000 * SECOND + 300_000_000
+
+
+def test_epoch_aligned_windows(capture, feed):
+    frame = Frame(["a"])
+    aggregator = Aggregator(capture, frame, [1.0])
+
+    # A sample every 250 ms, starting 300 ms into a second
+    feed(
+        aggregator,
+        frame,
+        [(START + i * SECOND // 4, [float(i)]) for i in range(7)],
+    )
+
+    # The first window ends at the next full second after START
+    window_end = (START // SECOND + 1) * SECOND
+    assert [timestamp for timestamp, _ in capture.samples] == [window_end]
+    _, values = capture.by_name()[0]
+    # Samples 0, 1 and 2 fall into the first window
+    assert values["a/mean"] == pytest.approx(1.0)
+    assert values["a/min"] == 0.0
+    assert values["a/max"] == 2.0
+    assert values["a/rms"] == pytest.approx(np.sqrt(5 / 3))
+    assert values["a/std"] == pytest.approx(np.std([0.0, 1.0, 2.0]))
+
+
+def test_sample_on_boundary_opens_window(capture, feed):
+    frame = Frame(["a"])
+    aggregator = Aggregator(capture, frame, [1.0])
+    boundary = (START // SECOND + 1) * SECOND
+
+    feed(
+        aggregator,
+        frame,
+        [(boundary - 1, [1.0]), (boundary, [5.0]), (boundary + SECOND, [0.0])],
+    )
+
+    assert [timestamp for timestamp, _ in capture.samples] == [
+        boundary,
+        boundary + SECOND,
+    ]
+    assert capture.by_name()[0][1]["a/max"] == 1.0
+    assert capture.by_name()[1][1]["a/mean"] == 5.0
+
+
+def test_written_once_every_window_closed(capture, feed):
+    frame = Frame(["fast", "slow"])
+    aggregator = Aggregator(capture, frame, [1.0, 2.0])
+    first = START // (2 * SECOND) * 2 * SECOND
+
+    feed(
+        aggregator,
+        frame,
+        [(first + i * SECOND // 2, [float(i), -float(i)]) for i in range(9)],
+    )
+
+    # The fast window is closed after a second, but the first sample is
+    # written once the slow window is closed after two seconds, stamped with
+    # the end of the latest closed window
+    assert [timestamp for timestamp, _ in capture.samples] == [
+        first + 2 * SECOND,
+        first + 3 * SECOND,
+        first + 4 * SECOND,
+    ]
+    _, values = capture.by_name()[0]
+    assert values["fast/mean"] == pytest.approx(2.5)
+    assert values["slow/mean"] == pytest.approx(-1.5)
+    # The slow statistics are kept until its window is closed again
+    assert capture.by_name()[1][1]["slow/mean"] == pytest.approx(-1.5)
+
+
+def test_percentiles_and_growth(capture, feed):
+    frame = Frame(["a"])
+    aggregator = Aggregator(capture, frame, [10.0], [50, 90])
+    first = START // (10 * SECOND) * 10 * SECOND
+    count = 3 * WINDOW_CAPACITY
+
+    feed(
+        aggregator,
+        frame,
+        [(first + i, [float(i)]) for i in range(count)]
+        + [(first + 10 * SECOND, [0.0])],
+    )
+
+    ((_, values),) = capture.by_name()
+    expected = np.arange(count, dtype=float)
+    assert values["a/p50"] == pytest.approx(np.percentile(expected, 50))
+    assert values["a/p90"] == pytest.approx(np.percentile(expected, 90))
+    assert values["a/max"] == count - 1
+
+
+def test_complex_columns(capture):
+    frame = Frame(["u/Re", "u/Im"])
+    aggregator = Aggregator(capture, frame, [1.0, 1.0])
+
+    assert aggregator.frame.names[:4] == [
+        "u/Re/mean",
+        "u/Im/mean",
+        "u/Re/min",
+        "u/Im/min",
+    ]
@@ -0,0 +1,230 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import asyncio
+import time
+from array import array
+from types import SimpleNamespace
+
+import pytest
+from asyncua import ua
+
+from seguro.gateway.opc_ua.backfill import Backfill
+from seguro.gateway.opc_ua.frame import Frame
+from seguro.gateway.opc_ua.sample_buffer import ns_to_datetime
+
+SECOND = 1_000_000_000
+# Start of the outage, a minute ago at microsecond resolution
+START = (time.time_ns() - 60 * SECOND) // 1000 * 1000
+
+
+class HistoryClient:
+    """
+    Client of a server with the history of every node as
+    {NodeId: [(timestamp_ns, value)]}, returning continuation points after
+    NumValuesPerNode values.
+    """
+
+    def __init__(self, history: dict, max_nodes: int = 0):
+        self.history = history
+        self.max_nodes = max_nodes
+        self.requests = []
+        self.released = []
+        self.blocked = None
+        self.uaclient = self
+
+    def get_node(self, node_id):
+        if node_id == ua.ObjectIds.Server_ServerStatus_CurrentTime:
+            value = ns_to_datetime(time.time_ns())
+        else:
+            value = self.max_nodes
+
+        async def read_value():
+            return value
+
+        return SimpleNamespace(read_value=read_value)
+
+    async def history_read(self, params: ua.HistoryReadParameters):
+        if params.ReleaseContinuationPoints:
+            self.released += [
+                (read.NodeId, read.ContinuationPoint)
+                for read in params.NodesToRead
+            ]
+            return []
+
+        self.requests.append(params)
+        if self.blocked is not None and len(self.requests) > 1:
+            await self.blocked.wait()
+
+        details = params.HistoryReadDetails
+        results = []
+        for read in params.NodesToRead:
+            history = self.history.get(read.NodeId)
+            if history is None:
+                results.append(
+                    ua.HistoryReadResult(
+                        StatusCode_=ua.StatusCode(
+                            ua.StatusCodes.BadHistoryOperationUnsupported
+                        )
+                    )
+                )
+                continue
+
+            offset = int(read.ContinuationPoint or 0)
+            values = [
+                (timestamp_ns, value)
+                for timestamp_ns, value in history
+                if details.StartTime
+                <= ns_to_datetime(timestamp_ns)
+                <= details.EndTime
+            ]
+            stop = offset + details.NumValuesPerNode
+            result = ua.HistoryReadResult()
+            result.HistoryData = ua.HistoryData(
+                DataValues=[
+                    ua.DataValue(
+                        ua.Variant(value, ua.VariantType.Double),
+                        SourceTimestamp=ns_to_datetime(timestamp_ns),
+                    )
+                    for timestamp_ns, value in values[offset:stop]
+                ]
+            )
+            if stop < len(values):
+                result.ContinuationPoint = str(stop).encode()
+            results.append(result)
+        return results
+
+
+def make_backfill(capture, names: list, values: list, **kwargs):
+    frame = Frame(names)
+    for slot, value in enumerate(values):
+        frame.set(slot, value)
+    pub_handler = SimpleNamespace(
+        frame=frame, format=capture, output=None, telemetry=None
+    )
+    latest = array("q", [START] * len(names))
+    return Backfill(pub_handler, latest, 1e6, **kwargs)
+
+
+def node_ids(count: int):
+    return {slot: ua.NodeId(slot + 1, 2) for slot in range(count)}
+
+
+def test_merge_by_timestamp(capture):
+    nodes = node_ids(2)
+    client = HistoryClient(
+        {
+            nodes[0]: [
+                (START, -1.0),
+                (START + 1 * SECOND, 1.0),
+                (START + 3 * SECOND, 3.0),
+                (START + 4 * SECOND, 4.0),
+                (START + 5 * SECOND, 5.0),
+            ],
+            nodes[1]: [
+                (START + 2 * SECOND, 20.0),
+                (START + 3 * SECOND, 30.0),
+            ],
+        },
+        max_nodes=1,
+    )
+    backfill = make_backfill(capture, ["a", "b"], [0.0, 10.0], batch=2)
+
+    async def run():
+        backfill.prepare([0, 1])
+        await backfill.start(client, nodes)
+        await backfill.task
+
+    asyncio.run(run())
+
+    # The value at the start of the outage has been received before, later
+    # samples start from the values of the frame before the outage
+    assert capture.samples == [
+        (START + 1 * SECOND, [1.0, 10.0]),
+        (START + 2 * SECOND, [1.0, 20.0]),
+        (START + 3 * SECOND, [3.0, 30.0]),
+        (START + 4 * SECOND, [4.0, 30.0]),
+        (START + 5 * SECOND, [5.0, 30.0]),
+    ]
+    # Every request reads one node, continuing with continuation points
+    assert all(len(params.NodesToRead) == 1 for params in client.requests)
+    assert any(
+        read.ContinuationPoint
+        for params in client.requests
+        for read in params.NodesToRead
+    )
+    assert not backfill.running
+
+
+def test_failed_node(capture):
+    nodes = node_ids(2)
+    client = HistoryClient({nodes[0]: [(START + SECOND, 1.0)]})
+    backfill = make_backfill(capture, ["a", "b"], [0.0, 10.0])
+
+    async def run():
+        backfill.prepare([0, 1])
+        await backfill.start(client, nodes)
+        await backfill.task
+
+    asyncio.run(run())
+
+    # The node without history keeps the value before the outage
+    assert capture.samples == [(START + SECOND, [1.0, 10.0])]
+
+
+def test_nothing_missed(capture):
+    client = HistoryClient({})
+    backfill = make_backfill(capture, ["a"], [0.0])
+    backfill.latest[0] = 0
+
+    async def run():
+        # Slots without values have not been read before
+        backfill.prepare([0])
+        await backfill.start(client, node_ids(1))
+
+    asyncio.run(run())
+    assert backfill.task is None
+    assert client.requests == []
+
+
+def test_max_duration(capture):
+    nodes = node_ids(1)
+    client = HistoryClient({nodes[0]: []})
+    backfill = make_backfill(capture, ["a"], [0.0], max_duration=10.0)
+
+    async def run():
+        backfill.prepare([0])
+        await backfill.start(client, nodes)
+        await backfill.task
+
+    started = time.time_ns()
+    asyncio.run(run())
+    (params,) = client.requests
+    start = params.HistoryReadDetails.StartTime
+    assert start >= ns_to_datetime(started - 10 * SECOND)
+
+
+def test_cancel_releases_continuation_points(capture):
+    nodes = node_ids(2)
+    client = HistoryClient(
+        {
+            node_id: [(START + i * SECOND, float(i)) for i in range(1, 10)]
+            for node_id in nodes.values()
+        }
+    )
+    client.blocked = asyncio.Event()
+    backfill = make_backfill(capture, ["a", "b"], [0.0, 0.0], batch=2)
+
+    async def run():
+        backfill.prepare([0, 1])
+        await backfill.start(client, nodes)
+        while len(client.requests) < 2:
+            await asyncio.sleep(0.01)
+
+        # A reconnect cancels the running backfill
+        task = backfill.task
+        backfill.prepare([0, 1])
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert client.released == [(nodes[0], b"2"), (nodes[1], b"2")]
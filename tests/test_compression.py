@@ -0,0 +1,132 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import numpy as np
+import pytest
+
+from seguro.gateway.opc_ua.compression import Compressor
+from seguro.gateway.opc_ua.frame import Frame
+
+SECOND = 1_000_000_000
+
+
+@pytest.fixture
+def compress(capture, feed):
+    """
+    Compress samples of (timestamp in nanoseconds, values) and return the
+    Compressor and the emitted samples.
+    """
+
+    def compress(samples: list, tolerances: list, **kwargs):
+        frame = Frame([f"s{slot}" for slot in range(len(tolerances))])
+        compressor = Compressor(capture, frame, tolerances, **kwargs)
+        feed(compressor, frame, samples)
+        return compressor, capture.samples
+
+    return compress
+
+
+def test_deadband_boundary(compress):
+    compressor, emitted = compress(
+        [
+            (0, [1.0]),
+            # Exactly at the tolerance
+            (1, [1.5]),
+            (2, [0.5]),
+            # Beyond the tolerance
+            (3, [1.75]),
+        ],
+        [0.5],
+    )
+
+    assert emitted == [(0, [1.0]), (3, [1.75])]
+    assert compressor.received == 4
+    assert compressor.emitted == 2
+
+
+def test_deadband_drift(compress):
+    # Every change is within the tolerance, but the drift from the last
+    # emitted value is not
+    _, emitted = compress(
+        [(i, [0.2 * i]) for i in range(6)],
+        [0.5],
+    )
+
+    assert [timestamp for timestamp, _ in emitted] == [0, 3]
+
+
+def test_deadband_any_slot(compress):
+    _, emitted = compress(
+        [(0, [0.0, 0.0]), (1, [0.1, 0.0]), (2, [0.2, 2.0])],
+        [0.5, 1.0],
+    )
+
+    # A sample holds all slots, so the suppressed change of the first slot
+    # is emitted with the second one
+    assert emitted == [(0, [0.0, 0.0]), (2, [0.2, 2.0])]
+
+
+def test_keepalive(compress):
+    _, emitted = compress(
+        [(i * SECOND, [0.0]) for i in range(6)],
+        [0.5],
+        keepalive=2.0,
+    )
+
+    assert [timestamp for timestamp, _ in emitted] == [
+        0,
+        2 * SECOND,
+        4 * SECOND,
+    ]
+
+
+def test_timestamp_going_back(compress):
+    _, emitted = compress(
+        [(10, [0.0]), (11, [0.0]), (5, [0.0])],
+        [0.5],
+    )
+
+    assert [timestamp for timestamp, _ in emitted] == [10, 5]
+
+
+def test_swinging_door_line(compress):
+    # The values of a line are reconstructed by interpolation, only the
+    # first sample is emitted
+    _, emitted = compress(
+        [(i * SECOND, [2.0 * i, -1.0 * i]) for i in range(10)],
+        [0.1, 0.1],
+        method="swinging_door",
+    )
+
+    assert emitted == [(0, [0.0, 0.0])]
+
+
+def test_swinging_door_kink(compress):
+    samples = [(i * SECOND, [float(i)]) for i in range(5)]
+    samples += [((4 + i) * SECOND, [4.0 - i]) for i in range(1, 4)]
+    _, emitted = compress(samples, [0.1], method="swinging_door")
+
+    # The door closes with the first sample after the kink, so the sample
+    # at the kink is emitted, delayed by one
+    assert emitted == [(0, [0.0]), (4 * SECOND, [4.0])]
+
+
+def test_swinging_door_tolerance(compress):
+    rng = np.random.default_rng(1)
+    timestamps = np.arange(500) * SECOND // 10
+    values = np.sin(timestamps / SECOND) + rng.normal(scale=0.02, size=500)
+    tolerance = 0.1
+
+    _, emitted = compress(
+        [(int(t), [v]) for t, v in zip(timestamps, values)],
+        [tolerance],
+        method="swinging_door",
+    )
+    assert len(emitted) < len(values) // 5
+
+    # Interpolation between the emitted samples reconstructs every value up
+    # to the last emitted one within the tolerance
+    archived, archived_values = zip(*emitted)
+    archived_values = [value for value, in archived_values]
+    covered = timestamps <= archived[-1]
+    reconstructed = np.interp(timestamps[covered], archived, archived_values)
+    assert np.all(np.abs(reconstructed - values[covered]) <= tolerance + 1e-9)
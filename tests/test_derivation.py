@@ -0,0 +1,140 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import cmath
+
+import pytest
+
+from seguro.gateway.opc_ua.derivation import Derivation
+from seguro.gateway.opc_ua.frame import Frame
+
+# Rotation by 120 degrees
+ROTATION = cmath.rect(1.0, cmath.pi * 2 / 3)
+
+
+@pytest.fixture
+def derive(capture, feed):
+    """
+    Derive the quantities of a sample of complex values, given by measurement
+    and value type, and return the values of the derived sample by name.
+    """
+
+    def derive(phasors: dict):
+        names = []
+        for measurement, value_type in phasors:
+            names += [
+                f"md1/{measurement}/{value_type}{part}/Momentary"
+                for part in ("Re", "Im")
+            ]
+        frame = Frame(names)
+        values = []
+        for value in phasors.values():
+            values += [value.real, value.imag]
+        feed(Derivation(capture, frame), frame, [(1, values)])
+
+        ((_, derived),) = capture.by_name()
+        return derived
+
+    return derive
+
+
+def voltages(positive: complex, negative: complex = 0, zero: complex = 0):
+    return {
+        (f"U{phase}", "ULNComplex"): (
+            zero
+            + positive * ROTATION**-phase * ROTATION
+            + negative * ROTATION**phase * ROTATION**-1
+        )
+        for phase in (1, 2, 3)
+    }
+
+
+def test_balanced(derive):
+    values = derive(voltages(230.0))
+
+    assert values["md1/U/Positive/Momentary"] == pytest.approx(230.0)
+    assert values["md1/U/Negative/Momentary"] == pytest.approx(0, abs=1e-9)
+    assert values["md1/U/Zero/Momentary"] == pytest.approx(0, abs=1e-9)
+    assert values["md1/U/Unbalance/Momentary"] == pytest.approx(0, abs=1e-9)
+    assert values["md1/U/ZeroUnbalance/Momentary"] == pytest.approx(
+        0, abs=1e-9
+    )
+
+
+def test_unbalanced(derive):
+    values = derive(voltages(230.0, negative=23.0, zero=4.6j))
+
+    assert values["md1/U/Positive/Momentary"] == pytest.approx(230.0)
+    assert values["md1/U/Negative/Momentary"] == pytest.approx(23.0)
+    assert values["md1/U/Zero/Momentary"] == pytest.approx(4.6)
+    assert values["md1/U/Unbalance/Momentary"] == pytest.approx(10.0)
+    assert values["md1/U/ZeroUnbalance/Momentary"] == pytest.approx(2.0)
+
+
+def test_negative_sequence_only(derive):
+    values = derive(voltages(0, negative=230.0))
+
+    assert values["md1/U/Positive/Momentary"] == pytest.approx(0, abs=1e-9)
+    assert values["md1/U/Negative/Momentary"] == pytest.approx(230.0)
+
+
+def test_no_voltage(derive):
+    values = derive(voltages(0))
+
+    # Without a positive sequence the unbalance is not defined
+    assert values["md1/U/Positive/Momentary"] == 0.0
+    assert values["md1/U/Unbalance/Momentary"] == 0.0
+    assert values["md1/U/ZeroUnbalance/Momentary"] == 0.0
+
+
+def test_incomplete_phases(derive):
+    phasors = voltages(230.0)
+    del phasors[("U3", "ULNComplex")]
+    values = derive(phasors)
+
+    assert "md1/U/Positive/Momentary" not in values
+
+
+def test_magnitude_and_phase(derive):
+    values = derive({("IG1_I1", "IComplex"): complex(-3.0, 4.0)})
+
+    assert values["md1/IG1_I1/Magnitude/Momentary"] == pytest.approx(5.0)
+    assert values["md1/IG1_I1/Phase/Momentary"] == pytest.approx(
+        126.86989764584402
+    )
+
+
+def test_power_from_voltage_and_current(derive):
+    values = derive(
+        {
+            ("U1", "ULNComplex"): cmath.rect(230.0, 0.0),
+            ("IG1_I1", "IComplex"): cmath.rect(10.0, -cmath.pi / 3),
+        }
+    )
+
+    name = "md1/IG1_I1_Power/{}/Momentary"
+    assert values[name.format("S")] == pytest.approx(2300.0)
+    assert values[name.format("PF")] == pytest.approx(0.5)
+
+
+def test_measured_power(derive):
+    values = derive(
+        {
+            ("U1", "ULNComplex"): 230.0,
+            ("IG1_I1", "IComplex"): 10.0,
+            ("IG1_I1_Power", "PowerComplex"): complex(-600.0, 800.0),
+        }
+    )
+
+    # The measured power takes precedence over U * conj(I), and is not
+    # treated as a phasor
+    name = "md1/IG1_I1_Power/{}/Momentary"
+    assert values[name.format("S")] == pytest.approx(1000.0)
+    assert values[name.format("PF")] == pytest.approx(-0.6)
+    assert name.format("Magnitude") not in values
+    assert list(values).count(name.format("S")) == 1
+
+
+def test_zero_power_factor(derive):
+    values = derive({("IG1_I1_Power", "PowerComplex"): 0j})
+
+    assert values["md1/IG1_I1_Power/PF/Momentary"] == 0.0
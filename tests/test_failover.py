@@ -0,0 +1,137 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+from types import SimpleNamespace
+
+import pytest
+
+from seguro.gateway.opc_ua import failover as failover_module
+from seguro.gateway.opc_ua.failover import Failover
+
+TIMEOUT = 1.0
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class StoringHandler:
+    def __init__(self):
+        self.stored = []
+
+    def store(self, notification):
+        self.stored.append(notification)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(failover_module.time, "monotonic", clock)
+    return clock
+
+
+def make_failover(clock: Clock, count: int = 2):
+    sessions = [
+        SimpleNamespace(url=f"opc.tcp://endpoint{i}", last_publish=clock.now)
+        for i in range(count)
+    ]
+    return Failover(sessions, TIMEOUT), sessions
+
+
+def test_select_active(clock):
+    failover, _ = make_failover(clock)
+
+    assert failover.select(0, "a") == ["a"]
+    # Standby notifications are held while the active session responds
+    assert failover.select(1, "b") == []
+    assert failover.active == 0
+
+
+def test_select_switches_with_held(clock):
+    failover, sessions = make_failover(clock)
+    failover.select(1, "a")
+    clock.now += 0.5
+    sessions[1].last_publish = clock.now
+    failover.select(1, "b")
+
+    clock.now += 0.6
+    sessions[1].last_publish = clock.now
+    # The active session has not responded for 1.1 seconds, the held
+    # notifications are emitted in order
+    assert failover.select(1, "c") == ["a", "b", "c"]
+    assert failover.active == 1
+    assert failover.select(0, "d") == []
+    assert failover.select(1, "e") == ["e"]
+
+
+def test_select_drops_expired(clock):
+    failover, sessions = make_failover(clock)
+    failover.select(1, "a")
+    clock.now += 2 * TIMEOUT + 0.1
+    sessions[1].last_publish = clock.now
+
+    # Notifications are held for two timeouts only
+    assert failover.select(1, "b") == ["b"]
+
+
+def test_select_without_response(clock):
+    failover, sessions = make_failover(clock)
+    sessions[0].last_publish = float("-inf")
+
+    assert failover.select(1, "a") == ["a"]
+    assert failover.active == 1
+
+
+def test_check(clock):
+    failover, sessions = make_failover(clock, 3)
+    handlers = [StoringHandler() for _ in sessions]
+    failover.handlers = handlers
+    failover.select(1, "a")
+    failover.select(2, "b")
+    clock.now += 0.5
+    failover.select(2, "c")
+
+    # The active session still responds
+    clock.now += 0.4
+    sessions[1].last_publish = clock.now
+    sessions[2].last_publish = clock.now - 0.1
+    failover.check()
+    assert failover.active == 0
+
+    # Switch to the standby session with the latest publish response and
+    # store its held notifications which did not expire
+    clock.now += 1.2
+    sessions[1].last_publish = clock.now - 0.2
+    sessions[2].last_publish = clock.now - 0.1
+    failover.check()
+    assert failover.active == 2
+    assert handlers[2].stored == ["c"]
+    assert not failover.held[2]
+    assert handlers[1].stored == []
+
+
+def test_check_requires_subscription(clock):
+    failover, sessions = make_failover(clock)
+    clock.now += 2.0
+    sessions[1].last_publish = clock.now
+
+    # The standby session has no subscription yet
+    failover.check()
+    assert failover.active == 0
+
+    failover.handlers[1] = StoringHandler()
+    failover.check()
+    assert failover.active == 1
+
+
+def test_check_stale_standby(clock):
+    failover, sessions = make_failover(clock)
+    failover.handlers = [StoringHandler() for _ in sessions]
+    clock.now += 2.0
+
+    # All sessions stalled, so the active one is kept
+    failover.check()
+    assert failover.active == 0
@@ -0,0 +1,31 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import pytest
+
+from seguro.gateway.opc_ua.mockup import Waveform
+
+RANGES = [(0.0, 1.0), (227.0, 235.0), (49.9, 50.1)]
+
+
+@pytest.mark.parametrize("kind", Waveform.kinds)
+def test_values_depend_on_tick(kind):
+    waveform = Waveform(kind, RANGES, rate=10.0, seed=3)
+    values = [waveform.values(tick) for tick in range(20)]
+
+    # Another generator skipping ticks yields the same values
+    other = Waveform(kind, RANGES, rate=10.0, seed=3)
+    assert [other.values(tick) for tick in reversed(range(20))] == list(
+        reversed(values)
+    )
+
+    for tick_values in values:
+        for value, (low, high) in zip(tick_values, RANGES):
+            assert low <= value <= high
+
+
+def test_random_seed():
+    first = Waveform("random", RANGES, rate=10.0, seed=1)
+    second = Waveform("random", RANGES, rate=10.0, seed=2)
+
+    assert first.values(5) != second.values(5)
+    assert first.values(5) != first.values(6)
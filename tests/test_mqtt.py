@@ -0,0 +1,256 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import asyncio
+import struct
+
+from seguro.gateway.opc_ua.mqtt import (
+    CONNACK,
+    CONNECT,
+    PINGREQ,
+    PUBACK,
+    PUBLISH,
+    MqttOutput,
+)
+
+TOPIC = "data/measurements/loc1/md1/mp1"
+
+
+class Broker:
+    """
+    Minimal MQTT 3.1.1 broker recording the packets it receives. PUBLISH
+    packets of QoS 1 are only acknowledged while ack is set.
+    """
+
+    def __init__(self):
+        self.packets = asyncio.Queue()
+        self.ack = True
+        self.writers = []
+        self.handlers = []
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.__handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    def node(self, **settings):
+        return {
+            "host": "127.0.0.1",
+            "port": self.port,
+            "out": {"publish": TOPIC},
+            **settings,
+        }
+
+    async def __handle(self, reader, writer):
+        self.writers.append(writer)
+        self.handlers.append(asyncio.current_task())
+        try:
+            while True:
+                header = await reader.readexactly(1)
+                length, shift = 0, 0
+                while True:
+                    (byte,) = await reader.readexactly(1)
+                    length |= (byte & 0x7F) << shift
+                    shift += 7
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(length)
+                packet = parse(header[0], body)
+                await self.packets.put(packet)
+
+                if packet["type"] == CONNECT:
+                    writer.write(bytes([CONNACK, 2, 0, 0]))
+                elif packet["type"] == PUBLISH and packet["qos"] and self.ack:
+                    writer.write(
+                        bytes([PUBACK, 2]) + struct.pack(">H", packet["id"])
+                    )
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+    def puback(self, packet_id: int):
+        for writer in self.writers:
+            writer.write(bytes([PUBACK, 2]) + struct.pack(">H", packet_id))
+
+    def disconnect(self):
+        for writer in self.writers:
+            writer.close()
+        self.writers = []
+
+    async def next(self, packet_type: int, timeout: float = 5.0):
+        while True:
+            packet = await asyncio.wait_for(self.packets.get(), timeout)
+            if packet["type"] == packet_type:
+                return packet
+
+    async def stop(self):
+        self.disconnect()
+        self.server.close()
+        await self.server.wait_closed()
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+
+
+def parse(header: int, body: bytes):
+    packet = {"type": header & 0xF0, "flags": header & 0x0F, "body": body}
+
+    if packet["type"] == PUBLISH:
+        (length,) = struct.unpack_from(">H", body)
+        offset = 2 + length
+        packet["topic"] = body[2:offset].decode()
+        packet["qos"] = header >> 1 & 0x03
+        packet["dup"] = bool(header & 0x08)
+        if packet["qos"]:
+            (packet["id"],) = struct.unpack_from(">H", body, offset)
+            offset += 2
+        packet["payload"] = body[offset:]
+    return packet
+
+
+def run(test):
+    async def main():
+        broker = Broker()
+        await broker.start()
+        try:
+            await test(broker)
+        finally:
+            await broker.stop()
+
+    asyncio.run(main())
+
+
+def test_connect():
+    async def test(broker):
+        output = MqttOutput(
+            broker.node(keepalive=30, username="user", password="secret"),
+            "md1",
+        )
+        output.send(b"a")
+
+        connect = await broker.next(CONNECT)
+        body = connect["body"]
+        # Protocol name, level 4, username, password and clean session flags,
+        # keepalive
+        assert body[:10] == b"\x00\x04MQTT\x04\xc2\x00\x1e"
+        assert body[10:] == b"\x00\x03md1\x00\x04user\x00\x06secret"
+        output.task.cancel()
+
+    run(test)
+
+
+def test_batch():
+    async def test(broker):
+        output = MqttOutput(broker.node(retain=True), "md1", batch=3)
+        for sample in [b"a", b"bb", b"c"]:
+            output.send(sample[:1], sample[1:])
+
+        packet = await broker.next(PUBLISH)
+        assert packet["topic"] == TOPIC
+        assert packet["qos"] == 1
+        # Retain flag
+        assert packet["flags"] & 0x01
+        assert not packet["dup"]
+        assert packet["payload"] == b"abbc"
+        output.task.cancel()
+
+    run(test)
+
+
+def test_linger():
+    async def test(broker):
+        output = MqttOutput(broker.node(qos=0), "md1", linger=0.05)
+        # Longer than 127 bytes, so the remaining length takes two bytes
+        output.send(b"x" * 300)
+
+        packet = await broker.next(PUBLISH)
+        assert packet["qos"] == 0
+        assert "id" not in packet
+        assert packet["payload"] == b"x" * 300
+        assert output.backlog == 0
+        output.task.cancel()
+
+    run(test)
+
+
+def test_inflight_limit():
+    async def test(broker):
+        output = MqttOutput(broker.node(), "md1", batch=1, inflight=2)
+        broker.ack = False
+        for sample in [b"a", b"b", b"c", b"d"]:
+            output.send(sample)
+
+        first = await broker.next(PUBLISH)
+        await broker.next(PUBLISH)
+        await asyncio.sleep(0.2)
+        assert broker.packets.empty()
+        assert len(output.inflight) == 2
+        assert output.backlog == 4
+
+        # Every acknowledgement lets one more message be published
+        broker.puback(first["id"])
+        third = await broker.next(PUBLISH)
+        assert third["payload"] == b"c"
+        await asyncio.sleep(0.2)
+        assert broker.packets.empty()
+        assert output.backlog == 3
+        output.task.cancel()
+
+    run(test)
+
+
+def test_keepalive():
+    async def test(broker):
+        output = MqttOutput(broker.node(keepalive=1), "md1")
+        output.send(b"a")
+        output.flush()
+
+        await broker.next(PUBLISH)
+        # A ping is sent after half of the keepalive without messages
+        await broker.next(PINGREQ, timeout=2.0)
+        output.task.cancel()
+
+    run(test)
+
+
+def test_queue_while_unreachable():
+    async def test(broker):
+        node = broker.node()
+        await broker.stop()
+        output = MqttOutput(node, "md1", batch=1, queue_size=2)
+        for sample in [b"a", b"b", b"c", b"d"]:
+            output.send(sample)
+
+        # The oldest messages are dropped
+        assert list(output.queue) == [b"c", b"d"]
+        assert output.dropped == 2
+        output.task.cancel()
+
+    run(test)
+
+
+def test_resend_in_publish_order():
+    async def test(broker):
+        output = MqttOutput(broker.node(), "md1", batch=1)
+        # The packet ids wrap around after the first message
+        output.packet_id = 0xFFFE
+        broker.ack = False
+        for sample in [b"a", b"b", b"c"]:
+            output.send(sample)
+
+        published = [await broker.next(PUBLISH) for _ in range(3)]
+        assert [packet["id"] for packet in published] == [0xFFFF, 1, 2]
+
+        # The messages are published again after a reconnect
+        broker.ack = True
+        broker.disconnect()
+        resent = [await broker.next(PUBLISH) for _ in range(3)]
+        assert [packet["payload"] for packet in resent] == [b"a", b"b", b"c"]
+        assert [packet["id"] for packet in resent] == [0xFFFF, 1, 2]
+        assert all(packet["dup"] for packet in resent)
+
+        for _ in range(50):
+            if not output.inflight:
+                break
+            await asyncio.sleep(0.02)
+        assert output.backlog == 0
+        output.task.cancel()
+
+    run(test)
@@ -0,0 +1,38 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import os
+import sys
+
+import pytest
+
+from seguro.gateway.opc_ua.outputs import StreamOutput
+
+
+@pytest.fixture
+def pipe():
+    read_fd, write_fd = os.pipe()
+    stream = os.fdopen(write_fd, "wb")
+    yield stream
+    stream.close()
+    os.close(read_fd)
+
+
+def test_pipe_non_blocking(pipe, monkeypatch, tmp_path):
+    monkeypatch.setattr(sys, "stderr", open(tmp_path / "stderr", "w"))
+
+    output = StreamOutput(pipe)
+
+    assert not os.get_blocking(output.fileno())
+    sys.stderr.close()
+
+
+def test_pipe_shared_with_stderr(pipe, monkeypatch):
+    # STDERR writes to the same pipe through another descriptor
+    stderr = os.fdopen(os.dup(pipe.fileno()), "w")
+    monkeypatch.setattr(sys, "stderr", stderr)
+
+    output = StreamOutput(pipe)
+
+    assert os.get_blocking(output.fileno())
+    assert os.get_blocking(stderr.fileno())
+    stderr.close()
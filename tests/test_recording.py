@@ -0,0 +1,162 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import asyncio
+import math
+import os
+
+import pytest
+from asyncua import ua
+
+from seguro.gateway.opc_ua.formats import make_format
+from seguro.gateway.opc_ua.recording import Recorder, Recording
+from seguro.gateway.opc_ua.replay import DiscardOutput, Replay
+from seguro.gateway.opc_ua.sample_buffer import ns_to_datetime
+
+SECOND = 1_000_000_000
+START = 1_700_000_000 * SECOND
+NAMES = ["md1/U1/ULNComplexRe/Momentary", "md1/U1/ULNComplexIm/Momentary"]
+
+
+def make_notification(items: list):
+    """Create a notification of (client handle, value, source timestamp)."""
+    notification = ua.DataChangeNotification()
+    for handle, value, timestamp_ns in items:
+        notification.MonitoredItems.append(
+            ua.MonitoredItemNotification(
+                ClientHandle=handle,
+                Value=ua.DataValue(
+                    ua.Variant(value),
+                    SourceTimestamp=(
+                        ns_to_datetime(timestamp_ns) if timestamp_ns else None
+                    ),
+                ),
+            )
+        )
+    return notification
+
+
+def items(notification: ua.DataChangeNotification):
+    return [
+        (
+            item.ClientHandle,
+            item.Value.Value.Value,
+            item.Value.SourceTimestamp,
+        )
+        for item in notification.MonitoredItems
+    ]
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "notifications.rec")
+    recorder = Recorder(path)
+    recorder.open(NAMES)
+    recorder.write(make_notification([(0, 1.5, START), (1, 2, START)]))
+    # Non-numeric values and missing timestamps
+    recorder.write(make_notification([(1, "text", 0)]))
+    recorder.close()
+
+    recording = Recording(path)
+    assert recording.names == NAMES
+    assert len(recording) == 3
+
+    (first_received, first), (last_received, last) = recording.notifications()
+    assert items(first) == [
+        (0, 1.5, ns_to_datetime(START)),
+        (1, 2.0, ns_to_datetime(START)),
+    ]
+    assert items(last) == [(1, None, None)]
+    assert first_received < last_received
+    assert math.isnan(recording.records["value"][2])
+
+
+def test_batch(tmp_path):
+    path = str(tmp_path / "notifications.rec")
+    recorder = Recorder(path)
+    recorder.open(NAMES)
+    recorder.write(make_notification([(0, 1.0, START)]))
+
+    # Records are written in batches
+    assert len(Recording(path)) == 0
+    recorder.flush()
+    assert len(Recording(path)) == 1
+    recorder.close()
+
+
+def test_continue(tmp_path):
+    path = str(tmp_path / "notifications.rec")
+    recorder = Recorder(path)
+    recorder.open(NAMES)
+    recorder.write(make_notification([(0, 1.0, START)]))
+    recorder.close()
+    # A record written partially before a crash
+    with open(path, "ab") as file:
+        file.write(b"\x01\x02\x03")
+
+    recorder = Recorder(path)
+    recorder.open(NAMES)
+    recorder.write(make_notification([(0, 2.0, START + SECOND)]))
+    recorder.close()
+
+    recording = Recording(path)
+    assert recording.records["value"].tolist() == [1.0, 2.0]
+    assert not os.path.exists(f"{path}.1")
+
+
+def test_rotate(tmp_path):
+    path = str(tmp_path / "notifications.rec")
+    for names, value in [(NAMES, 1.0), (NAMES[:1], 2.0), (NAMES, 3.0)]:
+        recorder = Recorder(path)
+        recorder.open(names)
+        recorder.write(make_notification([(0, value, START)]))
+        recorder.close()
+
+    # Recordings of other signals are kept with numeric suffixes
+    assert Recording(f"{path}.1").records["value"].tolist() == [1.0]
+    assert Recording(f"{path}.2").records["value"].tolist() == [2.0]
+    recording = Recording(path)
+    assert recording.names == NAMES
+    assert recording.records["value"].tolist() == [3.0]
+
+
+def test_reopen_other_signals(tmp_path):
+    path = str(tmp_path / "notifications.rec")
+    recorder = Recorder(path)
+    recorder.open(NAMES)
+    recorder.write(make_notification([(0, 1.0, START)]))
+    # The subscription is created again for other signals
+    recorder.open(NAMES[:1])
+    recorder.close()
+
+    assert Recording(f"{path}.1").records["value"].tolist() == [1.0]
+    assert len(Recording(path)) == 0
+
+
+def test_not_a_recording(tmp_path):
+    path = tmp_path / "other"
+    path.write_bytes(bytes(128))
+
+    with pytest.raises(ValueError):
+        Recording(str(path))
+
+
+def test_replay(tmp_path):
+    path = str(tmp_path / "notifications.rec")
+    recorder = Recorder(path)
+    recorder.open(NAMES)
+    for i in range(5):
+        recorder.write(
+            make_notification(
+                [(0, float(i), START + i), (1, -float(i), START + i)]
+            )
+        )
+    recorder.write(make_notification([(0, "text", 0)]))
+    recorder.close()
+
+    output = DiscardOutput()
+    replay = Replay(Recording(path), 10, output, make_format("villas.human"))
+    results = asyncio.run(replay.run(speed=0))
+
+    assert results["notifications"] == 6
+    assert results["values"] == 11
+    # The notifications are received within one sending period
+    assert results["samples"] == output.samples == 1
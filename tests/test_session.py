@@ -0,0 +1,174 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import asyncio
+import socket
+
+import pytest
+from asyncua import Server
+from asyncua.client.ua_client import UaClient
+
+from seguro.gateway.opc_ua.mockup import MockupServer
+from seguro.gateway.opc_ua.session import Session
+
+
+class Handler:
+    def __init__(self):
+        self.values = []
+
+    def datachange_notification(self, _node, value, _data):
+        self.values.append(value)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def start_server(sessions=None):
+    url = f"opc.tcp://127.0.0.1:{free_port()}/"
+    server = Server() if sessions is None else MockupServer(sessions)
+    await server.init()
+    server.set_endpoint(url)
+    namespace = await server.register_namespace("test")
+    variable = await server.nodes.objects.add_variable(namespace, "value", 0.0)
+    await server.start()
+    return server, url, variable
+
+
+async def subscribe(session: Session, variable):
+    handler = Handler()
+    subscription = await session.client.create_subscription(50, handler)
+    session.attach(subscription)
+    await subscription.subscribe_data_change(
+        session.client.get_node(variable.nodeid)
+    )
+    return subscription, handler
+
+
+async def wait_for(handler: Handler, value: float):
+    for _ in range(50):
+        if value in handler.values:
+            return
+        await asyncio.sleep(0.05)
+    raise TimeoutError(f"{value} not received: {handler.values}")
+
+
+def record_sequences(session: Session, subscription):
+    """
+    Record the sequence numbers of the notification messages received or
+    recovered for a subscription attached to the session.
+    """
+    sequences = []
+    callbacks = session.client.uaclient._subscription_callbacks
+    track = callbacks[subscription.subscription_id]
+
+    async def record(result):
+        message = result.NotificationMessage
+        if message.NotificationData:
+            sequences.append(message.SequenceNumber)
+        await track(result)
+
+    callbacks[subscription.subscription_id] = record
+    return sequences
+
+
+async def lose_connection(session: Session, variable, values: list):
+    """
+    Lose the connection without closing the session and write values in the
+    meantime.
+    """
+    session.client.uaclient.protocol.transport.close()
+    for value in values:
+        await variable.write_value(value)
+        await asyncio.sleep(0.1)
+
+
+@pytest.mark.parametrize("sessions", ["keep", "orphan"])
+def test_resume(sessions):
+    """
+    The mockup keeps the session of a lost connection to be reactivated, or
+    its subscription to be transferred to a new session. Notifications sent
+    on the lost connection are recovered with Republish.
+    """
+
+    async def run():
+        server, url, variable = await start_server(sessions)
+        session = Session(url)
+        try:
+            assert not await session.open()
+            subscription, handler = await subscribe(session, variable)
+            sequences = record_sequences(session, subscription)
+            await variable.write_value(1.0)
+            await wait_for(handler, 1.0)
+
+            await lose_connection(session, variable, [2.0, 3.0])
+
+            assert await session.open()
+            assert session.subscription is subscription
+            await variable.write_value(4.0)
+            await wait_for(handler, 4.0)
+
+            assert handler.values == [0.0, 1.0, 2.0, 3.0, 4.0]
+            assert sequences == list(
+                range(sequences[0], sequences[0] + len(sequences))
+            )
+        finally:
+            await session.close()
+            await server.stop()
+
+    asyncio.run(run())
+
+
+def test_transfer_fallback():
+    """
+    The asyncua server drops the session of a lost connection and does not
+    support TransferSubscriptions, so a resume falls back to a new session
+    without the subscription.
+    """
+
+    async def run():
+        server, url, variable = await start_server()
+        session = Session(url)
+        try:
+            assert not await session.open()
+            subscription, handler = await subscribe(session, variable)
+            await variable.write_value(1.0)
+            await wait_for(handler, 1.0)
+            assert session.last_sequence is not None
+
+            # Lose the connection without closing the session
+            session.client.uaclient.protocol.transport.close()
+            await asyncio.sleep(0.1)
+
+            assert not await session.open()
+            assert session.subscription is None
+            assert session.last_sequence is None
+            callbacks = session.client.uaclient._subscription_callbacks
+            assert subscription.subscription_id not in callbacks
+
+            # The new session is usable for a new subscription
+            _, handler = await subscribe(session, variable)
+            await variable.write_value(2.0)
+            await wait_for(handler, 2.0)
+        finally:
+            await session.close()
+            await server.stop()
+
+    asyncio.run(run())
+
+
+def test_check_asyncua(monkeypatch):
+    monkeypatch.delattr(UaClient, "_publish_loop")
+
+    async def run():
+        server, url, _ = await start_server()
+        session = Session(url)
+        try:
+            with pytest.raises(RuntimeError, match="_publish_loop"):
+                await session.open()
+            assert session.client is None
+        finally:
+            await server.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,108 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import pytest
+
+from seguro.gateway.opc_ua.frame import Frame
+from seguro.gateway.opc_ua.shmem import (
+    SLOT_HEADER,
+    SharedMemoryReader,
+    SharedMemoryWriter,
+)
+
+
+def write(writer: SharedMemoryWriter, frame: Frame, samples: range):
+    for i in samples:
+        frame.set(0, float(i))
+        frame.set(1, -float(i))
+        writer.write(None, 1000 + i, frame)
+
+
+def slot_offset(writer: SharedMemoryWriter, sequence: int):
+    return writer.data + sequence % writer.size * writer.slot_size
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "ring")
+    frame = Frame(["a", "b"])
+    writer = SharedMemoryWriter(path, 8)
+    write(writer, frame, range(3))
+
+    reader = SharedMemoryReader(path)
+    assert reader.names == ["a", "b"]
+    samples = reader.read()
+    assert [
+        (sequence, timestamp_ns, list(values))
+        for sequence, timestamp_ns, values in samples
+    ] == [
+        (0, 1000, [0.0, -0.0]),
+        (1, 1001, [1.0, -1.0]),
+        (2, 1002, [2.0, -2.0]),
+    ]
+    assert reader.read() == []
+
+    write(writer, frame, range(3, 4))
+    ((sequence, _, _),) = reader.read()
+    assert sequence == 3
+    assert reader.lost == 0
+
+
+def test_overwritten(tmp_path):
+    path = str(tmp_path / "ring")
+    frame = Frame(["a", "b"])
+    writer = SharedMemoryWriter(path, 4)
+    write(writer, frame, range(1))
+    reader = SharedMemoryReader(path)
+    assert reader.valid(0)
+
+    # The writer overtakes the reader, only the latest samples are kept
+    write(writer, frame, range(1, 10))
+    assert not reader.valid(0)
+    samples = reader.read()
+    assert [sequence for sequence, _, _ in samples] == [6, 7, 8, 9]
+    assert reader.lost == 6
+
+
+def test_torn_sample(tmp_path):
+    path = str(tmp_path / "ring")
+    frame = Frame(["a", "b"])
+    writer = SharedMemoryWriter(path, 8)
+    write(writer, frame, range(3))
+    reader = SharedMemoryReader(path)
+
+    # A value of the second sample changed, e.g. by a concurrent write whose
+    # stores became visible out of order
+    offset = slot_offset(writer, 1) + SLOT_HEADER.size
+    writer.map[offset] ^= 0xFF
+    # The third sample is being written
+    SLOT_HEADER.pack_into(writer.map, slot_offset(writer, 2), 0, 1002, 0)
+
+    samples = reader.read()
+    assert [sequence for sequence, _, _ in samples] == [0]
+    assert reader.lost == 2
+
+
+def test_resume(tmp_path):
+    path = str(tmp_path / "ring")
+    write(SharedMemoryWriter(path, 8), Frame(["a", "b"]), range(3))
+    reader = SharedMemoryReader(path)
+    reader.read()
+
+    # A restarted writer with the same layout continues the sequence
+    write(SharedMemoryWriter(path, 8), Frame(["a", "b"]), range(3, 5))
+    samples = reader.read()
+    assert [sequence for sequence, _, _ in samples] == [3, 4]
+
+
+def test_layout_change(tmp_path):
+    path = str(tmp_path / "ring")
+    write(SharedMemoryWriter(path, 8), Frame(["a", "b"]), range(3))
+    reader = SharedMemoryReader(path)
+
+    write(SharedMemoryWriter(path, 8), Frame(["a", "c"]), range(1))
+    with pytest.raises(ValueError):
+        reader.read()
+
+    # The ring starts again with the new layout
+    reader = SharedMemoryReader(path)
+    assert reader.names == ["a", "c"]
+    assert [sequence for sequence, _, _ in reader.read()] == [0]
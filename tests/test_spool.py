@@ -0,0 +1,109 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+from seguro.gateway.opc_ua.spool import Spool
+
+# Size of a spool with 64 bytes of data area
+SIZE = Spool.HEADER.size + 64
+
+
+def drain(spool: Spool):
+    messages = []
+    while len(spool) > 0:
+        messages.append(bytes(spool.peek()))
+        spool.pop()
+    return messages
+
+
+def test_order(tmp_path):
+    spool = Spool(str(tmp_path / "spool"), SIZE)
+    for message in [b"a", b"bb", b"ccc"]:
+        spool.append(message)
+
+    assert len(spool) == 3
+    assert spool.used == 3 * Spool.LENGTH.size + 6
+    assert drain(spool) == [b"a", b"bb", b"ccc"]
+    assert spool.peek() is None
+    assert spool.used == 0
+
+
+def test_wrap_around_with_marker(tmp_path):
+    spool = Spool(str(tmp_path / "spool"), SIZE)
+    # 24 bytes per message including its length
+    spool.append(b"1" * 20)
+    spool.append(b"2" * 20)
+    spool.pop()
+
+    # Does not fit behind the second message, so it wraps around and the
+    # rest of the data area is marked as unused with a length of 0
+    spool.append(b"3" * 20)
+    assert spool.tail == 24
+    (marker,) = Spool.LENGTH.unpack_from(spool.map, spool.offset + 48)
+    assert marker == 0
+
+    assert spool.dropped == 0
+    assert drain(spool) == [b"2" * 20, b"3" * 20]
+
+
+def test_wrap_around_at_end(tmp_path):
+    spool = Spool(str(tmp_path / "spool"), SIZE)
+    # 32 bytes per message, filling the data area exactly
+    spool.append(b"1" * 28)
+    spool.append(b"2" * 28)
+    spool.pop()
+
+    # No room is left for a marker, the head wraps around on its own
+    spool.append(b"3" * 28)
+    assert spool.fill == 1.0
+    assert drain(spool) == [b"2" * 28, b"3" * 28]
+
+
+def test_drop_oldest(tmp_path):
+    spool = Spool(str(tmp_path / "spool"), SIZE)
+    for i in range(5):
+        spool.append(bytes([i]) * 20)
+
+    assert spool.dropped == 3
+    assert drain(spool) == [bytes([3]) * 20, bytes([4]) * 20]
+
+
+def test_drop_oversized(tmp_path):
+    spool = Spool(str(tmp_path / "spool"), SIZE)
+    spool.append(b"a")
+    spool.append(b"x" * 64)
+
+    assert spool.dropped == 1
+    assert drain(spool) == [b"a"]
+
+
+def test_resume_after_reopen(tmp_path):
+    path = str(tmp_path / "spool")
+    spool = Spool(path, SIZE)
+    spool.append(b"1" * 20)
+    spool.append(b"2" * 20)
+    spool.pop()
+    spool.append(b"3" * 20)
+    spool.close()
+
+    # The wrapped-around messages survive a restart
+    spool = Spool(path, SIZE)
+    assert len(spool) == 2
+    assert bytes(spool.peek()) == b"2" * 20
+    spool.pop()
+    spool.append(b"4" * 20)
+    assert drain(spool) == [b"3" * 20, b"4" * 20]
+    spool.close()
+
+    spool = Spool(path, SIZE)
+    assert len(spool) == 0
+    assert spool.peek() is None
+
+
+def test_reset_on_size_change(tmp_path):
+    path = str(tmp_path / "spool")
+    spool = Spool(path, SIZE)
+    spool.append(b"a")
+    spool.close()
+
+    spool = Spool(path, SIZE + 64)
+    assert len(spool) == 0
+    assert spool.capacity == 128
@@ -0,0 +1,57 @@
+# SPDX-FileCopyrightText: 2023 Felix Wege, EONERC-ACS, RWTH Aachen University
+# SPDX-License-Identifier: Apache-2.0
+import asyncio
+import sys
+
+import pytest
+from asyncua import ua
+
+from seguro.gateway.opc_ua.subscription_handler import (
+    BatchedSubscription,
+    check_numpy,
+)
+
+
+class FailingHandler:
+    def __init__(self):
+        self.notifications = []
+        self.status = []
+
+    async def datachange_notifications(self, notification):
+        self.notifications.append(notification)
+        if len(self.notifications) == 1:
+            raise ValueError("failed to store")
+
+    def status_change_notification(self, status):
+        self.status.append(status)
+
+
+def test_batched_subscription_guard():
+    handler = FailingHandler()
+    subscription = BatchedSubscription(
+        None, ua.CreateSubscriptionParameters(), handler
+    )
+    result = ua.PublishResult()
+    result.NotificationMessage.NotificationData = [
+        ua.DataChangeNotification(),
+        ua.DataChangeNotification(),
+        ua.StatusChangeNotification(),
+    ]
+
+    # The exception of the first notification does not prevent the handling
+    # of the following ones
+    asyncio.run(subscription.publish_callback(result))
+    assert len(handler.notifications) == 2
+    assert len(handler.status) == 1
+
+
+def test_check_numpy(monkeypatch):
+    device = {"uid": "md1", "derive": False, "aggregation": {}}
+    check_numpy({"uid": "md1", "derive": False})
+    check_numpy(device)
+
+    # NumPy cannot be imported
+    monkeypatch.setitem(sys.modules, "numpy", None)
+    check_numpy({"uid": "md1", "derive": False})
+    with pytest.raises(ValueError, match="aggregation of md1 requires NumPy"):
+        check_numpy(device)